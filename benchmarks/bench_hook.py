@@ -0,0 +1,283 @@
+"""on_llm_request 钩子与配置加载的微基准（无需安装 AstrBot）
+
+覆盖 10 ~ 100k 个时段的合成作息表，测量以下操作的 ns/op：
+    current_action      RoutineManager._current_action
+    normalize_schedule  _normalize_schedule（整张表）
+    load_config         RoutineManager._load_config_from_runtime（含读盘与解析）
+    hook                完整的 on_llm_request（配置未变化）
+    hook_reload         完整的 on_llm_request（每次调用前都有配置变更），并等待它触发的后台重载完成
+                        （钩子本身不等待重载，此项衡量一次变更的全部开销）
+    hook_reused_request 同一个请求对象反复经过钩子（原位替换已有的注入块）
+
+用法：
+    python benchmarks/bench_hook.py --output bench.json
+    python benchmarks/bench_hook.py --sizes 10,1000 --compare bench.json
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import importlib.util
+from datetime import datetime, timedelta
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+import routine_core  # noqa: E402
+
+WEEK_KEYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+# ==================== AstrBot 桩模块 ====================
+
+class StubEvent:
+    """最小化的 AstrMessageEvent"""
+    def __init__(self, private: bool = False, origin: str = "bench:GroupMessage:10000"):
+        self.unified_msg_origin = origin
+        self._private = private
+
+    def is_private_chat(self) -> bool:
+        return self._private
+
+    def get_group_id(self) -> str:
+        return "" if self._private else self.unified_msg_origin.rsplit(":", 1)[-1]
+
+    def get_sender_id(self) -> str:
+        return "20000"
+
+class StubRequest:
+    """最小化的 ProviderRequest"""
+    def __init__(self, system_prompt: str = ""):
+        self.system_prompt = system_prompt
+
+def _install_astrbot_stubs():
+    """在 sys.modules 中注册 main.py 用到的 astrbot.api 接口"""
+    if "astrbot.api" in sys.modules:
+        return
+
+    def passthrough(*_args, **_kwargs):
+        return lambda f: f
+
+    class _CommandGroup:
+        def __init__(self, fn):
+            self.fn = fn
+
+        def command(self, *_args, **_kwargs):
+            return lambda f: f
+
+    class _Filter:
+        class PermissionType:
+            ADMIN = "admin"
+
+        on_llm_request = staticmethod(passthrough)
+        permission_type = staticmethod(passthrough)
+        command = staticmethod(passthrough)
+
+        @staticmethod
+        def command_group(*_args, **_kwargs):
+            return _CommandGroup
+
+    class _Star:
+        def __init__(self, context):
+            self.context = context
+
+    api = types.ModuleType("astrbot.api")
+    api.logger = logging.getLogger("routine_manager.bench")
+    event = types.ModuleType("astrbot.api.event")
+    event.filter = _Filter
+    event.AstrMessageEvent = StubEvent
+    star = types.ModuleType("astrbot.api.star")
+    star.Context = object
+    star.Star = _Star
+    star.register = passthrough
+    provider = types.ModuleType("astrbot.api.provider")
+    provider.ProviderRequest = StubRequest
+
+    sys.modules["astrbot"] = types.ModuleType("astrbot")
+    sys.modules["astrbot.api"] = api
+    sys.modules["astrbot.api.event"] = event
+    sys.modules["astrbot.api.star"] = star
+    sys.modules["astrbot.api.provider"] = provider
+
+def load_plugin_module():
+    _install_astrbot_stubs()
+    spec = importlib.util.spec_from_file_location(
+        "routine_manager_main", os.path.join(PLUGIN_DIR, "main.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# ==================== 数据生成 ====================
+
+def synthetic_schedule(slots: int, seed: int = 0) -> dict:
+    """生成 slots 个时段的周作息表，时段都在 00:00-24:00 内；一天放不下（按分钟）时改为随机时段，允许重叠"""
+    rng = random.Random(seed)
+    schedule = {k: {} for k in WEEK_KEYS}
+    per_day = -(-slots // len(WEEK_KEYS))
+    step = 1440 // per_day
+    count = 0
+    while count < slots:
+        day = WEEK_KEYS[count % len(WEEK_KEYS)]
+        idx = count // len(WEEK_KEYS)
+        if step:
+            start = idx * step
+            end = start + step
+        else:
+            start = rng.randrange(0, 1439)
+            end = rng.randrange(start + 1, 1441)
+        key = f"{start // 60:02d}:{start % 60:02d}-{end // 60:02d}:{end % 60:02d}"
+        if key in schedule[day]:
+            continue
+        schedule[day][key] = f"行为-{count % 97}"
+        count += 1
+    return schedule
+
+def write_config(path: str, schedule: dict):
+    cfg = {
+        "timezone": "Asia/Shanghai",
+        "inject_scope": "all",
+        "webui_port": 58101,
+        "prompt": {"routine_prompt_template": "现在时间：{now} 当前行为：{action} 请在语气和内容上贴合该场景进行回复。"},
+        "schedule": schedule,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cfg, f, ensure_ascii=False)
+
+# ==================== 计时 ====================
+
+def _measure(run, min_time: float, repeats: int) -> dict:
+    """run(n) 执行 n 次操作并返回耗时（ns）；自动放大 n 直到单轮不少于 min_time，取最优轮"""
+    n = 1
+    while True:
+        elapsed = run(n)
+        if elapsed >= min_time * 1e9 or n >= 1 << 24:
+            break
+        n *= 2 if elapsed <= 0 else max(2, min(10, int(min_time * 1e9 / elapsed) + 1))
+    best = elapsed
+    for _ in range(repeats - 1):
+        best = min(best, run(n))
+    return {"ns_per_op": best / n, "ops": n}
+
+def bench_size(mod, slots: int, min_time: float, repeats: int, workdir: str) -> list:
+    schedule = synthetic_schedule(slots)
+    cfg_path = os.path.join(workdir, f"routine_config_{slots}.json")
+    write_config(cfg_path, schedule)
+
+    plugin = mod.RoutineManager(None, {})
+    plugin._config_file = cfg_path
+    plugin._load_config_from_runtime()
+
+    base = datetime(2025, 1, 6, tzinfo=plugin._now().tzinfo)
+    moments = [base + timedelta(minutes=7 * i) for i in range(1440)]
+    results = []
+
+    def record(name, run):
+        r = _measure(run, min_time, repeats)
+        r.update(benchmark=name, slots=slots)
+        results.append(r)
+        print(f"{name:<20}{slots:>8} slots {r['ns_per_op']:>16,.0f} ns/op", file=sys.stderr)
+
+    def run_current_action(n):
+        current = plugin._current_action
+        t0 = time.perf_counter_ns()
+        for i in range(n):
+            current(moments[i % 1440])
+        return time.perf_counter_ns() - t0
+
+    def run_normalize(n):
+        t0 = time.perf_counter_ns()
+        for _ in range(n):
+            routine_core._normalize_schedule(schedule)
+        return time.perf_counter_ns() - t0
+
+    def run_load(n):
+        t0 = time.perf_counter_ns()
+        for _ in range(n):
+            plugin._load_config_from_runtime()
+        return time.perf_counter_ns() - t0
+
+    def run_hook(reload: bool, reuse: bool = False):
+        async def body(n):
+            event, req = StubEvent(), StubRequest("你是一个助手。")
+            hook = plugin.on_llm_request
+            t0 = time.perf_counter_ns()
+            for _ in range(n):
+                if reload:
+                    plugin._config_version += 1
+                if not reuse:
+                    req.system_prompt = "你是一个助手。"
+                await hook(event, req)
+                if reload and plugin._reload_task is not None:
+                    await plugin._reload_task
+            return time.perf_counter_ns() - t0
+        return lambda n: loop.run_until_complete(body(n))
+
+    loop = asyncio.new_event_loop()
+    try:
+        record("current_action", run_current_action)
+        record("normalize_schedule", run_normalize)
+        record("load_config", run_load)
+        record("hook", run_hook(reload=False))
+        record("hook_reload", run_hook(reload=True))
+        record("hook_reused_request", run_hook(reload=False, reuse=True))
+        loop.run_until_complete(plugin.terminate())
+    finally:
+        loop.close()
+    return results
+
+# ==================== 入口 ====================
+
+def compare(results: list, baseline_path: str):
+    """与历史结果对比，打印耗时比值（>1 表示变慢）"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["benchmark"], r["slots"]): r["ns_per_op"] for r in baseline.get("results", [])}
+    print(f"\n对比基线 {baseline_path}:", file=sys.stderr)
+    for r in results:
+        prev = old.get((r["benchmark"], r["slots"]))
+        if prev:
+            print(f"{r['benchmark']:<20}{r['slots']:>8} slots  x{r['ns_per_op'] / prev:.2f}", file=sys.stderr)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="逗号分隔的时段数量")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每轮最短计时（秒）")
+    parser.add_argument("--repeats", type=int, default=3, help="重复轮数，取最优")
+    parser.add_argument("--output", help="JSON 结果输出路径（缺省输出到 stdout）")
+    parser.add_argument("--compare", help="用于对比的历史 JSON 结果")
+    args = parser.parse_args(argv)
+
+    mod = load_plugin_module()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in (int(x) for x in args.sizes.split(",") if x.strip()):
+            results.extend(bench_size(mod, size, args.min_time, args.repeats, workdir))
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
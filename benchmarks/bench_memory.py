@@ -0,0 +1,130 @@
+"""作息表内存占用基准：对比旧的 RoutineItem 列表与紧凑的 _SlotTable
+
+对每种规模的合成作息表，从 JSON 文本解析配置并编译，丢弃配置字典后
+用 tracemalloc 统计仍被保留的内存（即插件进程加载后的常驻开销）：
+    legacy    每个时段一个 @dataclass RoutineItem（两个 time 对象、raw_range 与未去重的 action）
+              + 以对象引用列表保存的周内区间索引（改动前的实现，保留于本文件用于对比）
+    compact   routine_core._SlotTable（array 存储起止分钟，行为去重表）+ array 版 _WeekIndex
+
+用法：
+    python benchmarks/bench_memory.py
+    python benchmarks/bench_memory.py --sizes 1000,100000 --output mem.json
+"""
+import gc
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, time as dtime
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+import routine_core  # noqa: E402
+from bench_hook import synthetic_schedule  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# ==================== 改动前的表示 ====================
+
+@dataclass
+class LegacyRoutineItem:
+    day: int
+    start: dtime
+    end: dtime
+    action: str
+    raw_range: str
+
+def legacy_normalize(sched_conf) -> list:
+    items = []
+    for day_idx, k in enumerate(routine_core.WEEK_KEYS):
+        for rng, act in (sched_conf.get(k) or {}).items():
+            try:
+                s, e = routine_core._check_range(str(rng))
+            except ValueError:
+                continue
+            items.append(LegacyRoutineItem(day=day_idx, start=s, end=e, action=str(act).strip(), raw_range=str(rng)))
+    return items
+
+def legacy_index(items: list) -> tuple:
+    pieces = []
+    for order, it in enumerate(items):
+        s, e = routine_core._item_span(it)
+        if e <= routine_core._WEEK_MINUTES:
+            pieces.append((s, e, order, it))
+        else:
+            pieces.append((s, routine_core._WEEK_MINUTES, order, it))
+            pieces.append((0, e - routine_core._WEEK_MINUTES, order, it))
+    return routine_core._sweep(pieces, 0, routine_core._WEEK_MINUTES)
+
+def build_legacy(sched_conf):
+    items = legacy_normalize(sched_conf)
+    return items, legacy_index(items)
+
+def build_compact(sched_conf):
+    table = routine_core._compile_schedule(sched_conf)
+    return table, routine_core._WeekIndex(table)
+
+FORMS = {"legacy": build_legacy, "compact": build_compact}
+
+# ==================== 测量 ====================
+
+def measure(build, text: str) -> dict:
+    """解析 JSON 并编译，丢弃配置字典后统计保留的字节数"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        cfg = json.loads(text)
+        store = build(cfg["schedule"])
+        elapsed = time.perf_counter() - t0
+        del cfg
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - base
+    finally:
+        tracemalloc.stop()
+    del store
+    return {"bytes": retained, "build_ms": elapsed * 1000}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="逗号分隔的时段数量")
+    parser.add_argument("--output", help="JSON 结果输出路径（缺省输出到 stdout）")
+    args = parser.parse_args(argv)
+
+    results = []
+    for slots in (int(x) for x in args.sizes.split(",") if x.strip()):
+        text = json.dumps({"schedule": synthetic_schedule(slots)}, ensure_ascii=False)
+        row = {}
+        for form, build in FORMS.items():
+            r = measure(build, text)
+            row[form] = r["bytes"]
+            results.append({"form": form, "slots": slots, "bytes": r["bytes"],
+                            "bytes_per_slot": r["bytes"] / slots, "build_ms": r["build_ms"]})
+            print(f"{form:<10}{slots:>8} slots  {r['bytes'] / 1024:>10,.0f} KiB  "
+                  f"{r['bytes'] / slots:>7,.1f} B/slot  {r['build_ms']:>8,.1f} ms", file=sys.stderr)
+        print(f"{'':<10}{slots:>8} slots  compact / legacy = {row['compact'] / row['legacy']:.2f}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
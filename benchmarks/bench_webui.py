@@ -0,0 +1,365 @@
+"""管理后台（webui.py）并发负载测试：吞吐量、p50/p99 延迟与并发保存后的配置完整性
+
+在独立进程中以临时端口（0）和临时存储启动 webui.run_server，由多个并发客户端
+（各自一条 keep-alive 连接，只用标准库实现的 HTTP/1.1）按比例混合发送：
+    login     POST /login（新会话登录）
+    load      GET  /api/load
+    config    POST /api/config（携带 If-Match；412 修订冲突属于正常结果，单独计数）
+结束后停止服务进程并检查存储：JSON 可解析、修订号等于成功保存次数、最终内容等于
+最后一次成功保存的内容、没有残留的临时文件（SQLite 存储另做 integrity_check）。
+完整性检查失败时以非零状态退出。
+
+用法：
+    python benchmarks/bench_webui.py
+    python benchmarks/bench_webui.py --clients 64 --duration 20 --mix login=1,load=8,config=2
+    python benchmarks/bench_webui.py --keep-alive 30 --backlog 512 --worker-class uvloop --output web.json
+    python benchmarks/bench_webui.py --storage sqlite
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import platform
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime
+from urllib.parse import urlencode
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+from bench_hook import synthetic_schedule  # noqa: E402
+
+LOGIN_KEY = "bench-login-key"
+DEFAULT_MIX = "login=1,load=8,config=1"
+START_TIMEOUT = 15.0
+
+# ==================== 服务进程 ====================
+
+def _serve(cfg: dict):
+    """子进程入口：按文件路径加载 webui.py（与插件的独立进程模式一致）"""
+    import webui
+    webui.run_server(cfg)
+
+def start_server(workdir: str, args) -> tuple:
+    """启动 WebUI 进程，返回 (进程, 端口, 初始修订号, 通知计数)；通知管道由后台线程持续读取，避免写满阻塞服务端"""
+    storage_path = os.path.join(workdir, "routine_config.json")
+    with open(storage_path, "w", encoding="utf-8") as f:
+        json.dump({"timezone": "Asia/Shanghai", "revision": 0, "schedule": synthetic_schedule(args.slots)},
+                  f, ensure_ascii=False)
+    store_path, initial = "", 0
+    if args.storage == "sqlite":
+        from routine_store import open_store
+        store_path = os.path.join(workdir, "routine_config.db")
+        store = open_store(store_path, storage_path)
+        initial = store.revision()
+        store.close()
+
+    parent, child = multiprocessing.Pipe(duplex=True)
+    cfg = {
+        "webui_port": 0,
+        "host": "127.0.0.1",
+        "server_key": LOGIN_KEY,
+        "one_time_key": False,
+        "key_ttl_seconds": 86400,
+        "storage_path": storage_path,
+        "store_path": store_path,
+        "plugin_config": {},
+        "notify_conn": child,
+        "keep_alive_timeout": args.keep_alive,
+        "backlog": args.backlog,
+        "worker_class": args.worker_class,
+    }
+    proc = multiprocessing.Process(target=_serve, args=(cfg,), daemon=True)
+    proc.start()
+    child.close()
+    if not parent.poll(START_TIMEOUT):
+        proc.terminate()
+        raise RuntimeError("WebUI 启动超时")
+    kind, detail = parent.recv()
+    if kind != "ready":
+        proc.terminate()
+        raise RuntimeError(f"WebUI 启动失败：{detail}")
+
+    notified = {"config": 0}
+
+    def drain():
+        while True:
+            try:
+                msg = parent.recv()
+            except (EOFError, OSError):
+                break
+            if msg and msg[0] == "config":
+                notified["config"] += 1
+
+    threading.Thread(target=drain, daemon=True).start()
+    return proc, detail, initial, notified
+
+# ==================== HTTP 客户端 ====================
+
+class _Connection:
+    """最小化的 HTTP/1.1 keep-alive 客户端：一次一个请求，服务端关闭连接时自动重连"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.reader = self.writer = None
+        self.cookie = ""
+
+    async def _connect(self):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers: dict = None) -> tuple:
+        """返回 (状态码, 响应头, 响应体)"""
+        for attempt in (0, 1):
+            if self.writer is None:
+                await self._connect()
+            try:
+                return await self._roundtrip(method, path, body, headers or {})
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                if attempt:
+                    raise
+
+    async def _roundtrip(self, method: str, path: str, body: bytes, headers: dict) -> tuple:
+        lines = [f"{method} {path} HTTP/1.1", f"Host: 127.0.0.1:{self.port}", f"Content-Length: {len(body)}"]
+        if self.cookie:
+            lines.append(f"Cookie: {self.cookie}")
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        resp_headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip().lower(), value.strip()
+            if name == "set-cookie":
+                self.cookie = value.split(";", 1)[0]
+            resp_headers[name] = value
+        if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            data = b"".join(chunks)
+        else:
+            data = await self.reader.readexactly(int(resp_headers.get("content-length", 0)))
+        if resp_headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, resp_headers, data
+
+# ==================== 负载 ====================
+
+class _Stats:
+    __slots__ = ("latencies", "statuses", "errors")
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+def _quantile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+async def _login(conn: _Connection) -> int:
+    conn.cookie = ""
+    status, _, _ = await conn.request(
+        "POST", "/login", urlencode({"key": LOGIN_KEY}).encode(),
+        {"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    return status
+
+async def _client(cid: int, port: int, deadline: float, ops: list, weights: list, schedule: dict,
+                  stats: dict, saves: list, rng: random.Random):
+    conn = _Connection(port)
+    revision = 0
+    try:
+        await _login(conn)
+        n = 0
+        while time.perf_counter() < deadline:
+            op = rng.choices(ops, weights)[0]
+            n += 1
+            t0 = time.perf_counter()
+            try:
+                if op == "login":
+                    status = await _login(conn)
+                elif op == "load":
+                    status, _, data = await conn.request("GET", "/api/load")
+                    if status == 200:
+                        revision = json.loads(data)["data"]["revision"]
+                else:
+                    marker = f"c{cid}-{n}"
+                    body = json.dumps({"schedule": {**schedule, "Mon": {"00:00-00:30": marker}}},
+                                      ensure_ascii=False).encode("utf-8")
+                    status, _, data = await conn.request("POST", "/api/config", body, {
+                        "Content-Type": "application/json", "If-Match": f'"{revision}"',
+                    })
+                    if status in (200, 412):
+                        revision = json.loads(data)["revision"]
+                    if status == 200:
+                        saves.append((revision, marker))
+            except (OSError, asyncio.IncompleteReadError, ValueError, KeyError):
+                stats[op].errors += 1
+                await conn.close()
+                continue
+            st = stats[op]
+            st.latencies.append(time.perf_counter() - t0)
+            st.statuses[status] = st.statuses.get(status, 0) + 1
+            if status >= 500:
+                st.errors += 1
+    finally:
+        await conn.close()
+
+async def run_load(port: int, args, ops: list, weights: list) -> tuple:
+    schedule = synthetic_schedule(args.slots)
+    stats = {op: _Stats() for op in ops}
+    saves = []
+    rng = random.Random(args.seed)
+    t0 = time.perf_counter()
+    deadline = t0 + args.duration
+    await asyncio.gather(*(
+        _client(i, port, deadline, ops, weights, schedule, stats, saves, random.Random(rng.random()))
+        for i in range(args.clients)
+    ))
+    return stats, saves, time.perf_counter() - t0
+
+# ==================== 完整性检查 ====================
+
+def check_integrity(workdir: str, args, initial: int, saves: list, notified: dict) -> dict:
+    """并发保存结束后检查存储是否完好，返回 {"ok": bool, "problems": [...], ...}"""
+    problems = []
+    expected = max(saves)[0] if saves else initial
+    if args.storage == "sqlite":
+        db_path = os.path.join(workdir, "routine_config.db")
+        db = sqlite3.connect(db_path)
+        status = db.execute("PRAGMA integrity_check").fetchone()[0]
+        db.close()
+        if status != "ok":
+            problems.append(f"integrity_check: {status}")
+        from routine_store import RoutineStore
+        store = RoutineStore(db_path)
+        cfg = store.load()
+        store.close()
+    else:
+        path = os.path.join(workdir, "routine_config.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cfg = json.load(f)
+        except ValueError as e:
+            return {"ok": False, "problems": [f"routine_config.json 无法解析：{e}"]}
+        leftovers = [n for n in os.listdir(workdir) if n.startswith(".routine_config.")]
+        if leftovers:
+            problems.append(f"残留临时文件：{leftovers}")
+    revision = cfg.get("revision")
+    if revision != initial + len(saves) or revision != expected:
+        problems.append(f"修订号 {revision}，初始 {initial}，成功保存 {len(saves)} 次，最大返回修订 {expected}")
+    if saves:
+        marker = dict(saves)[expected]
+        actual = (cfg.get("schedule") or {}).get("Mon")
+        if actual != {"00:00-00:30": marker}:
+            problems.append(f"最终内容不是最后一次成功保存的内容（期望 {marker}，实际 {actual}）")
+    if notified["config"] != len(saves):
+        problems.append(f"变更通知 {notified['config']} 次，成功保存 {len(saves)} 次")
+    return {"ok": not problems, "problems": problems, "revision": revision, "saves": len(saves)}
+
+# ==================== 入口 ====================
+
+def parse_mix(text: str) -> tuple:
+    ops, weights = [], []
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("login", "load", "config"):
+            raise SystemExit(f"未知操作：{name}")
+        if float(weight or 1) > 0:
+            ops.append(name)
+            weights.append(float(weight or 1))
+    return ops, weights
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=32, help="并发客户端（连接）数")
+    parser.add_argument("--duration", type=float, default=10.0, help="持续时间（秒）")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"操作权重，默认 {DEFAULT_MIX}")
+    parser.add_argument("--slots", type=int, default=100, help="配置中的时段数量（决定请求与保存的体积）")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json", help="存储方式")
+    parser.add_argument("--keep-alive", type=float, default=5.0, help="hypercorn keep_alive_timeout（秒）")
+    parser.add_argument("--backlog", type=int, default=100, help="监听队列长度")
+    parser.add_argument("--worker-class", choices=("asyncio", "uvloop"), default="asyncio", help="服务端事件循环")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="JSON 结果输出路径（缺省输出到 stdout）")
+    args = parser.parse_args(argv)
+    ops, weights = parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        proc, port, initial, notified = start_server(workdir, args)
+        try:
+            stats, saves, elapsed = asyncio.run(run_load(port, args, ops, weights))
+        finally:
+            proc.terminate()
+            proc.join(timeout=5)
+        time.sleep(0.2)  # 让通知线程取完管道中剩余的消息
+        integrity = check_integrity(workdir, args, initial, saves, notified)
+
+    results = []
+    for op in ops:
+        st = stats[op]
+        lat = sorted(st.latencies)
+        row = {
+            "op": op, "requests": len(lat), "rps": len(lat) / elapsed,
+            "p50_ms": _quantile(lat, 0.50) * 1000, "p99_ms": _quantile(lat, 0.99) * 1000,
+            "max_ms": (lat[-1] if lat else 0.0) * 1000, "errors": st.errors,
+            "statuses": {str(k): v for k, v in sorted(st.statuses.items())},
+        }
+        results.append(row)
+        print(f"{op:<8}{row['requests']:>8} req {row['rps']:>9,.1f} req/s  p50 {row['p50_ms']:>8,.2f} ms  "
+              f"p99 {row['p99_ms']:>8,.2f} ms  errors {row['errors']}  {row['statuses']}", file=sys.stderr)
+    total = sum(r["requests"] for r in results)
+    print(f"{'total':<8}{total:>8} req {total / elapsed:>9,.1f} req/s", file=sys.stderr)
+    print(f"integrity: {'ok' if integrity['ok'] else 'FAILED'} {integrity['problems'] or ''}", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+        },
+        "settings": {k: getattr(args, k) for k in
+                     ("clients", "duration", "mix", "slots", "storage", "keep_alive", "backlog", "worker_class")},
+        "results": results,
+        "integrity": integrity,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0 if integrity["ok"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,21 @@
+import io
 import os
+import sys
 import json
+import zlib
+import random
 import secrets
 import asyncio
+import inspect
+import threading
 import importlib.util
-from dataclasses import dataclass
-from datetime import datetime, time
-from typing import List, Tuple, Optional
-from multiprocessing import Process
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from time import time as _timestamp, perf_counter
+from typing import Callable, Dict, List, NamedTuple, Tuple, Optional
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import Connection
 from zoneinfo import ZoneInfo
 
 # 符合 AstrBot 插件开发规范的导入
@@ -15,55 +24,341 @@ from astrbot.api.star import Context, Star, register
 from astrbot.api.provider import ProviderRequest
 from astrbot.api import logger
 
+try:
+    from .routine_core import (
+        WEEK_KEYS, CLEARED, _DAY_MINUTES, _SlotTable, _compile_schedule, _WeekIndex, _DateIndex,
+        _profile_schedule, _write_json_atomic, _validate_schedule, _merge_adjacent, _BatchResolver,
+        _AliasTable, _seed_unit, _PROFILE_RE, _PromptTemplate, _override_issues,
+    )
+    from . import routine_io
+    from .routine_store import open_store
+except ImportError:  # 非包方式加载（如基准脚本按文件路径导入 main.py）
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from routine_core import (
+        WEEK_KEYS, CLEARED, _DAY_MINUTES, _SlotTable, _compile_schedule, _WeekIndex, _DateIndex,
+        _profile_schedule, _write_json_atomic, _validate_schedule, _merge_adjacent, _BatchResolver,
+        _AliasTable, _seed_unit, _PROFILE_RE, _PromptTemplate, _override_issues,
+    )
+    import routine_io
+    from routine_store import open_store
+
 # ---------------- 常量 ----------------
 _DEFAULT_TZ = "Asia/Shanghai"
 _DEFAULT_TEMPLATE = "现在时间：{now} 当前行为：{action} 请在语气和内容上贴合该场景进行回复。"
+_COMPACT_TEMPLATE = "[{now:.16}] 当前行为：{action}"  # 精简模式下替换默认模板
+_DEFAULT_INJECT_BUDGET = 80  # 精简模式下注入块的字符上限（不含标记）
+_BLOCK_BEGIN = "<routine_context>"  # 注入块标记：已存在时原位替换，而不是再追加一份
+_BLOCK_END = "</routine_context>"
+_VARIANT_SEEDS = ("day", "conversation", "request")  # 备选行为的选择方式，见 _variant_seed
 _DEFAULT_WEBUI_PORT = 58101
-WEEK_KEYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
-
-# ---------------- 数据结构 ----------------
-@dataclass
-class RoutineItem:
-    day: int                 # 0..6  (Mon..Sun)
-    start: time
-    end: time
-    action: str
-    raw_range: str           # "HH:MM-HH:MM"
-
-# ---------------- 工具函数 ----------------
-def _parse_hhmm(s: str) -> time:
-    hh, mm = s.split(":")
-    return time(hour=int(hh), minute=int(mm))
-
-def _parse_range(range_str: str) -> Tuple[time, time]:
-    s, e = range_str.split("-")
-    return _parse_hhmm(s.strip()), _parse_hhmm(e.strip())
-
-def _in_range(now_t: time, start: time, end: time) -> bool:
-    # 不允许跨天块：直接比较
-    return start < end and (start <= now_t < end)
-
-def _normalize_schedule(sched_conf) -> List[RoutineItem]:
-    """将配置中的 {Mon:{'07:00-08:00':'X'}, ...} 规范为 RoutineItem 列表"""
-    items: List[RoutineItem] = []
-    if isinstance(sched_conf, dict):
-        for k in WEEK_KEYS:
-            sub = sched_conf.get(k, {}) or {}
-            if not isinstance(sub, dict):
-                continue
-            day_idx = WEEK_KEYS.index(k)
-            for rng, act in sub.items():
-                try:
-                    s, e = _parse_range(str(rng))
-                    if s >= e:
-                        continue  # 暂不支持跨天
-                    items.append(RoutineItem(
-                        day=day_idx, start=s, end=e,
-                        action=str(act).strip(), raw_range=str(rng)
-                    ))
-                except Exception:
-                    continue
-    return items
+_DEFAULT_PROFILE = "default"  # 顶层 schedule 对应的默认方案名
+_DEFAULT_PROFILE_CACHE = 256
+_WATCH_INTERVAL = 2.0  # 手动编辑配置文件时的兜底检查间隔（秒）
+_WEBUI_START_TIMEOUT = 15.0
+_HOOK_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.001, 0.005)  # 秒
+_RELOAD_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.5, 2.5)
+_UNDEFINED_ACTION = "（未定义，建议在 WebUI 中完善每周作息表）"
+
+class _SlotCache:
+    """当前作息区段的注入缓存：在 [since, until) 时间戳范围内行为不变。
+    需要按会话或按请求选择备选行为时，variants 为别名表，choices 为各备选代入后的片段。
+    """
+    __slots__ = ("since", "until", "action", "raw_range", "chunks", "defined", "variants", "choices", "seed")
+
+    def __init__(self, since: float, until: float, action: str, raw_range: str, chunks: List[str],
+                 defined: bool = True):
+        self.since = since
+        self.until = until
+        self.action = action
+        self.raw_range = raw_range
+        self.chunks = chunks
+        self.defined = defined
+        self.variants: Optional[_AliasTable] = None
+        self.choices: Optional[List[List[str]]] = None
+        self.seed = 0
+
+def _occurrence_start(when: datetime, raw_range: str) -> datetime:
+    """when 所在的这一次时段的开始时间（跨午夜的后半段算作前一天开始的那次）"""
+    hh, mm = raw_range.rsplit(" ", 1)[-1].split("-")[0].split(":")
+    back = (when.hour * 60 + when.minute - int(hh) * 60 - int(mm)) % _DAY_MINUTES
+    return when.replace(second=0, microsecond=0) - timedelta(minutes=back)
+
+def _variant_seed(when: datetime, raw_range: str) -> int:
+    """备选行为的种子：时段本次开始的日期与时段写法，同一天的同一时段（含跨午夜的后半段）选择相同"""
+    day = _occurrence_start(when, raw_range).toordinal()
+    return (day << 32) | zlib.crc32(raw_range.encode("utf-8"))
+
+def _conversation_seed(seed: int, origin: str) -> int:
+    return seed ^ (zlib.crc32(origin.encode("utf-8")) << 21)
+
+class _CompiledProfile:
+    """已编译的作息方案：每周区间索引、日期覆盖索引，加上该方案自己的注入缓存"""
+    __slots__ = ("name", "items", "index", "dates", "slot_cache", "_batch")
+
+    def __init__(self, name: str, items: _SlotTable, overrides=None, today: Optional[date] = None):
+        self.name = name
+        self.items = items
+        self.index = _WeekIndex(items)
+        dates = _DateIndex(overrides, today)
+        self.dates: Optional[_DateIndex] = dates if dates else None  # 没有覆盖项时查询走快速路径
+        self.slot_cache: Optional[_SlotCache] = None
+        self._batch: Optional[_BatchResolver] = None  # 首次批量解析时构建
+
+    def resolve_many(self, timestamps, tz: Optional[ZoneInfo] = None) -> List[Tuple[Optional[str], str]]:
+        """批量解析 datetime 或 POSIX 时间戳，返回 [(行为或 None, 时段写法)]，与逐个 resolve 的结果一致"""
+        if self._batch is None:
+            self._batch = _BatchResolver(self.items, self.index, self.dates)
+        return self._batch.resolve_many(timestamps, tz)
+
+    def resolve(self, dt: datetime) -> Tuple[Optional[str], str, int, int, Optional[_AliasTable]]:
+        """返回 (行为或 None, 时段写法, 距区段起点的分钟数, 距区段终点的分钟数, 别名表或 None)；
+        日期覆盖优先于每周作息
+        """
+        clock = dt.hour * 60 + dt.minute
+        minute = dt.weekday() * _DAY_MINUTES + clock
+        slot, seg_start, seg_end = self.index.lookup(minute)
+        if self.dates is not None:
+            stamp = dt.toordinal() * _DAY_MINUTES + clock
+            ov, alias, ov_start, ov_end = self.dates.lookup(stamp)
+            if ov is CLEARED:
+                return None, "—", stamp - ov_start, ov_end - stamp, None
+            if ov is not None:
+                return ov.action, ov.raw_range, stamp - ov_start, ov_end - stamp, alias
+            # 未被覆盖：区段同时受每周作息与下一个覆盖边界约束
+            back, ahead = min(minute - seg_start, stamp - ov_start), min(seg_end - minute, ov_end - stamp)
+        else:
+            back, ahead = minute - seg_start, seg_end - minute
+        if slot < 0:
+            return None, "—", back, ahead, None
+        return self.items.action(slot), self.items.range_key(slot), back, ahead, self.items.alias(slot)
+
+def _replace_block(prompt: str, block: str) -> Optional[str]:
+    """把 prompt 中已有的作息注入块换成 block；多余的旧块连同其前的空行一并去掉。
+    没有完整的块（缺少结束标记）时返回 None，由调用方追加。
+    """
+    out, pos = [], 0
+    while True:
+        start = prompt.find(_BLOCK_BEGIN, pos)
+        end = prompt.find(_BLOCK_END, start) if start >= 0 else -1
+        if end < 0:
+            break
+        head = prompt[pos:start]
+        if not out:
+            out += (head, block)
+        else:
+            out.append(head[:-2] if head.endswith("\n\n") else head)
+        pos = end + len(_BLOCK_END)
+    if not out:
+        return None
+    out.append(prompt[pos:])
+    return "".join(out)
+
+def _compile_profile_schedule(conf, merge: bool = False) -> _SlotTable:
+    """编译周作息；merge 为真时先合并相邻的相同行为（重叠部分按先定义者为准），查找结构更小"""
+    if merge and isinstance(conf, dict):
+        conf = _merge_adjacent(conf)
+    return _compile_schedule(conf)
+
+class _ProfileCache:
+    """命名作息方案的 LRU：原始配置按名哈希索引，编译结果按需生成并限量保留"""
+    __slots__ = ("capacity", "tz", "merge", "_raw", "_compiled")
+
+    def __init__(self, raw: dict, capacity: int = _DEFAULT_PROFILE_CACHE, tz: Optional[ZoneInfo] = None,
+                 merge: bool = False):
+        self.capacity = max(1, capacity)
+        self.tz = tz
+        self.merge = merge
+        self._raw = raw
+        self._compiled: "OrderedDict[str, _CompiledProfile]" = OrderedDict()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._raw
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def get(self, name: str) -> Optional[_CompiledProfile]:
+        prof = self._compiled.get(name)
+        if prof is not None:
+            self._compiled.move_to_end(name)
+            return prof
+        raw = self._raw.get(name)
+        if raw is None:
+            return None
+        if not isinstance(raw, dict):
+            raw = {}
+        _check_schedule(name, raw.get("schedule"), raw.get("overrides"))
+        prof = _CompiledProfile(name, _compile_profile_schedule(raw.get("schedule"), self.merge),
+                                raw.get("overrides"), datetime.now(self.tz).date())
+        self._compiled[name] = prof
+        if len(self._compiled) > self.capacity:
+            self._compiled.popitem(last=False)
+        return prof
+
+_SCHEDULE_WARNINGS: Dict[str, Tuple[int, int, int]] = {}  # 方案名 -> 上次警告时的 (无法解析, 重叠, 无效覆盖项) 数
+
+def _check_schedule(name: str, conf, overrides=None):
+    """编译方案时校验周作息与日期覆盖：重叠时只有先定义的时段生效，
+    无法解析的时段与无效的覆盖项被忽略，均记录警告。同一方案的问题数不变时不重复警告（每次重载都会重新编译默认方案）。
+    """
+    counts = _validate_schedule(conf)["counts"]
+    key = (counts["invalid"], counts["overlaps"], len(_override_issues(overrides)))
+    if _SCHEDULE_WARNINGS.get(name, (0, 0, 0)) == key:
+        return
+    _SCHEDULE_WARNINGS[name] = key
+    if any(key):
+        logger.warning(
+            f"[RoutineManager] Profile {name!r}: {key[0]} invalid range(s), "
+            f"{key[1]} overlapping segment(s), {key[2]} invalid override(s); see WebUI for details"
+        )
+
+class _ConfigSnapshot:
+    """一次加载得到的全部运行配置。在工作线程中构建，发布后不再修改，重载时整体替换，
+    请求路径只读取一个引用，不会看到新旧配置混杂的中间状态。
+
+    （各方案的区段缓存与命名方案 LRU 随快照一起替换，只是缓存，不影响配置的一致性）
+    """
+    __slots__ = ("timezone", "tz", "inject_scope", "prompt_template", "template", "variant_seed", "server_port",
+                 "default_profile", "profiles", "bindings", "stamp")
+
+    def __init__(self, disk: dict, options: dict, stamp=None):
+        self.stamp = stamp  # 来源的版本戳：配置文件的 mtime，或 SQLite 存储的修订号
+        self.timezone = disk.get("timezone", _DEFAULT_TZ)
+        try:
+            self.tz = ZoneInfo(self.timezone)
+        except Exception:
+            logger.error(f"[RoutineManager] Unknown timezone {self.timezone!r}, using {_DEFAULT_TZ}")
+            self.tz = ZoneInfo(_DEFAULT_TZ)
+        self.inject_scope = disk.get("inject_scope", "all")
+
+        # 解析提示词模板：整体包在标记内；精简模式换用短模板（自定义模板保留）并限制字符数
+        pf = disk.get("prompt") or {}
+        self.prompt_template = pf.get("routine_prompt_template", _DEFAULT_TEMPLATE)
+        compact = str(options.get("inject_mode", "full")).strip() == "compact"
+        source = _COMPACT_TEMPLATE if compact and self.prompt_template == _DEFAULT_TEMPLATE else self.prompt_template
+        budget = int(options.get("inject_budget", _DEFAULT_INJECT_BUDGET)) if compact else 0
+        seed = str(options.get("variant_seed", "day")).strip()
+        self.variant_seed = seed if seed in _VARIANT_SEEDS else "day"
+        markers = len(_BLOCK_BEGIN) + len(_BLOCK_END)  # 预算不含标记
+        total = budget + markers if budget > 0 else 0
+        try:
+            self.template = _PromptTemplate(_BLOCK_BEGIN + source + _BLOCK_END, total)
+        except ValueError as e:
+            logger.error(f"[RoutineManager] Invalid prompt template, using default: {e}")
+            self.template = _PromptTemplate(_BLOCK_BEGIN + (_COMPACT_TEMPLATE if compact else _DEFAULT_TEMPLATE)
+                                            + _BLOCK_END, total)
+        if total and self.template.budget > total:
+            logger.warning(f"[RoutineManager] inject_budget {budget} is shorter than the template itself; "
+                           f"using {self.template.budget - markers}")
+
+        # 解析端口
+        self.server_port = int(disk.get("webui_port", _DEFAULT_WEBUI_PORT))
+
+        # 解析作息表与日期覆盖（已过期的覆盖项在编译时丢弃）
+        today = datetime.now(self.tz).date()
+        merge = bool(options.get("merge_adjacent", False))
+        _check_schedule(_DEFAULT_PROFILE, disk.get("schedule", {}), disk.get("overrides"))
+        self.default_profile = _CompiledProfile(
+            _DEFAULT_PROFILE, _compile_profile_schedule(disk.get("schedule", {}), merge), disk.get("overrides"), today
+        )
+        if budget:
+            # 精简模式：加载时为默认方案的每个行为预先截断并代入，请求路径不再处理长描述
+            items = self.default_profile.items
+            for aid, action in enumerate(items.actions):
+                alias = items.variants.get(aid)
+                for name in (alias.names if alias is not None else (action,)):
+                    self.template.bind(name)
+            self.template.bind(_UNDEFINED_ACTION)
+
+        # 解析命名方案与会话绑定（方案在首次命中时才编译）
+        profiles = disk.get("profiles")
+        bindings = disk.get("profile_bindings")
+        capacity = int(options.get("profile_cache_size", _DEFAULT_PROFILE_CACHE))
+        self.profiles = _ProfileCache(profiles if isinstance(profiles, dict) else {}, capacity, self.tz, merge)
+        self.bindings = {str(k): str(v) for k, v in bindings.items()} if isinstance(bindings, dict) else {}
+
+def _load_snapshot(path: str, options: dict, disk: Optional[dict] = None, store=None) -> Optional[_ConfigSnapshot]:
+    """读取并编译配置（阻塞，在工作线程中调用）；disk 为进程内 WebUI 推送的配置时省去读盘解析。
+    store 为 SQLite 存储时从中读取当前修订。配置文件不存在（或存储为空）时返回 None。
+    """
+    if store is not None:
+        if disk is None:
+            if store.is_empty():
+                return None
+            disk = store.load()
+        return _ConfigSnapshot(disk, options, disk.get("revision"))
+    if disk is None:
+        if not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        with open(path, "r", encoding="utf-8") as f:
+            disk = json.load(f)
+    else:
+        mtime = os.path.getmtime(path)
+    return _ConfigSnapshot(disk, options, mtime)
+
+class _Histogram:
+    """累积分桶直方图（Prometheus 语义：bucket[i] 统计 <= bounds[i] 的观测值）"""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # 末位为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        return {"bounds": list(self.bounds), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+class _Metrics:
+    """钩子与配置重载的进程内计数器。
+
+    热路径上只有整数自增与一次直方图观测；快照仅在 WebUI 抓取 /api/metrics 时
+    经由通知管道生成并发送，无人抓取时没有额外开销。
+    """
+    __slots__ = ("hook_calls", "hook_skipped", "actions_resolved", "actions_undefined", "injections_replaced",
+                 "config_reloads", "config_load_failures", "config_watch_errors", "transitions",
+                 "hook_latency", "reload_latency")
+
+    _COUNTERS = (
+        ("hook_calls", "on_llm_request 调用次数"),
+        ("hook_skipped", "因注入范围跳过的请求数"),
+        ("actions_resolved", "命中已定义作息的注入次数"),
+        ("actions_undefined", "当前时间未定义作息的注入次数"),
+        ("injections_replaced", "原位替换已有注入块（而非追加）的次数"),
+        ("config_reloads", "配置重载次数"),
+        ("config_load_failures", "配置读取或解析失败次数"),
+        ("config_watch_errors", "配置文件监视出错次数"),
+        ("transitions", "作息切换事件次数"),
+    )
+
+    def __init__(self):
+        for name, _ in self._COUNTERS:
+            setattr(self, name, 0)
+        self.hook_latency = _Histogram(_HOOK_BUCKETS)
+        self.reload_latency = _Histogram(_RELOAD_BUCKETS)
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": [(f"{name}_total", help_, getattr(self, name)) for name, help_ in self._COUNTERS],
+            "histograms": [
+                ("hook_duration_seconds", "on_llm_request 注入耗时", self.hook_latency.snapshot()),
+                ("config_reload_duration_seconds", "配置重载耗时", self.reload_latency.snapshot()),
+            ],
+        }
+
+class RoutineTransition(NamedTuple):
+    """作息切换事件，传给 RoutineManager.add_transition_listener 注册的回调"""
+    profile: str              # 方案名
+    previous: Optional[str]   # 切换前的行为（None 表示未定义）
+    action: Optional[str]     # 切换后的行为（None 表示未定义）
+    raw_range: str            # 切换后所在时段，未定义时为 "—"
+    at: datetime              # 切换时刻（配置时区）
 
 # =======================================================================
 
@@ -76,79 +371,377 @@ class RoutineManager(Star):
         # 路径配置
         self._storage_dir = os.path.dirname(os.path.abspath(__file__))
         self._config_file = os.path.join(self._storage_dir, "routine_config.json")
-        self._config_mtime: Optional[float] = None
+        self._config_stamp = None  # 已加载配置的版本戳（文件 mtime 或 SQLite 修订号）
+
+        # 可选的 SQLite 存储（storage=sqlite）：首次启用时导入现有的 routine_config.json
+        self._store = None
+        if str(self.config.get("storage", "json")).strip() == "sqlite":
+            try:
+                self._store = open_store(os.path.join(self._storage_dir, "routine_config.db"), self._config_file)
+            except Exception as e:
+                logger.error(f"[RoutineManager] Cannot open SQLite store, falling back to JSON: {e}")
+
+        # 运行指标
+        self._metrics = _Metrics()
 
-        # 运行参数初始化
-        self.timezone = _DEFAULT_TZ
-        self.inject_scope = "all"
-        self.prompt_template = _DEFAULT_TEMPLATE
+        # 运行配置快照：时区、注入范围、模板、默认方案与命名方案、会话绑定。
+        # 默认方案即顶层 schedule，其他方案经会话绑定选用；重载时整体替换
+        self._snapshot = _ConfigSnapshot({}, self.config)
         self.server_port = _DEFAULT_WEBUI_PORT
-        self.schedule_items: List[RoutineItem] = []
 
-        # WebUI 进程句柄
+        # 按秒记忆的时间字符串（各方案的区段缓存见 _CompiledProfile.slot_cache）
+        self._now_sec = -1
+        self._now_str = ""
+
+        # WebUI 句柄：独立进程模式下为子进程，进程内模式下为事件循环上的任务
         self.webui_process: Optional[Process] = None
+        self._webui_task: Optional[asyncio.Task] = None
+        self._webui_shutdown: Optional[asyncio.Event] = None
+        self._webui_ready: Optional[asyncio.Future] = None
+
+        # 配置变更通知：版本号由 WebUI 经管道推送、或由后台文件监视递增，
+        # 请求路径只比较内存中的版本号，每次变更最多触发一次重载
+        self._config_version = 0
+        self._applied_version = 0
+        self._watched_stamp = None
+        self._notify_conn: Optional[Connection] = None
+        self._pending_config: Optional[dict] = None  # 进程内 WebUI 直接推送的新配置
+        self._watch_task: Optional[asyncio.Task] = None
+        self._reload_task: Optional[asyncio.Task] = None
+
+        # 作息切换调度：只在注册了回调时运行，睡眠到最近的区段边界再唤醒
+        self._transition_listeners: Dict[str, List[Callable]] = {}
+        self._transition_state: Dict[str, list] = {}  # 方案名 -> [行为, 时段, 下一个边界时间戳]
+        self._transition_task: Optional[asyncio.Task] = None
 
         # 初始化加载配置
         self._load_config_from_runtime()
 
     # ---------------- 配置加载与热更新 ----------------
+    @property
+    def timezone(self) -> str:
+        return self._snapshot.timezone
+
+    @property
+    def inject_scope(self) -> str:
+        return self._snapshot.inject_scope
+
+    @property
+    def prompt_template(self) -> str:
+        return self._snapshot.prompt_template
+
+    @property
+    def schedule_items(self) -> _SlotTable:
+        """默认方案的时段（迭代得到 RoutineItem 视图）"""
+        return self._snapshot.default_profile.items
+
     def _load_config_from_runtime(self):
-        """从 JSON 文件加载配置（WebUI 修改的就是这个文件）"""
-        if os.path.exists(self._config_file):
+        """从 JSON 文件（或 SQLite 存储）同步加载配置；仅用于启动时，运行中的重载见 _reload_config"""
+        try:
+            snapshot = _load_snapshot(self._config_file, self.config, store=self._store)
+        except Exception as e:
+            self._metrics.config_load_failures += 1
+            logger.error(f"[RoutineManager] Failed to load config: {e}")
+            return
+        if snapshot is not None:
+            self._publish_snapshot(snapshot)
+
+    def _publish_snapshot(self, snapshot: _ConfigSnapshot):
+        """一次赋值发布新快照，随后作废按秒缓存的时间字符串，切换调度按新配置（与时区）重新计时"""
+        self._snapshot = snapshot
+        self.server_port = snapshot.server_port
+        if snapshot.stamp is not None:
+            self._config_stamp = snapshot.stamp
+        self._now_sec = -1
+        self._rearm_transitions()
+
+    async def _reload_config(self):
+        """在工作线程中读盘、解析并编译，完成后一次性替换快照；期间到达的新变更在下一轮处理"""
+        while self._applied_version != self._config_version:
+            logger.info("[RoutineManager] Detected config change, reloading...")
+            self._applied_version = self._config_version
+            t0 = perf_counter()
+            # 进程内模式：直接应用 WebUI 推送的配置，省去一次读盘解析
+            pending, self._pending_config = self._pending_config, None
             try:
-                with open(self._config_file, "r", encoding="utf-8") as f:
-                    disk = json.load(f)
-                
-                self.timezone = disk.get("timezone", _DEFAULT_TZ)
-                self.inject_scope = disk.get("inject_scope", "all")
-                
-                # 解析提示词模板
-                pf = disk.get("prompt") or {}
-                self.prompt_template = pf.get("routine_prompt_template", _DEFAULT_TEMPLATE)
-                
-                # 解析端口
-                self.server_port = int(disk.get("webui_port", _DEFAULT_WEBUI_PORT))
-                
-                # 解析作息表
-                self.schedule_items = _normalize_schedule(disk.get("schedule", {}))
-                
-                # 更新文件修改时间戳
-                self._config_mtime = os.path.getmtime(self._config_file)
+                snapshot = await asyncio.to_thread(_load_snapshot, self._config_file, self.config, pending, self._store)
             except Exception as e:
+                self._metrics.config_load_failures += 1
                 logger.error(f"[RoutineManager] Failed to load config: {e}")
+                snapshot = None
+            if snapshot is not None:
+                self._publish_snapshot(snapshot)
+            self._metrics.reload_latency.observe(perf_counter() - t0)
+            self._metrics.config_reloads += 1
 
-    def _maybe_reload_config(self):
-        """检查文件是否变更，若变更则热重载"""
+    def _schedule_reload(self):
+        """启动后台重载任务；已有任务在运行时由它接着处理最新版本"""
+        task = self._reload_task
+        if task is not None and not task.done():
+            return
         try:
-            if os.path.exists(self._config_file):
-                mtime = os.path.getmtime(self._config_file)
-                if self._config_mtime is None or mtime > self._config_mtime:
-                    # logger.info("[RoutineManager] Detected config change, reloading...")
-                    self._load_config_from_runtime()
-        except Exception:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # 尚未激活，由 initialize 或下一次请求处理
+        self._reload_task = loop.create_task(self._reload_config())
+
+    def _mark_config_changed(self):
+        """记录一次配置变更并立即在后台重载，请求路径继续使用旧快照直到新快照发布"""
+        self._config_version += 1
+        self._schedule_reload()
+
+    def _handle_webui_message(self, msg):
+        """处理 WebUI 发来的消息：("config", 修订号[, 配置]) / ("metrics",) / ("ready", 端口) / ("error", 原因)"""
+        if not msg:
+            return
+        kind = msg[0]
+        if kind == "config":
+            if len(msg) > 2:
+                self._pending_config = msg[2]
+            self._mark_config_changed()
+        elif kind == "metrics" and self._notify_conn is not None:
+            # WebUI 抓取 /api/metrics：在事件循环线程中回传一份快照
+            self._notify_conn.send(("metrics", self._metrics.snapshot()))
+        elif kind in ("ready", "error"):
+            self._resolve_webui_ready(kind, msg[1] if len(msg) > 1 else "")
+
+    def _resolve_webui_ready(self, kind: str, detail):
+        fut = self._webui_ready
+        if fut is not None and not fut.done():
+            fut.set_result((kind, detail))
+
+    def _on_notify_readable(self):
+        """管道可读回调：取出所有待处理消息"""
+        conn = self._notify_conn
+        try:
+            while conn is not None and conn.poll():
+                self._handle_webui_message(conn.recv())
+        except (EOFError, OSError):
+            self._close_notify_channel()
+
+    def _pump_notify(self, conn: Connection, loop: asyncio.AbstractEventLoop):
+        """不支持 add_reader 的事件循环（Windows Proactor）下，由后台线程阻塞读取管道"""
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            loop.call_soon_threadsafe(self._handle_webui_message, msg)
+
+    def _open_notify_channel(self) -> Connection:
+        """建立与 WebUI 进程之间的通知管道，返回交给 WebUI 进程的一端。
+
+        WebUI 经此推送配置变更，并请求指标快照（插件在同一管道上回复）。
+        """
+        self._close_notify_channel()
+        recv_conn, send_conn = Pipe(duplex=True)
+        self._notify_conn = recv_conn
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_reader(recv_conn.fileno(), self._on_notify_readable)
+        except NotImplementedError:
+            threading.Thread(target=self._pump_notify, args=(recv_conn, loop), daemon=True).start()
+        return send_conn
+
+    def _close_notify_channel(self):
+        conn, self._notify_conn = self._notify_conn, None
+        if conn is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(conn.fileno())
+        except (RuntimeError, NotImplementedError, OSError, ValueError):
             pass
+        conn.close()
+        self._resolve_webui_ready("error", "WebUI 进程已退出")
+
+    def _source_stamp(self):
+        """配置来源当前的版本戳：配置文件的 mtime，或 SQLite 存储的最新修订号"""
+        if self._store is not None:
+            return self._store.revision()
+        return os.path.getmtime(self._config_file)
+
+    async def _watch_config_file(self):
+        """兜底：低频检查配置文件的修改时间（SQLite 存储下检查修订号），覆盖手动编辑与其他进程写入的场景"""
+        while True:
+            await asyncio.sleep(_WATCH_INTERVAL)
+            try:
+                stamp = self._source_stamp()
+            except Exception:
+                self._metrics.config_watch_errors += 1
+                continue
+            if stamp != self._config_stamp and stamp != self._watched_stamp:
+                self._watched_stamp = stamp
+                self._mark_config_changed()
+
+    def _start_config_watcher(self):
+        if self._watch_task is None:
+            self._watch_task = asyncio.get_running_loop().create_task(self._watch_config_file())
+
+    async def initialize(self):
+        """插件激活时启动配置文件监视（以及激活前已注册回调的切换调度）"""
+        self._start_config_watcher()
+        if self._config_version != self._applied_version:
+            self._schedule_reload()
+        self._rearm_transitions()
+
+    # ---------------- 作息切换调度 ----------------
+    def add_transition_listener(self, callback: Callable, profile: str = _DEFAULT_PROFILE):
+        """注册作息切换回调 callback(RoutineTransition)，可以是普通函数或协程函数。
+
+        调度任务睡眠到下一个区段边界（包括日期覆盖的边界）再唤醒，空闲时不占用 CPU；
+        配置重载或时区变化后自动重新计时，夏令时切换按墙上时间对齐。
+        """
+        self._transition_listeners.setdefault(profile, []).append(callback)
+        self._rearm_transitions()
+
+    def remove_transition_listener(self, callback: Callable, profile: str = _DEFAULT_PROFILE):
+        listeners = self._transition_listeners.get(profile)
+        if listeners and callback in listeners:
+            listeners.remove(callback)
+            if not listeners:
+                del self._transition_listeners[profile]
+                self._transition_state.pop(profile, None)
+            self._rearm_transitions()
+
+    def _rearm_transitions(self):
+        """重启切换调度任务（已记录的行为保留，边界全部重新计算）"""
+        task, self._transition_task = self._transition_task, None
+        if task is not None and not task.done():
+            task.cancel()
+        if not self._transition_listeners:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # 尚未激活，由 initialize 启动
+        for state in self._transition_state.values():
+            state[2] = 0.0
+        self._transition_task = loop.create_task(self._run_transitions())
+
+    def _named_profile(self, snapshot: _ConfigSnapshot, name: str) -> Optional[_CompiledProfile]:
+        return snapshot.default_profile if name == _DEFAULT_PROFILE else snapshot.profiles.get(name)
+
+    async def _run_transitions(self):
+        """检查到期的方案并触发回调，然后睡眠到最近的下一个边界"""
+        while True:
+            ts = _timestamp()
+            snapshot = self._snapshot
+            wake = ts + _DAY_MINUTES * 60  # 无任何边界（如方案不存在）时每天复查一次
+            for name in list(self._transition_listeners):
+                state = self._transition_state.get(name)
+                if state is None or ts >= state[2]:
+                    profile = self._named_profile(snapshot, name)
+                    if profile is None:
+                        continue
+                    cache = profile.slot_cache = self._build_slot_cache(ts, profile, snapshot)
+                    action = cache.action if cache.defined else None
+                    if state is None:
+                        state = self._transition_state[name] = [action, cache.raw_range, cache.until]
+                    else:
+                        previous = state[0]
+                        state[:] = [action, cache.raw_range, cache.until]
+                        if previous != action:
+                            await self._fire_transition(RoutineTransition(
+                                name, previous, action, cache.raw_range, datetime.fromtimestamp(ts, snapshot.tz)
+                            ))
+                wake = min(wake, state[2])
+            # 事件循环按单调时钟计时，提前醒来时上面的检查不会误触发，重新睡眠剩余时间即可
+            await asyncio.sleep(max(0.0, wake - _timestamp()))
+
+    async def _fire_transition(self, event: RoutineTransition):
+        self._metrics.transitions += 1
+        logger.info(f"[RoutineManager] Routine of {event.profile!r} changed: {event.previous} -> {event.action}")
+        for callback in list(self._transition_listeners.get(event.profile, ())):
+            try:
+                result = callback(event)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"[RoutineManager] Transition callback failed: {e}")
 
     # ---------------- 核心逻辑：时间与行为判定 ----------------
     def _now(self) -> datetime:
-        try:
-            return datetime.now(ZoneInfo(self.timezone))
-        except Exception:
-            return datetime.now(ZoneInfo(_DEFAULT_TZ))
+        return datetime.now(self._snapshot.tz)
 
-    def _current_action(self, when: Optional[datetime] = None) -> Tuple[str, str]:
-        """计算当前时间对应的行为"""
-        dt = when or self._now()
-        now_t = time(dt.hour, dt.minute, dt.second)
-        day = dt.weekday()  # 0..6 (Mon..Sun)
-        
-        for it in self.schedule_items:
-            if it.day == day and _in_range(now_t, it.start, it.end):
-                return it.action, it.raw_range
-        return "（未定义，建议在 WebUI 中完善每周作息表）", "—"
+    def _profile_for(self, event: AstrMessageEvent, snapshot: _ConfigSnapshot) -> _CompiledProfile:
+        """按 会话来源 -> 群号 -> 用户 ID 的顺序查找绑定的方案，未绑定时使用默认方案"""
+        bindings = snapshot.bindings
+        if not bindings:
+            return snapshot.default_profile
+        name = bindings.get(getattr(event, "unified_msg_origin", ""))
+        if name is None:
+            try:
+                name = bindings.get(event.get_group_id() or "") or bindings.get(event.get_sender_id() or "")
+            except Exception:
+                name = None
+        if name is None or name == _DEFAULT_PROFILE:
+            return snapshot.default_profile
+        return snapshot.profiles.get(name) or snapshot.default_profile
+
+    def _current_action(self, when: Optional[datetime] = None,
+                        profile: Optional[_CompiledProfile] = None) -> Tuple[str, str]:
+        """计算当前时间对应的行为；备选行为按 variant_seed 选出一个（别名表，O(1)）"""
+        profile = profile or self._snapshot.default_profile
+        when = when or self._now()
+        action, raw_range, _, _, alias = profile.resolve(when)
+        if action is None:
+            return _UNDEFINED_ACTION, raw_range
+        if alias is not None:
+            if self._snapshot.variant_seed == "request":
+                u = random.random()
+            else:  # 没有会话信息时按天选择
+                u = _seed_unit(_variant_seed(when, raw_range))
+            action = alias.names[alias.pick(u)]
+        return action, raw_range
+
+    def resolve_many(self, timestamps, profile: str = _DEFAULT_PROFILE) -> List[Tuple[Optional[str], str]]:
+        """批量解析一组时间（datetime 或 POSIX 时间戳，无时区的 datetime 按配置时区理解），
+        返回 [(行为或 None, 时段写法)]；用于预览与核对覆盖情况，比逐个调用 _current_action 快得多。
+        方案不存在时返回 None。
+        """
+        snapshot = self._snapshot
+        prof = self._named_profile(snapshot, profile)
+        return None if prof is None else prof.resolve_many(timestamps, snapshot.tz)
+
+    def _build_slot_cache(self, ts: float, profile: _CompiledProfile, snapshot: _ConfigSnapshot) -> _SlotCache:
+        """解析 ts 所在区段，并计算该区段的起止时间戳（profile 须属于 snapshot）"""
+        now = datetime.fromtimestamp(ts, snapshot.tz)
+        action, raw_range, back, ahead, alias = profile.resolve(now)
+        defined = action is not None
+        if not defined:
+            action = _UNDEFINED_ACTION
+
+        # 按墙上时间推算边界，再换算为时间戳，夏令时切换也能对齐
+        base = now.replace(second=0, microsecond=0)
+        since = (base - timedelta(minutes=back)).timestamp()
+        until = (base + timedelta(minutes=ahead)).timestamp()
+        if not since <= ts < until:
+            since, until = ts, base.timestamp() + 60  # 落在夏令时缺口内时退化为按分钟缓存
+        if alias is None:
+            return _SlotCache(since, until, action, raw_range, snapshot.template.bind(action), defined)
+
+        # 备选行为：按天选择时在此一次选定；按会话 / 按请求时由钩子用别名表选择。
+        # 种子随时段每次开始的日期变化，缓存不跨越本次时段（全天覆盖、合并后的多天区段每天重新选择）
+        start = _occurrence_start(base, raw_range)
+        since = max(since, start.timestamp())
+        until = min(until, (start + timedelta(days=1)).timestamp())
+        seed = _variant_seed(base, raw_range)
+        choices = [snapshot.template.bind(name) for name in alias.names]
+        cache = _SlotCache(since, until, action, raw_range, choices[alias.pick(_seed_unit(seed))], defined)
+        if snapshot.variant_seed != "day":
+            cache.variants, cache.choices, cache.seed = alias, choices, seed
+        return cache
 
-    def _should_inject(self, event: AstrMessageEvent) -> bool:
+    def _format_now(self, ts: float) -> str:
+        sec = int(ts)
+        if sec != self._now_sec:
+            self._now_sec = sec
+            self._now_str = datetime.fromtimestamp(sec, self._snapshot.tz).strftime("%Y-%m-%d %H:%M:%S")
+        return self._now_str
+
+    def _should_inject(self, event: AstrMessageEvent, inject_scope: str) -> bool:
         """判断当前场景是否需要注入"""
-        if self.inject_scope == "off":
+        if inject_scope == "off":
             return False
         
         try:
@@ -156,9 +749,9 @@ class RoutineManager(Star):
         except Exception:
             is_private = True
             
-        if self.inject_scope == "private":
+        if inject_scope == "private":
             return is_private
-        if self.inject_scope == "group":
+        if inject_scope == "group":
             return not is_private
         return True
 
@@ -166,58 +759,73 @@ class RoutineManager(Star):
     
     @filter.on_llm_request()
     async def on_llm_request(self, event: AstrMessageEvent, req: ProviderRequest):
-        # 1. 热重载检查
-        self._maybe_reload_config()
+        t0 = perf_counter()
+        metrics = self._metrics
+        metrics.hook_calls += 1
+
+        # 1. 热重载检查：仅比较内存中的版本号，重载在后台进行，本次请求使用当前快照
+        if self._watch_task is None:
+            self._start_config_watcher()
+        if self._config_version != self._applied_version:
+            self._schedule_reload()
+        snapshot = self._snapshot
 
         # 2. 范围判定
-        if not self._should_inject(event):
+        if not self._should_inject(event, snapshot.inject_scope):
+            metrics.hook_skipped += 1
             return
 
-        # 3. 计算当前行为
-        now = self._now()
-        action, _ = self._current_action(now)
-        now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+        # 3. 取会话所用方案的当前区段缓存（跨越区段边界时才重新解析）
+        ts = _timestamp()
+        profile = self._profile_for(event, snapshot)
+        cache = profile.slot_cache
+        if cache is None or not cache.since <= ts < cache.until:
+            cache = profile.slot_cache = self._build_slot_cache(ts, profile, snapshot)
+        if cache.defined:
+            metrics.actions_resolved += 1
+        else:
+            metrics.actions_undefined += 1
 
-        # 4. 构建提示词
-        try:
-            injection_text = self.prompt_template.format(action=action, now=now_str)
-        except Exception:
-            injection_text = f"现在时间：{now_str} 当前行为：{action}"
+        # 4. 构建提示词：预编译模板只需代入 {now}；按会话 / 按请求选择的备选行为在此 O(1) 选出
+        chunks = cache.chunks
+        if cache.variants is not None:
+            if snapshot.variant_seed == "request":
+                u = random.random()
+            else:
+                u = _seed_unit(_conversation_seed(cache.seed, getattr(event, "unified_msg_origin", "") or ""))
+            chunks = cache.choices[cache.variants.pick(u)]
+        injection_text = snapshot.template.render(chunks, self._format_now(ts))
 
-        # 5. 注入到 System Prompt
-        if req.system_prompt:
-            req.system_prompt += f"\n\n{injection_text}"
-        else:
+        # 5. 注入到 System Prompt：已有作息块（请求对象复用、其他插件已注入）时原位替换，保证只有一份
+        prompt = req.system_prompt
+        if not prompt:
             req.system_prompt = injection_text
+        else:
+            replaced = _replace_block(prompt, injection_text) if _BLOCK_BEGIN in prompt else None
+            if replaced is None:
+                req.system_prompt = f"{prompt}\n\n{injection_text}"
+            else:
+                req.system_prompt = replaced
+                metrics.injections_replaced += 1
+        metrics.hook_latency.observe(perf_counter() - t0)
 
     # ---------------- WebUI 管理与进程控制 ----------------
-    async def _check_port_active(self) -> bool:
-        """检查端口是否被占用"""
-        try:
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection("127.0.0.1", int(self.server_port)), timeout=1.0
-            )
-            writer.close()
-            await writer.wait_closed()
-            return True
-        except Exception:
-            return False
-
     def _generate_secret_key(self, n: int = 12) -> str:
         return secrets.token_urlsafe(n)
 
     def _export_runtime_config(self) -> dict:
+        snapshot = self._snapshot
         weekly = {k: {} for k in WEEK_KEYS}
-        for it in self.schedule_items:
-            key = f"{it.start.strftime('%H:%M')}-{it.end.strftime('%H:%M')}"
-            weekly[WEEK_KEYS[it.day]][key] = it.action
+        items = snapshot.default_profile.items
+        for i in range(len(items)):
+            weekly[WEEK_KEYS[items.days[i]]][items.range_key(i)] = items.value(i)
             
         return {
-            "timezone": self.timezone,
-            "inject_scope": self.inject_scope,
+            "timezone": snapshot.timezone,
+            "inject_scope": snapshot.inject_scope,
             "webui_port": self.server_port,
             "schedule": weekly,
-            "prompt": {"routine_prompt_template": self.prompt_template},
+            "prompt": {"routine_prompt_template": snapshot.prompt_template},
         }
 
     def _kill_webui_process(self):
@@ -229,6 +837,67 @@ class RoutineManager(Star):
             except Exception:
                 pass
         self.webui_process = None
+        self._close_notify_channel()
+
+    async def _stop_webui(self):
+        """关闭本插件开启的 WebUI（两种模式均适用）"""
+        self._kill_webui_process()
+        task, self._webui_task = self._webui_task, None
+        if task is not None and not task.done():
+            self._webui_shutdown.set()
+            try:
+                await asyncio.wait_for(task, timeout=5)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            except Exception as e:
+                logger.error(f"[RoutineManager] WebUI task failed on shutdown: {e}")
+
+    def _webui_running(self) -> bool:
+        if self.webui_process is not None and self.webui_process.is_alive():
+            return True
+        return self._webui_task is not None and not self._webui_task.done()
+
+    def _import_webui(self):
+        """动态导入 WebUI（quart / hypercorn 到此时才加载）"""
+        try:
+            from . import webui
+            return webui
+        except ImportError:
+            spec = importlib.util.spec_from_file_location(
+                "routine_webui",
+                os.path.join(self._storage_dir, "webui.py")
+            )
+            if spec and spec.loader:
+                m = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(m)
+                return m
+            raise ImportError("Cannot find webui.py")
+
+    def _start_webui_process(self, webui, cfg: dict):
+        """独立进程模式：notify_conn 用于就绪信号、配置变更通知与指标拉取"""
+        notify_conn = self._open_notify_channel()
+        cfg["notify_conn"] = notify_conn
+        self.webui_process = Process(target=webui.run_server, args=(cfg,), daemon=True)
+        self.webui_process.start()
+        notify_conn.close()  # 该端已交给子进程，父进程关闭自己的副本
+
+    def _start_webui_inprocess(self, webui, cfg: dict):
+        """进程内模式：在 AstrBot 的事件循环上运行 WebUI，消息与指标直接回调"""
+        cfg["plugin_hooks"] = {"notify": self._handle_webui_message, "metrics": self._metrics.snapshot}
+        self._webui_shutdown = asyncio.Event()
+        self._webui_task = asyncio.get_running_loop().create_task(
+            webui.start_server(cfg, shutdown_trigger=self._webui_shutdown.wait)
+        )
+        self._webui_task.add_done_callback(self._on_webui_task_done)
+
+    def _on_webui_task_done(self, task: asyncio.Task):
+        if task.cancelled():
+            self._resolve_webui_ready("error", "WebUI 已取消")
+        elif task.exception() is not None:
+            logger.error(f"[RoutineManager] WebUI stopped: {task.exception()}")
+            self._resolve_webui_ready("error", str(task.exception()))
+        else:
+            self._resolve_webui_ready("error", "WebUI 已退出")
 
     @filter.command_group("作息管理")
     def routine_manager(self):
@@ -245,57 +914,45 @@ class RoutineManager(Star):
         one_time_key = self._generate_secret_key(12)
 
         try:
-            # 检查端口占用情况
-            if await self._check_port_active():
-                 # 端口被占，检查是否为本插件开启的进程
-                 if self.webui_process and self.webui_process.is_alive():
-                     # 是自己的进程 -> 重启（先杀掉）
-                     self._kill_webui_process()
-                     # 等待一小会儿让端口释放
-                     await asyncio.sleep(1)
-                 else:
-                     # 端口被占，但不是我记录的进程（可能是僵尸进程或被其他软件占用）
-                     yield event.plain_result(f"⚠️ 端口 {self.server_port} 已被占用，且无法自动释放。请检查后台进程或更换端口。")
-                     return
-
-            # 动态导入 WebUI
-            try:
-                from .webui import run_server
-            except ImportError:
-                spec = importlib.util.spec_from_file_location(
-                    "routine_webui",
-                    os.path.join(self._storage_dir, "webui.py")
-                )
-                if spec and spec.loader:
-                    m = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(m)
-                    run_server = m.run_server
-                else:
-                    raise ImportError("Cannot find webui.py")
+            # 若本插件的后台仍在运行则先关闭（重启）；新服务以 SO_REUSEADDR 监听，无需等待端口释放
+            await self._stop_webui()
+            webui = self._import_webui()
 
             # 启动配置
             cfg = {
                 "webui_port": self.server_port,
                 "server_key": one_time_key,
                 "storage_path": self._config_file,
+                "store_path": self._store.path if self._store is not None else "",
                 "plugin_config": self._export_runtime_config(),
                 "host": "0.0.0.0",
                 "one_time_key": True,
                 "key_ttl_seconds": 600,
+                "metrics_token": str(self.config.get("metrics_token", "") or ""),
+                "keep_alive_timeout": self.config.get("webui_keep_alive"),
+                "backlog": self.config.get("webui_backlog"),
+                "worker_class": self.config.get("webui_worker_class"),
             }
-            
-            self.webui_process = Process(target=run_server, args=(cfg,), daemon=True)
-            self.webui_process.start()
-
-            # 轮询等待启动
-            for _ in range(15):
-                if await self._check_port_active():
-                    break
-                await asyncio.sleep(1)
+
+            # 启动后等待 WebUI 发回就绪信号（端口监听成功）或错误，不再轮询端口
+            self._webui_ready = asyncio.get_running_loop().create_future()
+            if str(self.config.get("webui_mode", "process")).strip() == "inprocess":
+                self._start_webui_inprocess(webui, cfg)
             else:
-                self._kill_webui_process()
+                self._start_webui_process(webui, cfg)
+            try:
+                kind, detail = await asyncio.wait_for(self._webui_ready, timeout=_WEBUI_START_TIMEOUT)
+            except asyncio.TimeoutError:
+                await self._stop_webui()
                 yield event.plain_result("⌛ 启动超时，请检查服务器防火墙或日志。")
                 return
+            finally:
+                self._webui_ready = None
+
+            if kind != "ready":
+                await self._stop_webui()
+                yield event.plain_result(f"⚠️ 端口 {self.server_port} 无法监听（{detail}），可能已被占用。请检查后台进程或更换端口。")
+                return
 
             safe_url = f"http://[您的公网ip]:{self.server_port}"
             yield event.plain_result(
@@ -313,13 +970,171 @@ class RoutineManager(Star):
     @filter.permission_type(filter.PermissionType.ADMIN)
     @routine_manager.command("关闭管理后台")
     async def stop_webui(self, event: AstrMessageEvent):
-        if self.webui_process and self.webui_process.is_alive():
-            self._kill_webui_process()
+        if self._webui_running():
+            await self._stop_webui()
             yield event.plain_result("🛑 管理后台已关闭")
         else:
             yield event.plain_result("ℹ️ 管理后台未在运行")
 
+    def _read_config(self) -> dict:
+        """（工作线程中执行）读取当前保存的完整配置；尚未保存过时返回运行配置"""
+        if self._store is not None:
+            if not self._store.is_empty():
+                return self._store.load()
+        elif os.path.exists(self._config_file):
+            with open(self._config_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return self._export_runtime_config()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self._config_file)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _write_config(self, cfg: dict, source: str, stamp: Optional[Tuple[int, int]] = None):
+        """（工作线程中执行）写回完整配置，cfg["revision"] 须为读到的修订号 + 1。
+        JSON 文件在读取后被改动过（stamp 为读取前的文件戳，WebUI 保存或手动编辑）时不写入，与 WebUI 的 If-Match 检查相同。
+        """
+        if self._store is None:
+            if self._file_stamp() != stamp:
+                raise RuntimeError("配置已被其他修改更新，请重试")
+            _write_json_atomic(self._config_file, cfg)
+        elif self._store.save(cfg, expect=cfg["revision"] - 1, source=source) is None:
+            raise RuntimeError("配置已被其他修改更新，请重试")
+
+    def _import_file(self, path: str, fmt: str, profile: str, replace: bool) -> dict:
+        """（工作线程中执行）流式解析文件并写回配置，返回逐行报告"""
+        stamp = self._file_stamp() if self._store is None else None
+        cfg = self._read_config()
+        with open(path, "rb") as f:
+            fmt = fmt or routine_io.detect_format(f.read(64))
+            f.seek(0)
+            text = io.TextIOWrapper(f, encoding="utf-8-sig", errors="replace", newline="")
+            report = routine_io.import_schedule(cfg, routine_io.parse_rows(text, fmt, self._snapshot.tz), profile, replace)
+        if report["imported"] or replace:
+            try:
+                cfg["revision"] = int(cfg.get("revision", 0)) + 1
+            except (TypeError, ValueError):
+                cfg["revision"] = 1
+            self._write_config(cfg, "import", stamp)
+        report["format"] = fmt
+        return report
+
+    def _export_file(self, fmt: str, profile: str) -> Optional[str]:
+        """（工作线程中执行）把方案日程逐段写入 exports/ 目录，方案不存在时返回 None"""
+        cfg = self._read_config()
+        schedule = _profile_schedule(cfg, profile)
+        if schedule is None:
+            return None
+        out_dir = os.path.join(self._storage_dir, "exports")
+        os.makedirs(out_dir, exist_ok=True)
+        out_path = os.path.join(out_dir, f"routine-{profile.replace(os.sep, '_')}.{fmt}")
+        if fmt == "ics":
+            chunks = routine_io.export_ics(schedule, str(cfg.get("timezone") or _DEFAULT_TZ), profile)
+        else:
+            chunks = routine_io.export_csv(schedule)
+        with open(out_path, "w", encoding="utf-8", newline="") as f:
+            f.writelines(chunks)
+        return out_path
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @routine_manager.command("导入作息")
+    async def import_routine(self, event: AstrMessageEvent, path: str, mode: str = "merge",
+                             profile: str = _DEFAULT_PROFILE):
+        """从服务器上的 CSV / iCalendar 文件导入作息（mode: merge 合并 / replace 覆盖该方案）"""
+        if mode not in ("merge", "replace"):
+            yield event.plain_result("⚠️ 导入模式只能是 merge（合并）或 replace（覆盖）")
+            return
+        if not _PROFILE_RE.match(profile):
+            yield event.plain_result("⚠️ 方案名不能含空白或 /，且最长 64 个字符")
+            return
+        if not os.path.isabs(path):
+            path = os.path.join(self._storage_dir, path)
+        ext = os.path.splitext(path)[1].lower().lstrip(".")
+        fmt = "ics" if ext in ("ics", "ical") else "csv" if ext == "csv" else ""
+        try:
+            report = await asyncio.to_thread(self._import_file, path, fmt, profile, mode == "replace")
+        except OSError as e:
+            yield event.plain_result(f"⚠️ 无法读取或写入文件：{e}")
+            return
+        except Exception as e:
+            logger.error(f"[RoutineManager] Import failed: {e}")
+            yield event.plain_result(f"⚠️ 导入失败：{e}")
+            return
+        self._mark_config_changed()
+
+        lines = [f"📥 已导入 {report['imported']} 个时段到方案「{profile}」（{report['format'].upper()}）"]
+        if report["error_count"]:
+            lines.append(f"⚠️ {report['error_count']} 行未导入：")
+            lines += [f"  第 {e['line']} 行：{e['error']}" for e in report["errors"][:10]]
+            if report["error_count"] > 10:
+                lines.append(f"  ……其余 {report['error_count'] - 10} 行略")
+        yield event.plain_result("\n".join(lines))
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @routine_manager.command("导出作息")
+    async def export_routine(self, event: AstrMessageEvent, fmt: str = "csv", profile: str = _DEFAULT_PROFILE):
+        """把作息方案导出为 CSV / iCalendar 文件（保存在插件目录的 exports/ 下）"""
+        fmt = fmt.lower()
+        if fmt not in routine_io.FORMATS:
+            yield event.plain_result("⚠️ 导出格式只能是 csv 或 ics")
+            return
+        try:
+            out_path = await asyncio.to_thread(self._export_file, fmt, profile)
+        except Exception as e:
+            logger.error(f"[RoutineManager] Export failed: {e}")
+            yield event.plain_result(f"⚠️ 导出失败：{e}")
+            return
+        if out_path is None:
+            yield event.plain_result(f"⚠️ 方案「{profile}」不存在")
+        else:
+            yield event.plain_result(f"📤 已导出到 {out_path}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @routine_manager.command("作息历史")
+    async def routine_history(self, event: AstrMessageEvent, limit: int = 10):
+        """列出最近的配置修订（需启用 SQLite 存储）"""
+        if self._store is None:
+            yield event.plain_result("ℹ️ 修订历史需要在插件配置中将 storage 设为 sqlite")
+            return
+        revisions = await asyncio.to_thread(self._store.history, max(1, min(int(limit), 50)))
+        lines = ["🕘 最近的修订："]
+        for r in revisions:
+            at = datetime.fromtimestamp(r["at"], self._snapshot.tz).strftime("%m-%d %H:%M")
+            lines.append(f"  #{r['revision']} {at} {r['source'] or '-'} {r['note']}"
+                         f"（+{r['slots_added']} / -{r['slots_removed']} 时段）")
+        yield event.plain_result("\n".join(lines))
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @routine_manager.command("回滚作息")
+    async def rollback_routine(self, event: AstrMessageEvent, revision: int):
+        """把配置恢复为某个修订的内容（作为新修订保存，之后的历史保留）"""
+        if self._store is None:
+            yield event.plain_result("ℹ️ 回滚需要在插件配置中将 storage 设为 sqlite")
+            return
+        try:
+            saved = await asyncio.to_thread(self._store.rollback, int(revision))
+        except Exception as e:
+            logger.error(f"[RoutineManager] Rollback failed: {e}")
+            yield event.plain_result(f"⚠️ 回滚失败：{e}")
+            return
+        if saved is None:
+            yield event.plain_result(f"⚠️ 修订 #{revision} 不存在")
+            return
+        self._mark_config_changed()
+        yield event.plain_result(f"⏪ 已回滚到修订 #{revision} 的内容（新修订 #{saved}）")
+
     async def terminate(self):
         """插件卸载时清理"""
-        self._kill_webui_process()
+        await self._stop_webui()
+        for task in (self._watch_task, self._reload_task):
+            if task is not None:
+                task.cancel()
+        self._watch_task = self._reload_task = None
+        self._transition_listeners.clear()
+        self._rearm_transitions()
+        if self._store is not None:
+            self._store.close()
         logger.info("[RoutineManager] Terminated.")
\ No newline at end of file
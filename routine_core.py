@@ -0,0 +1,823 @@
+"""作息表的纯数据逻辑：时段解析、规范化与周内区间索引。
+
+插件（main.py）与 WebUI（webui.py）共用，不依赖 AstrBot / Quart。
+"""
+import os
+import re
+import sys
+import json
+import math
+import heapq
+import tempfile
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from string import Formatter
+from typing import Dict, List, Tuple, Optional, Union
+
+try:
+    import numpy as np  # 可选依赖：安装后批量解析使用 searchsorted 向量化
+except ImportError:
+    np = None
+
+# ---------------- 常量 ----------------
+WEEK_KEYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+_DAY_MINUTES = 24 * 60
+_WEEK_MINUTES = 7 * _DAY_MINUTES
+_FAR_MINUTE = date.max.toordinal() * _DAY_MINUTES * 2  # 日期覆盖时间轴的“无穷远”
+DEFAULT_PROFILE = "default"    # 顶层 schedule 对应的默认方案
+_PROFILE_RE = re.compile(r"^[^\s/]{1,64}$")  # 方案名：不含空白与 /，最长 64 个字符
+_NOW_SAMPLE = "0000-00-00 00:00:00"  # 估算模板长度时代入的 {now}
+_HHMM = tuple(f"{m // 60:02d}:{m % 60:02d}" for m in range(_DAY_MINUTES + 1))  # 分钟数 -> "HH:MM"（含 24:00）
+
+# ---------------- 数据结构 ----------------
+ActionValue = Union[str, list, dict]  # 行为：字符串，或备选行为（等权列表 / {行为: 权重}）
+
+@dataclass(slots=True)
+class RoutineItem:
+    day: int                 # 0..6  (Mon..Sun)
+    start: time
+    end: time
+    action: str
+    raw_range: str           # "HH:MM-HH:MM"
+
+class _AliasTable:
+    """一组加权备选行为的别名表（Vose）：加载时构建，pick 为 O(1)，与备选数量无关。
+    value 为规范化后的配置写法（列表或 {行为: 权重}），用于原样写回配置。
+    """
+    __slots__ = ("names", "prob", "alias", "value")
+
+    def __init__(self, names: List[str], weights: List[float], value):
+        n = len(names)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.names = names
+        self.prob = array("d", [1.0] * n)
+        self.alias = array("I", range(n))
+        self.value = value
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s], self.alias[s] = scaled[s], l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # 剩余项（含浮点误差留下的）概率为 1
+
+    def pick(self, u: float) -> int:
+        """u ∈ [0, 1) 映射为备选序号"""
+        x = u * len(self.names)
+        i = int(x)
+        return i if x - i < self.prob[i] else self.alias[i]
+
+def _clean_action(value) -> Optional[ActionValue]:
+    """规范化配置中的行为：字符串去空白；列表为等权备选，{行为: 权重} 为加权备选（权重须为正数）。
+    空值返回 None；只剩一个备选时退化为字符串，与旧配置完全一致。
+    """
+    if isinstance(value, list):
+        names = [str(v).strip() for v in value if not isinstance(v, (list, dict)) and str(v).strip()]
+        return (names if len(names) > 1 else names[0]) if names else None
+    if isinstance(value, dict):
+        out = {}
+        for name, weight in value.items():
+            name = str(name).strip()
+            if name and isinstance(weight, (int, float)) and not isinstance(weight, bool) \
+                    and 0 < weight < math.inf:
+                out[name] = weight
+        return (out if len(out) > 1 else next(iter(out))) if out else None
+    text = str(value).strip() if value is not None else ""
+    return text or None
+
+def _parse_action(value) -> Tuple[str, Optional[_AliasTable]]:
+    """配置中的行为 -> (行为写法, 别名表或 None)。备选行为的写法为 "A / B"（加权时为 "A×3 / B×1"），
+    仅用于显示：字面量 "A / B" 与列表 ["A", "B"] 写法相同，去重与查找须用 _action_key。
+    """
+    value = _clean_action(value)
+    if value is None:
+        return "", None
+    if isinstance(value, str):
+        return value, None
+    if isinstance(value, list):
+        names, weights = value, [1.0] * len(value)
+        label = " / ".join(names)
+    else:
+        names, weights = list(value), [float(w) for w in value.values()]
+        label = " / ".join(f"{k}×{w:g}" for k, w in value.items()) if len(set(weights)) > 1 else " / ".join(names)
+    return label, _AliasTable(names, weights, value)
+
+def _action_key(action: str, alias: Optional[_AliasTable]):
+    """行为的去重键：普通行为为字符串本身，备选行为为其配置写法的 JSON（与任何字符串都不相等）"""
+    return action if alias is None else ("alt", json.dumps(alias.value, ensure_ascii=False))
+
+def _mix64(x: int) -> int:
+    """splitmix64：把整数种子打散为 64 位，跨进程稳定（不受 PYTHONHASHSEED 影响）"""
+    x = (x + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+def _seed_unit(seed: int) -> float:
+    """种子 -> [0, 1) 内的确定值"""
+    return (_mix64(seed) >> 11) * (1.0 / (1 << 53))
+
+class _SlotTable:
+    """紧凑的时段存储：星期、起止分钟与行为序号各占一个 array，
+    行为字符串去重（并 sys.intern）后按序号存放，多个方案中相同的行为共享同一对象。
+    备选行为按配置写法去重（见 _action_key），actions 中为其显示写法，别名表按行为序号存于 variants。
+
+    下标访问与迭代按需生成 RoutineItem 视图，供 _export_runtime_config 等既有调用方使用。
+    """
+    __slots__ = ("days", "starts", "ends", "action_ids", "actions", "variants", "_ids")
+
+    def __init__(self):
+        self.days = array("B")
+        self.starts = array("H")       # 当天分钟数 0..1439
+        self.ends = array("H")         # 0 表示午夜（24:00）
+        self.action_ids = array("H")   # 不同行为超过 65535 种时自动升级为 "I"
+        self.actions: List[str] = []
+        self.variants: Dict[int, _AliasTable] = {}  # 行为序号 -> 别名表
+        self._ids: dict = {}
+
+    def append(self, day: int, start: int, end: int, action: str, variants: Optional[_AliasTable] = None):
+        key = _action_key(action, variants)
+        aid = self._ids.get(key)
+        if aid is None:
+            aid = self._ids[key] = len(self.actions)
+            self.actions.append(sys.intern(action))
+            if variants is not None:
+                self.variants[aid] = variants
+            if aid > 0xFFFF and self.action_ids.typecode == "H":
+                self.action_ids = array("I", self.action_ids)
+        self.days.append(day)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.action_ids.append(aid)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __getitem__(self, i: int) -> RoutineItem:
+        s, e = self.starts[i], self.ends[i]
+        return RoutineItem(self.days[i], time(s // 60, s % 60), time(e // 60, e % 60),
+                           self.actions[self.action_ids[i]], self.range_key(i))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self.days)))
+
+    def action(self, i: int) -> str:
+        return self.actions[self.action_ids[i]]
+
+    def alias(self, i: int) -> Optional[_AliasTable]:
+        """第 i 个时段的别名表（非备选行为为 None）"""
+        return self.variants.get(self.action_ids[i])
+
+    def value(self, i: int) -> ActionValue:
+        """第 i 个时段的配置写法（备选行为为列表 / 字典）"""
+        alias = self.variants.get(self.action_ids[i])
+        return alias.value if alias is not None else self.actions[self.action_ids[i]]
+
+    def range_key(self, i: int) -> str:
+        """同 _range_key，不经过 time 对象"""
+        return f"{_HHMM[self.starts[i]]}-{_HHMM[self.ends[i] or _DAY_MINUTES]}"
+
+    def span(self, i: int) -> Tuple[int, int]:
+        """同 _item_span，直接读取数组"""
+        s = self.starts[i]
+        start = self.days[i] * _DAY_MINUTES + s
+        return start, start + ((self.ends[i] - s) % _DAY_MINUTES or _DAY_MINUTES)
+
+# ---------------- 工具函数 ----------------
+def _parse_hhmm(s: str) -> time:
+    hh, mm = s.split(":")
+    if int(hh) == 24 and int(mm) == 0:
+        return time(0, 0)  # "24:00" 仅作为结束时间出现，等价于次日 00:00
+    return time(hour=int(hh), minute=int(mm))
+
+def _parse_range(range_str: str) -> Tuple[time, time]:
+    s, e = range_str.split("-")
+    return _parse_hhmm(s.strip()), _parse_hhmm(e.strip())
+
+def _minutes(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+def _range_key(start: time, end: time) -> str:
+    """时段的规范写法；结束于 00:00 的写作 24:00"""
+    return f"{start:%H:%M}-" + ("24:00" if _minutes(end) == 0 else f"{end:%H:%M}")
+
+def _item_span(it: RoutineItem) -> Tuple[int, int]:
+    """返回时段在周内的 [起, 止) 分钟数；结束不晚于开始的视为跨越午夜"""
+    start = it.day * _DAY_MINUTES + _minutes(it.start)
+    length = (_minutes(it.end) - _minutes(it.start)) % _DAY_MINUTES or _DAY_MINUTES
+    return start, start + length
+
+def _check_range(range_str: str) -> Tuple[time, time]:
+    """解析并校验单个时段，不合法时抛出 ValueError（附原因）"""
+    try:
+        s, e = _parse_range(range_str)
+    except Exception:
+        raise ValueError(f"无法解析的时段 {range_str!r}，应为 HH:MM-HH:MM") from None
+    if s == e and not range_str.strip().endswith("24:00"):
+        raise ValueError(f"零长度时段 {range_str!r}")  # 00:00-24:00 表示全天
+    return s, e
+
+def _compile_schedule(sched_conf) -> _SlotTable:
+    """将配置中的 {Mon:{'07:00-08:00':'X'}, ...} 编译为紧凑的 _SlotTable（不合法的时段跳过）"""
+    table = _SlotTable()
+    if isinstance(sched_conf, dict):
+        for day_idx, k in enumerate(WEEK_KEYS):
+            sub = sched_conf.get(k, {}) or {}
+            if not isinstance(sub, dict):
+                continue
+            for rng, act in sub.items():
+                try:
+                    s, e = _check_range(str(rng))
+                except ValueError:
+                    continue
+                table.append(day_idx, _minutes(s), _minutes(e), *_parse_action(act))
+    return table
+
+def _normalize_schedule(sched_conf) -> List[RoutineItem]:
+    """将配置中的 {Mon:{'07:00-08:00':'X'}, ...} 规范为 RoutineItem 列表（不合法的时段跳过）"""
+    return list(_compile_schedule(sched_conf))
+
+def _sweep(pieces: list, lo: int, hi: int) -> Tuple[List[int], list]:
+    """扫描线：把可能重叠的区间 [(起, 止, 优先级, 时段)] 压平为互不重叠的区段。
+
+    返回 (bounds, items)：bounds[i] 为第 i 个区段的起点（首个为 lo），区段延续到 bounds[i+1]
+    （末段到 hi），items[i] 为该区段生效的时段（None 表示无）。重叠时优先级值小者胜出。
+    """
+    starts: dict = {}
+    ends: dict = {}
+    by_prio: dict = {}
+    for ps, pe, prio, item in pieces:
+        starts.setdefault(ps, []).append(prio)
+        ends.setdefault(pe, []).append(prio)
+        by_prio[prio] = item
+
+    # 堆中保存当前覆盖的优先级，堆顶即生效者（惰性删除）
+    points = sorted(p for p in {lo, *starts, *ends} if p < hi)
+    active, heap = set(), []
+    bounds: List[int] = []
+    items: list = []
+    for p in points:
+        for prio in ends.get(p, ()):
+            active.discard(prio)
+        for prio in starts.get(p, ()):
+            active.add(prio)
+            heapq.heappush(heap, prio)
+        while heap and heap[0] not in active:
+            heapq.heappop(heap)
+        cur = by_prio[heap[0]] if heap else None
+        if items and items[-1] == cur:
+            continue  # 相邻区段同属一个时段，合并
+        bounds.append(p)
+        items.append(cur)
+    return bounds, items
+
+class _WeekIndex:
+    """按周内分钟数编译的区间索引。
+
+    bounds[i] 为第 i 个区段的起点，区段延续到 bounds[i+1]（末段到周末），
+    slots[i] 为该区段生效的时段在 _SlotTable 中的序号（-1 表示空闲）。查询为一次二分。
+    时段重叠时保持原有语义：配置中靠前的时段优先。
+    """
+    __slots__ = ("bounds", "slots")
+
+    def __init__(self, table: _SlotTable):
+        pieces = []
+        for order in range(len(table)):
+            s, e = table.span(order)
+            if e <= _WEEK_MINUTES:
+                pieces.append((s, e, order, order))
+            else:  # 周日跨午夜到周一
+                pieces.append((s, _WEEK_MINUTES, order, order))
+                pieces.append((0, e - _WEEK_MINUTES, order, order))
+        bounds, slots = _sweep(pieces, 0, _WEEK_MINUTES)
+        self.bounds = array("H", bounds)
+        self.slots = array("i", (-1 if x is None else x for x in slots))
+
+    def lookup(self, minute: int) -> Tuple[int, int, int]:
+        """返回 (时段序号或 -1, 区段起点, 区段终点)，单位均为周内分钟数"""
+        i = bisect_right(self.bounds, minute) - 1
+        end = self.bounds[i + 1] if i + 1 < len(self.bounds) else _WEEK_MINUTES
+        return self.slots[i], self.bounds[i], end
+
+# ---------------- 校验与整理 ----------------
+_MAX_ISSUES = 200     # 每类问题最多列出的条数（counts 中为总数）
+_MAX_OVERLAP_LIST = 5  # 每处重叠最多列出的时段数
+
+def _day_pieces(start: int, end: int):
+    """把周内区间 [start, end) 按天拆开，逐段产出 (星期序号, 当天起点, 当天终点)"""
+    while start < end:
+        day = start // _DAY_MINUTES
+        stop = min(end, (day + 1) * _DAY_MINUTES)
+        yield day % 7, start - day * _DAY_MINUTES, stop - day * _DAY_MINUTES
+        start = stop
+
+def _validate_schedule(sched_conf) -> dict:
+    """扫描线校验作息表（O(n log n)），按天报告无法解析的时段、重叠与空闲：
+
+    {"days": {"Mon": {"invalid": [{"range", "error"}], "overlaps": [{"range", "ranges"}], "gaps": ["HH:MM-HH:MM"]}},
+     "counts": {"invalid": n, "overlaps": n, "gaps": n}}
+
+    overlaps 的 ranges 按优先级排列，首个即实际生效的时段（配置中靠前者）；跨午夜的区间按天拆开。
+    """
+    days = {k: {"invalid": [], "overlaps": [], "gaps": []} for k in WEEK_KEYS}
+    counts = {"invalid": 0, "overlaps": 0, "gaps": 0}
+
+    def report(kind: str, day: int, entry):
+        counts[kind] += 1
+        if counts[kind] <= _MAX_ISSUES:
+            days[WEEK_KEYS[day]][kind].append(entry)
+
+    # 1. 逐条解析，收集合法时段的周内区间
+    keys, events = [], []
+    conf = sched_conf if isinstance(sched_conf, dict) else {}
+    for day, k in enumerate(WEEK_KEYS):
+        sub = conf.get(k) or {}
+        if not isinstance(sub, dict):
+            report("invalid", day, {"range": None, "error": "当天的日程应为 {\"HH:MM-HH:MM\": 行为}"})
+            continue
+        for rng, act in sub.items():
+            try:
+                s, e = _check_range(str(rng))
+            except ValueError as exc:
+                report("invalid", day, {"range": str(rng), "error": str(exc)})
+                continue
+            if _clean_action(act) is None:
+                report("invalid", day, {"range": str(rng), "error": "行为为空"})
+            order = len(keys)
+            keys.append(str(rng))
+            start = day * _DAY_MINUTES + _minutes(s)
+            end = start + ((_minutes(e) - _minutes(s)) % _DAY_MINUTES or _DAY_MINUTES)
+            spans = [(start, end)] if end <= _WEEK_MINUTES else [(start, _WEEK_MINUTES), (0, end - _WEEK_MINUTES)]
+            for ps, pe in spans:
+                events.append((ps, 1, order))
+                events.append((pe, 0, order))  # 同一时刻先结束后开始，首尾相接不算重叠
+
+    # 2. 扫描线：每个事件点都会改变覆盖集合，两点之间的区段按覆盖数报告
+    events.sort()
+    active: set = set()
+    last, i, n = 0, 0, len(events)
+    while i <= n:
+        pos = events[i][0] if i < n else _WEEK_MINUTES
+        if pos > last:
+            if not active:
+                for day, ds, de in _day_pieces(last, pos):
+                    report("gaps", day, f"{_HHMM[ds]}-{_HHMM[de]}")
+            elif len(active) > 1:
+                ranges = [keys[o] for o in heapq.nsmallest(_MAX_OVERLAP_LIST, active)] \
+                    if counts["overlaps"] < _MAX_ISSUES else []
+                for day, ds, de in _day_pieces(last, pos):
+                    report("overlaps", day, {"range": f"{_HHMM[ds]}-{_HHMM[de]}", "ranges": ranges})
+        if i == n:
+            break
+        while i < n and events[i][0] == pos:
+            _, starting, order = events[i]
+            if starting:
+                active.add(order)
+            else:
+                active.discard(order)
+            i += 1
+        last = pos
+    return {"days": days, "counts": counts}
+
+def _merge_adjacent(sched_conf) -> dict:
+    """按实际生效结果重建作息表：去掉被遮挡的部分，合并首尾相接的相同行为。
+
+    查询结果与原表完全一致，但时段更少、互不重叠，编译后的索引也更小。
+    """
+    table = _compile_schedule(sched_conf)
+    index = _WeekIndex(table)
+    segs = []  # [起, 止, 行为]
+    for i, slot in enumerate(index.slots):
+        if slot < 0:
+            continue
+        start = index.bounds[i]
+        end = index.bounds[i + 1] if i + 1 < len(index.bounds) else _WEEK_MINUTES
+        action = table.value(slot)
+        if segs and segs[-1][1] == start and segs[-1][2] == action:
+            segs[-1][1] = end
+        else:
+            segs.append([start, end, action])
+    # 周日延续到周一的同一行为
+    if len(segs) > 1 and segs[0][0] == 0 and segs[-1][1] == _WEEK_MINUTES and segs[0][2] == segs[-1][2]:
+        first = segs.pop(0)
+        segs[-1][1] = _WEEK_MINUTES + first[1]
+
+    out = {k: {} for k in WEEK_KEYS}
+    for start, end, action in segs:
+        pieces = list(_day_pieces(start, end))
+        j = 0
+        while j < len(pieces):
+            day, ds, de = pieces[j]
+            # 到午夜为止、次日从 00:00 开始且合计不足一天的两段，写成一个跨午夜时段
+            if de == _DAY_MINUTES and ds > 0 and j + 1 < len(pieces) and pieces[j + 1][2] < ds:
+                out[WEEK_KEYS[day]][f"{_HHMM[ds]}-{_HHMM[pieces[j + 1][2]]}"] = action
+                j += 2
+                continue
+            out[WEEK_KEYS[day]][f"{_HHMM[ds]}-{_HHMM[de]}"] = action
+            j += 1
+    return out
+
+# ---------------- 日期覆盖 ----------------
+CLEARED = RoutineItem(day=0, start=time(0), end=time(0), action="", raw_range="")  # replace 覆盖清空的时间
+_MAX_OVERRIDE_DAYS = 366  # 按时段覆盖（逐天展开）的最长天数；全天覆盖编译为一个区间，不受限制
+
+def _override_dates(entry) -> Optional[Tuple[date, date]]:
+    """覆盖项的 [起, 止] 日期（均含）；格式不合法时返回 None"""
+    if not isinstance(entry, dict):
+        return None
+    try:
+        first = date.fromisoformat(str(entry["date"]).strip())
+        last = date.fromisoformat(str(entry.get("to") or entry["date"]).strip())
+    except (KeyError, ValueError):
+        return None
+    return (first, last) if first <= last else None
+
+def _override_slots(entry: dict) -> dict:
+    """覆盖项的时段表；只写了 action 的视为全天"""
+    slots = entry.get("slots")
+    if isinstance(slots, dict):
+        return slots
+    return {"00:00-24:00": entry["action"]} if entry.get("action") else {}
+
+def _whole_day(s: time, e: time) -> bool:
+    return s == e == time(0)  # 00:00-24:00
+
+def _check_override(entry) -> Optional[str]:
+    """校验单个覆盖项，返回错误描述；合法时返回 None"""
+    if not isinstance(entry, dict):
+        return "覆盖项应为对象"
+    if _override_dates(entry) is None:
+        return "date / to 应为 YYYY-MM-DD，且 to 不早于 date"
+    if "slots" in entry and not isinstance(entry["slots"], dict):
+        return "slots 应为 {\"HH:MM-HH:MM\": 行为}"
+    slots = _override_slots(entry)
+    if not slots and not entry.get("replace"):
+        return "需要 slots 或 action（或以 replace: true 清空当天）"
+    first, last = _override_dates(entry)
+    for rng, act in slots.items():
+        try:
+            s, e = _check_range(str(rng))
+        except ValueError as exc:
+            return str(exc)
+        if _clean_action(act) is None:
+            return f"时段 {rng!r} 的行为为空"
+        if not _whole_day(s, e) and (last - first).days >= _MAX_OVERRIDE_DAYS:
+            return f"按时段覆盖最长 {_MAX_OVERRIDE_DAYS} 天（全天覆盖不受限制）"
+    if not isinstance(entry.get("replace", False), bool):
+        return "replace 应为 true / false"
+    return None
+
+def _override_issues(overrides) -> List[dict]:
+    """配置中不合法的覆盖项 [{"index": 序号, "error": 描述}]；这些项在编译时被忽略，保存时被丢弃"""
+    if overrides is None:
+        return []
+    if not isinstance(overrides, list):
+        return [{"index": None, "error": "overrides 应为列表"}]
+    return [{"index": i, "error": err} for i, err in enumerate(map(_check_override, overrides)) if err]
+
+def _prune_overrides(overrides, today: date) -> list:
+    """去掉已过期的覆盖项（结束日期早于昨天；跨午夜的时段最多延续到次日）与日期无法解析的项"""
+    if not isinstance(overrides, list):
+        return []
+    keep = today - timedelta(days=1)
+    out = []
+    for o in overrides:
+        span = _override_dates(o)
+        if span is not None and span[1] >= keep:
+            out.append(o)
+    return out
+
+class _DateIndex:
+    """日期覆盖（节假日、临时安排）的区间索引，优先于每周作息表。
+
+    时间轴为本地墙上时间的 日期序数 * 1440 + 分钟，编译方式同 _WeekIndex；
+    多年累积的覆盖项也只是一次二分。已过期的覆盖项在编译时丢弃。
+    items 中的 CLEARED 表示该时间被 replace 覆盖清空（不回落到每周作息表）；
+    variants 为区段序号 -> 别名表，只记录备选行为所在的区段。
+    """
+    __slots__ = ("bounds", "items", "variants")
+
+    def __init__(self, overrides, today: Optional[date] = None):
+        pieces = []
+        if today is not None:
+            overrides = _prune_overrides(overrides, today)
+        for order, entry in enumerate(overrides if isinstance(overrides, list) else ()):
+            span = _override_dates(entry)
+            if span is None:
+                continue
+            first, last = span
+            if today is not None:
+                first = max(first, today - timedelta(days=1))
+            slots = []
+            for rng, act in _override_slots(entry).items():
+                try:
+                    s, e = _check_range(str(rng))
+                except ValueError:
+                    continue
+                act, alias = _parse_action(act)
+                if act:
+                    slots.append((s, e, act, alias, str(rng)))
+            replace = bool(entry.get("replace", "slots" not in entry))
+            # 全天时段与 replace 清空覆盖整段日期，编译为一个区间；其余时段逐天展开（最多 _MAX_OVERRIDE_DAYS 天）
+            lo, hi = first.toordinal() * _DAY_MINUTES, (last.toordinal() + 1) * _DAY_MINUTES
+            run = f"{first}~{last}" if first < last else str(first)
+            partial = []
+            for n, (s, e, act, alias, rng) in enumerate(slots):
+                if _whole_day(s, e):
+                    it = RoutineItem(day=first.weekday(), start=s, end=e, action=act, raw_range=f"{run} {rng}")
+                    pieces.append((lo, hi, (0, order, n, lo), (it, alias)))
+                else:
+                    partial.append((n, s, e, act, alias, rng))
+            if replace:
+                pieces.append((lo, hi, (1, order, 0, lo), CLEARED))
+            day, last = first, min(last, first + timedelta(days=_MAX_OVERRIDE_DAYS - 1))
+            while partial and day <= last:
+                base = day.toordinal() * _DAY_MINUTES
+                for n, s, e, act, alias, rng in partial:
+                    ps = base + _minutes(s)
+                    pe = ps + ((_minutes(e) - _minutes(s)) % _DAY_MINUTES or _DAY_MINUTES)
+                    it = RoutineItem(day=day.weekday(), start=s, end=e, action=act, raw_range=f"{day} {rng}")
+                    pieces.append((ps, pe, (0, order, n, base), (it, alias)))
+                day += timedelta(days=1)
+        # 区段载荷为 (时段, 别名表)，别名表按对象比较，写法相同的普通行为与备选行为不会被合并
+        self.bounds, segs = _sweep(pieces, 0, _FAR_MINUTE) if pieces else ([0], [None])
+        self.items = [seg if seg is None or seg is CLEARED else seg[0] for seg in segs]
+        self.variants: Dict[int, _AliasTable] = {
+            i: seg[1] for i, seg in enumerate(segs) if isinstance(seg, tuple) and seg[1] is not None
+        }
+
+    def __bool__(self) -> bool:
+        return len(self.bounds) > 1
+
+    def lookup(self, minute: int) -> Tuple[Optional[RoutineItem], Optional[_AliasTable], int, int]:
+        """返回 (覆盖时段或 None, 别名表或 None, 区段起点, 区段终点)，单位为日期序数分钟"""
+        i = bisect_right(self.bounds, minute) - 1
+        end = self.bounds[i + 1] if i + 1 < len(self.bounds) else _FAR_MINUTE
+        return self.items[i], self.variants.get(i), self.bounds[i], end
+
+# ---------------- 批量解析 ----------------
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_OFFSET_PROBE = 7 * 86400  # 查找时区偏移切换的探测步长（假定相邻两次切换相隔不短于一周）
+
+def _offset_spans(tz, lo: int, hi: int) -> Tuple[List[int], List[int]]:
+    """时间戳区间 [lo, hi] 内 tz 的 UTC 偏移分段，返回 (各段起点, 偏移秒数)。
+    按周探测，发现偏移变化后二分到秒，跨一年也只需几十次时区查询。
+    """
+    def offset(ts: int) -> int:
+        return int(datetime.fromtimestamp(ts, tz).utcoffset().total_seconds())
+
+    starts, offsets = [lo], [offset(lo)]
+    t = lo
+    while t < hi:
+        probe = min(hi, t + _OFFSET_PROBE)
+        if offset(probe) == offsets[-1]:
+            t = probe
+            continue
+        a, b = t, probe
+        while b - a > 1:
+            mid = (a + b) // 2
+            if offset(mid) == offsets[-1]:
+                a = mid
+            else:
+                b = mid
+        starts.append(b)
+        offsets.append(offset(b))
+        t = b
+    return starts, offsets
+
+def _as_timestamps(values, tz) -> list:
+    """datetime（无时区的按 tz 的墙上时间理解）或 POSIX 时间戳 -> 时间戳列表"""
+    out = []
+    for v in values:
+        if isinstance(v, datetime):
+            out.append((v if v.tzinfo is not None else v.replace(tzinfo=tz)).timestamp())
+        else:
+            out.append(float(v))
+    return out
+
+class _BatchResolver:
+    """一次解析一批时间戳：周内索引与日期覆盖索引展开为查找数组，
+    有 numpy 时整批 searchsorted，否则逐个 bisect，两者结果相同。
+
+    每个结果为 (行为或 None, 时段写法)，与逐个查询时 resolve() 的前两项一致。
+    """
+    __slots__ = ("week_bounds", "week_codes", "date_bounds", "date_codes", "labels", "_arrays")
+
+    def __init__(self, table: _SlotTable, index: _WeekIndex, dates: Optional[_DateIndex] = None):
+        # 标签表：周内时段在前，覆盖时段在后，末尾为“未定义”，故序号 -1 即未定义
+        labels = [(table.action(i), table.range_key(i)) for i in range(len(table))]
+        self.week_bounds = list(index.bounds)
+        self.week_codes = list(index.slots)
+        self.date_bounds: Optional[list] = None
+        self.date_codes: Optional[list] = None
+        if dates:
+            self.date_bounds = list(dates.bounds)
+            self.date_codes = []  # -2 表示未被覆盖，回落到每周作息
+            for it in dates.items:
+                if it is None:
+                    self.date_codes.append(-2)
+                elif it is CLEARED:
+                    self.date_codes.append(-1)
+                else:
+                    self.date_codes.append(len(labels))
+                    labels.append((it.action, it.raw_range))
+        labels.append((None, "—"))
+        self.labels = labels
+        self._arrays = None
+
+    def resolve_many(self, timestamps, tz=None) -> list:
+        """解析一批 datetime 或 POSIX 时间戳（按 tz 的墙上时间计算，缺省为 UTC）"""
+        tz = tz or timezone.utc
+        if np is not None:
+            return self._resolve_numpy(timestamps, tz)
+        stamps = _as_timestamps(timestamps, tz)
+        if not stamps:
+            return []
+        floors = [math.floor(t) for t in stamps]
+        starts, offsets = _offset_spans(tz, min(floors), max(floors))
+        week_bounds, week_codes = self.week_bounds, self.week_codes
+        date_bounds, date_codes, labels = self.date_bounds, self.date_codes, self.labels
+        out = []
+        for t in floors:
+            days, secs = divmod(t + offsets[bisect_right(starts, t) - 1], 86400)
+            clock = secs // 60
+            code = -2
+            if date_codes is not None:
+                code = date_codes[bisect_right(date_bounds, (days + _EPOCH_ORDINAL) * _DAY_MINUTES + clock) - 1]
+            if code == -2:
+                code = week_codes[bisect_right(week_bounds, (days + 3) % 7 * _DAY_MINUTES + clock) - 1]
+            out.append(labels[code])
+        return out
+
+    def _resolve_numpy(self, timestamps, tz) -> list:
+        if self._arrays is None:
+            labels = np.empty(len(self.labels), dtype=object)
+            for i, label in enumerate(self.labels):
+                labels[i] = label
+            self._arrays = (
+                np.asarray(self.week_bounds, dtype=np.int64), np.asarray(self.week_codes, dtype=np.int64),
+                None if self.date_codes is None else np.asarray(self.date_bounds, dtype=np.int64),
+                None if self.date_codes is None else np.asarray(self.date_codes, dtype=np.int64),
+                labels,
+            )
+        week_bounds, week_codes, date_bounds, date_codes, labels = self._arrays
+        if isinstance(timestamps, np.ndarray) and timestamps.dtype.kind in "iuf":
+            stamps = np.floor(timestamps).astype(np.int64)
+        else:
+            stamps = np.floor(np.asarray(_as_timestamps(timestamps, tz), dtype=np.float64)).astype(np.int64)
+        if not stamps.size:
+            return []
+        starts, offsets = _offset_spans(tz, int(stamps.min()), int(stamps.max()))
+        local = stamps + np.asarray(offsets, dtype=np.int64)[np.searchsorted(starts, stamps, side="right") - 1]
+        days, clock = np.divmod(local, 86400)
+        clock //= 60
+        codes = week_codes[np.searchsorted(week_bounds, (days + 3) % 7 * _DAY_MINUTES + clock, side="right") - 1]
+        if date_codes is not None:
+            over = date_codes[np.searchsorted(date_bounds, (days + _EPOCH_ORDINAL) * _DAY_MINUTES + clock,
+                                              side="right") - 1]
+            codes = np.where(over == -2, codes, over)
+        return labels[codes].tolist()
+
+# ---------------- 提示词模板 ----------------
+class _PromptTemplate:
+    """加载时预编译的提示词模板：拆分为字面量与 {action}/{now} 字段片段。
+
+    模板语法错误或引用了未知字段时在构造阶段抛出 ValueError，
+    请求路径上只剩代入 {now} 的一次 join。
+    budget 为渲染结果的字符上限（0 为不限）：超出时截断 action，每个行为只截断、代入一次。
+    模板的固定部分已超出 budget 时，budget 提高到至少能给每个 action 留一个字符（“…”）。
+    """
+    __slots__ = ("source", "budget", "_segments", "_now_formats", "_room", "_bound")
+    _FIELDS = ("action", "now")
+
+    def __init__(self, source: str, budget: int = 0):
+        self.source = source
+        self.budget = budget
+        self._segments: list = []
+        self._now_formats: List[Tuple[Optional[str], str]] = []
+        self._room: Optional[int] = None  # action 可用的字符数
+        self._bound: Dict[str, List[str]] = {}
+        for literal, field, spec, conv in Formatter().parse(source):
+            if literal:
+                self._segments.append(literal)
+            if field is None:
+                continue
+            if field not in self._FIELDS:
+                raise ValueError(f"unknown field {{{field}}} in prompt template")
+            if conv not in (None, "r", "s", "a"):
+                raise ValueError(f"unknown conversion !{conv} in prompt template")
+            self._segments.append((field, conv, spec))
+            if field == "now":
+                self._now_formats.append((conv, spec))
+        # 用样例值试渲染一次，提前暴露格式说明符错误；同时得到除 action 以外的固定长度
+        fixed = self._length(self._bind(""))
+        fields = sum(1 for seg in self._segments if not isinstance(seg, str) and seg[0] == "action")
+        if budget > 0:
+            self.budget = max(budget, fixed + fields)
+            if fields:
+                self._room = (self.budget - fixed) // fields
+
+    @staticmethod
+    def _format_field(value: str, conv: Optional[str], spec: str) -> str:
+        if conv == "r":
+            value = repr(value)
+        elif conv == "a":
+            value = ascii(value)
+        return format(value, spec) if spec else value
+
+    def bind(self, action: str) -> List[str]:
+        """代入 action（超出预算时先截断），返回以 {now} 为分隔的字面量片段；结果按行为缓存"""
+        chunks = self._bound.get(action)
+        if chunks is None:
+            room = self._room
+            fitted = action if room is None or len(action) <= room else action[:room - 1] + "…"
+            chunks = self._bind(fitted)
+            # !r 等转换会改变长度，按实际渲染结果再收紧
+            while room is not None and len(fitted) > 1 and self._length(chunks) > self.budget:
+                room -= 1
+                fitted = action[:room - 1] + "…"
+                chunks = self._bind(fitted)
+            self._bound[action] = chunks
+        return chunks
+
+    def _length(self, chunks: List[str]) -> int:
+        return len(self.render(chunks, _NOW_SAMPLE))
+
+    def _bind(self, action: str) -> List[str]:
+        chunks, buf = [], []
+        for seg in self._segments:
+            if isinstance(seg, str):
+                buf.append(seg)
+            elif seg[0] == "action":
+                buf.append(self._format_field(action, seg[1], seg[2]))
+            else:
+                chunks.append("".join(buf))
+                buf = []
+        chunks.append("".join(buf))
+        return chunks
+
+    def render(self, chunks: List[str], now_str: str) -> str:
+        if all(conv is None and not spec for conv, spec in self._now_formats):
+            return now_str.join(chunks)
+        out = [chunks[0]]
+        for (conv, spec), chunk in zip(self._now_formats, chunks[1:]):
+            out.append(self._format_field(now_str, conv, spec))
+            out.append(chunk)
+        return "".join(out)
+
+# ---------------- 配置文件 ----------------
+def _profile_holder(cfg: dict, profile: str, create: bool = False):
+    """取方案的配置字典（默认方案即顶层配置）；不存在且 create=False 时返回 None"""
+    if profile == DEFAULT_PROFILE:
+        return cfg
+    profiles = cfg.get("profiles")
+    if not isinstance(profiles, dict):
+        if not create:
+            return None
+        profiles = cfg["profiles"] = {}
+    holder = profiles.get(profile)
+    if not isinstance(holder, dict):
+        if not create:
+            return None
+        holder = profiles[profile] = {}
+    return holder
+
+def _profile_schedule(cfg: dict, profile: str, create: bool = False):
+    """取方案对应的 schedule 字典（默认方案即顶层 schedule）；不存在且 create=False 时返回 None"""
+    holder = _profile_holder(cfg, profile, create)
+    if holder is None:
+        return None
+    schedule = holder.get("schedule")
+    if not isinstance(schedule, dict):
+        if not create and holder is not cfg:
+            return None
+        schedule = holder["schedule"] = {}
+    return schedule
+
+def _write_json_atomic(path: str, data: dict) -> Tuple[os.stat_result, bytes]:
+    """原子写入 JSON：先写同目录临时文件并 fsync，再 rename 覆盖，读者不会看到半截文件。
+    返回 (新文件的 stat, 写入的字节)；失败时抛出 OSError。
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".routine_config.", suffix=".tmp",
+        dir=os.path.dirname(os.path.abspath(path))
+    )
+    try:
+        raw = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        if os.path.exists(path):
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        os.replace(tmp_path, path)
+        return st, raw
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,379 @@
+"""作息表的批量导入导出：CSV 与 iCalendar（每周重复的 VEVENT）。
+
+解析器逐行读取文本流，内存占用与文件大小无关；每一行（iCalendar 为每个事件）
+产出 ImportRow，不合法的行带上错误原因，而不是像 _normalize_schedule 那样静默跳过。
+"""
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Iterator, List, NamedTuple, Optional, TextIO
+from zoneinfo import ZoneInfo
+
+try:
+    from .routine_core import (
+        WEEK_KEYS, DEFAULT_PROFILE, _check_range, _compile_schedule, _range_key, _profile_schedule,
+        _clean_action,
+    )
+except ImportError:  # 非包方式加载（WebUI 独立进程 / 基准脚本）
+    from routine_core import (
+        WEEK_KEYS, DEFAULT_PROFILE, _check_range, _compile_schedule, _range_key, _profile_schedule,
+        _clean_action,
+    )
+
+FORMATS = ("csv", "ics")
+_MAX_ERRORS = 200              # 报告中保留的错误明细条数（总数另计）
+_MAX_LINE = 64 * 1024          # iCalendar 单个逻辑行的上限，超出的内容丢弃并报错
+_ICS_DAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+_ICS_ANCHOR = date(2024, 1, 1)  # 导出时以该周（周一）为每周重复事件的起点
+
+
+def _day_aliases() -> dict:
+    """星期写法 → WEEK_KEYS：Mon / Monday / MO / 1 / 周一 / 星期一 / 礼拜一（不区分大小写）"""
+    fulls = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+    aliases = {}
+    for i, key in enumerate(WEEK_KEYS):
+        cn = "一二三四五六日"[i]
+        for alias in (key, fulls[i], _ICS_DAYS[i], str(i + 1), f"周{cn}", f"星期{cn}", f"礼拜{cn}"):
+            aliases[alias.lower()] = key
+    aliases.update({"周天": "Sun", "星期天": "Sun", "礼拜天": "Sun", "0": "Sun"})
+    return aliases
+
+
+_DAY_ALIASES = _day_aliases()
+
+_CSV_COLUMNS = {
+    "day": "day", "weekday": "day", "星期": "day",
+    "range": "range", "时段": "range",
+    "start": "start", "开始": "start",
+    "end": "end", "结束": "end",
+    "action": "action", "行为": "action", "summary": "action",
+}
+
+
+class ImportRow(NamedTuple):
+    line: int                   # 源文件行号（iCalendar 为 BEGIN:VEVENT 所在行）
+    day: str = ""               # WEEK_KEYS 之一
+    range: str = ""             # 规范化后的 "HH:MM-HH:MM"
+    action: object = ""         # 字符串，或备选行为的列表 / {行为: 权重}
+    error: Optional[str] = None
+
+
+def detect_format(head: bytes) -> str:
+    """按文件开头识别格式：以 BEGIN:VCALENDAR 开头的为 iCalendar，其余按 CSV 处理"""
+    return "ics" if head.lstrip(b"\xef\xbb\xbf \t\r\n").upper().startswith(b"BEGIN:VCALENDAR") else "csv"
+
+
+def _row(line: int, day: str, rng: str, action: str) -> ImportRow:
+    """按 _normalize_schedule 的语义校验一行，出错时返回带原因的 ImportRow"""
+    key = _DAY_ALIASES.get(day.strip().lower())
+    if key is None:
+        return ImportRow(line, error=f"未知的星期 {day!r}")
+    try:
+        s, e = _check_range(rng)
+    except ValueError as exc:
+        return ImportRow(line, key, error=str(exc))
+    action = action.strip()
+    if action[:1] in ("[", "{"):  # 备选行为以 JSON 写在单元格中（export_csv 的写法）
+        try:
+            action = _clean_action(json.loads(action)) or ""
+        except ValueError:
+            pass
+    if not action:
+        return ImportRow(line, key, _range_key(s, e), error="行为为空")
+    return ImportRow(line, key, _range_key(s, e), action)
+
+
+# ---------------- CSV ----------------
+def parse_csv(fp: TextIO) -> Iterator[ImportRow]:
+    """逐行解析 CSV：day,range,action 或 day,start,end,action，可带表头（列名中英文均可）。
+    空行与 # 开头的注释行忽略。
+    """
+    reader = csv.reader(fp)
+    columns = None
+    while True:
+        try:
+            cells = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as exc:  # 例如字段超长，跳过该行继续
+            yield ImportRow(reader.line_num, error=f"CSV 格式错误：{exc}")
+            continue
+        cells = [c.strip() for c in cells]
+        if not any(cells) or cells[0].startswith("#"):
+            continue
+        if columns is None:
+            names = [_CSV_COLUMNS.get(c.lower().lstrip("\ufeff")) for c in cells]
+            if "day" in names and "action" in names:
+                columns = names
+                continue
+            columns = ["day", "range", "action"] if len(cells) == 3 else ["day", "start", "end", "action"]
+        if len(cells) < len(columns):
+            yield ImportRow(reader.line_num, error=f"列数不足：需要 {len(columns)} 列，实际 {len(cells)} 列")
+            continue
+        values = {name: value for name, value in zip(columns, cells) if name}
+        rng = values.get("range") or f"{values.get('start', '')}-{values.get('end', '')}"
+        yield _row(reader.line_num, values.get("day", ""), rng, values.get("action", ""))
+
+
+def export_csv(schedule: dict) -> Iterator[str]:
+    """逐行导出 day,start,end,action（与 parse_csv 互逆）"""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\r\n")
+    writer.writerow(("day", "start", "end", "action"))
+    table = _compile_schedule(schedule)
+    for i in range(len(table)):
+        start, end = table.range_key(i).split("-")
+        value = table.value(i)
+        cell = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        writer.writerow((WEEK_KEYS[table.days[i]], start, end, cell))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+# ---------------- iCalendar ----------------
+def _ics_lines(fp: TextIO) -> Iterator[tuple]:
+    """展开折行，逐个产出 (行号, 逻辑行)；超长的逻辑行产出 (行号, None)"""
+    start, parts, size = 0, [], 0
+    for no, raw in enumerate(fp, 1):
+        raw = raw.rstrip("\r\n")
+        if raw[:1] in (" ", "\t") and start:
+            if size <= _MAX_LINE:
+                parts.append(raw[1:])
+                size += len(raw) - 1
+            continue
+        if start:
+            yield start, "".join(parts) if size <= _MAX_LINE else None
+        start, parts, size = no, [raw], len(raw)
+    if start:
+        yield start, "".join(parts) if size <= _MAX_LINE else None
+
+
+def _split_property(line: str):
+    """拆分 NAME;PARAM=V:VALUE，返回 (名称, 参数, 值)；参数值可带引号"""
+    quoted = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            quoted = not quoted
+        elif ch == ":" and not quoted:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return line.upper(), {}, ""
+    name, *params = head.split(";")
+    param_map = {}
+    for p in params:
+        k, _, v = p.partition("=")
+        param_map[k.upper()] = v.strip('"')
+    return name.upper(), param_map, value
+
+
+def _unescape_text(value: str) -> str:
+    out, i = [], 0
+    while i < len(value):
+        ch = value[i]
+        if ch == "\\" and i + 1 < len(value):
+            nxt = value[i + 1]
+            out.append("\n" if nxt in "nN" else nxt)
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
+
+
+def _escape_text(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _parse_ics_datetime(value: str, params: dict, tz: Optional[ZoneInfo]):
+    """解析 DTSTART/DTEND：返回 (datetime, 是否全天)。UTC 或带 TZID 的时间换算到目标时区"""
+    value = value.strip()
+    if params.get("VALUE") == "DATE" or len(value) == 8:
+        return datetime.strptime(value[:8], "%Y%m%d"), True
+    utc = value.endswith("Z")
+    dt = datetime.strptime(value.rstrip("Z")[:15], "%Y%m%dT%H%M%S")
+    src = ZoneInfo("UTC") if utc else None
+    if src is None and params.get("TZID"):
+        try:
+            src = ZoneInfo(params["TZID"])
+        except Exception:
+            src = None  # 未知的时区名（如 Windows 时区），按墙上时间处理
+    if src is not None and tz is not None:
+        dt = dt.replace(tzinfo=src).astimezone(tz).replace(tzinfo=None)
+    return dt, False
+
+
+def _parse_duration(value: str) -> timedelta:
+    """解析 RFC 5545 DURATION（如 PT1H30M、P1D）"""
+    sign = -1 if value.startswith("-") else 1
+    value = value.lstrip("+-")
+    if not value.startswith("P"):
+        raise ValueError(value)
+    total, num, in_time = timedelta(), "", False
+    units = {"W": timedelta(weeks=1), "D": timedelta(days=1)}
+    time_units = {"H": timedelta(hours=1), "M": timedelta(minutes=1), "S": timedelta(seconds=1)}
+    for ch in value[1:]:
+        if ch == "T":
+            in_time = True
+        elif ch.isdigit():
+            num += ch
+        else:
+            unit = (time_units if in_time else units).get(ch)
+            if unit is None or not num:
+                raise ValueError(value)
+            total += unit * int(num)
+            num = ""
+    return total * sign
+
+
+def _event_rows(line: int, props: dict, tz: Optional[ZoneInfo]) -> List[ImportRow]:
+    """把一个 VEVENT 展开为每周各天的时段"""
+    if "DTSTART" not in props:
+        return [ImportRow(line, error="事件缺少 DTSTART")]
+    rrule = props.get("RRULE")
+    if rrule is None:
+        return [ImportRow(line, error="非重复事件（缺少 RRULE），无法放入每周作息表")]
+    rule = dict(p.partition("=")[::2] for p in rrule[1].upper().split(";") if p)
+    freq = rule.get("FREQ")
+    if freq not in ("WEEKLY", "DAILY"):
+        return [ImportRow(line, error=f"不支持的重复频率 FREQ={freq}，仅支持 WEEKLY / DAILY")]
+    if rule.get("INTERVAL", "1") != "1":
+        return [ImportRow(line, error=f"不支持间隔重复 INTERVAL={rule['INTERVAL']}")]
+
+    try:
+        start, all_day = _parse_ics_datetime(props["DTSTART"][1], props["DTSTART"][0], tz)
+        if "DTEND" in props:
+            end, _ = _parse_ics_datetime(props["DTEND"][1], props["DTEND"][0], tz)
+        elif "DURATION" in props:
+            end = start + _parse_duration(props["DURATION"][1].strip())
+        else:
+            end = start + timedelta(days=1) if all_day else start
+    except ValueError as exc:
+        return [ImportRow(line, error=f"无法解析的时间：{exc}")]
+    span = end - start
+    if span <= timedelta(0):
+        return [ImportRow(line, error="事件结束时间不晚于开始时间")]
+    if span > timedelta(days=1) or (span == timedelta(days=1) and (start.hour, start.minute) != (0, 0)):
+        return [ImportRow(line, error="事件跨度超过一天")]
+
+    # 时区换算可能让开始时间落到前一天/后一天，BYDAY 随之平移
+    shift = (start.date() - datetime.strptime(props["DTSTART"][1].strip()[:8], "%Y%m%d").date()).days
+    if "BYDAY" in rule:
+        days = []
+        for code in rule["BYDAY"].split(","):
+            code = code.strip().lstrip("+-0123456789")
+            if code not in _ICS_DAYS:
+                return [ImportRow(line, error=f"无法识别的 BYDAY {code!r}")]
+            days.append((_ICS_DAYS.index(code) + shift) % 7)
+    elif freq == "DAILY":
+        days = list(range(7))
+    else:
+        days = [start.weekday()]
+
+    rng = f"{start:%H:%M}-" + ("24:00" if end.time() == datetime.min.time() else f"{end:%H:%M}")
+    summary = _unescape_text(props["SUMMARY"][1]) if "SUMMARY" in props else ""
+    return [_row(line, WEEK_KEYS[d], rng, summary) for d in days]
+
+
+def parse_ics(fp: TextIO, tz: Optional[ZoneInfo] = None) -> Iterator[ImportRow]:
+    """逐行解析 iCalendar，只取 VEVENT 的 DTSTART/DTEND/DURATION/RRULE/SUMMARY。
+    RRULE 的 UNTIL/COUNT 与 EXDATE 被忽略（作息表按周无限重复）。
+    """
+    event_line, props, nested = 0, None, 0
+    for no, line in _ics_lines(fp):
+        if line is None:
+            yield ImportRow(no, error=f"行过长（超过 {_MAX_LINE} 字符）")
+            continue
+        name, params, value = _split_property(line)
+        if name == "BEGIN":
+            if value.upper() == "VEVENT" and props is None:
+                event_line, props, nested = no, {}, 0
+            elif props is not None:
+                nested += 1  # VALARM 等嵌套组件
+        elif name == "END" and props is not None:
+            if nested:
+                nested -= 1
+            elif value.upper() == "VEVENT":
+                yield from _event_rows(event_line, props, tz)
+                props = None
+        elif props is not None and not nested and name in ("DTSTART", "DTEND", "DURATION", "RRULE", "SUMMARY"):
+            props[name] = (params, value)
+    if props is not None:
+        yield ImportRow(event_line, error="事件缺少 END:VEVENT")
+
+
+def _fold(line: str) -> str:
+    """按 RFC 5545 折行：每行不超过 75 个八位组，且不拆开 UTF-8 字符"""
+    out, size, chunk = [], 0, []
+    for ch in line:
+        n = len(ch.encode("utf-8"))
+        if size + n > 75:
+            out.append("".join(chunk))
+            chunk, size = [" "], 1
+        chunk.append(ch)
+        size += n
+    out.append("".join(chunk))
+    return "\r\n".join(out) + "\r\n"
+
+
+def export_ics(schedule: dict, tz_name: str, calname: str = "") -> Iterator[str]:
+    """逐个导出每周重复的 VEVENT（以 2024-01-01 所在周为起点，时间为 tz_name 下的墙上时间）。
+    备选行为以其写法（如 "A / B"）作为 SUMMARY，需要完整保留时请导出 CSV 或 JSON。
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//astrbot_plugin_routine_manager//routine//ZH\r\n"
+    if calname:
+        yield _fold(f"X-WR-CALNAME:{_escape_text(calname)}")
+    yield _fold(f"X-WR-TIMEZONE:{tz_name}")
+    for n, it in enumerate(_compile_schedule(schedule)):
+        day = _ICS_ANCHOR + timedelta(days=it.day)
+        start = datetime.combine(day, it.start)
+        end = datetime.combine(day, it.end)
+        if end <= start:
+            end += timedelta(days=1)  # 跨午夜或到 24:00
+        yield (
+            "BEGIN:VEVENT\r\n"
+            f"UID:{WEEK_KEYS[it.day]}-{start:%H%M}-{n}@routine_manager\r\n"
+            f"DTSTAMP:{stamp}\r\n"
+            f"DTSTART;TZID={tz_name}:{start:%Y%m%dT%H%M%S}\r\n"
+            f"DTEND;TZID={tz_name}:{end:%Y%m%dT%H%M%S}\r\n"
+            f"RRULE:FREQ=WEEKLY;BYDAY={_ICS_DAYS[it.day]}\r\n"
+            + _fold(f"SUMMARY:{_escape_text(it.action)}")
+            + "END:VEVENT\r\n"
+        )
+    yield "END:VCALENDAR\r\n"
+
+
+# ---------------- 导入到配置 ----------------
+def parse_rows(fp: TextIO, fmt: str, tz: Optional[ZoneInfo] = None) -> Iterator[ImportRow]:
+    if fmt == "ics":
+        return parse_ics(fp, tz)
+    if fmt == "csv":
+        return parse_csv(fp)
+    raise ValueError(f"unknown format {fmt!r}")
+
+
+def import_schedule(cfg: dict, rows: Iterable[ImportRow], profile: str = DEFAULT_PROFILE,
+                    replace: bool = False) -> dict:
+    """把解析出的行写入 cfg 中指定方案的日程（replace=True 时先清空该方案），返回报告：
+    {"imported": 成功行数, "error_count": 错误行数, "errors": [{"line", "error"}...]}
+    错误明细最多保留 _MAX_ERRORS 条。
+    """
+    schedule = _profile_schedule(cfg, profile, create=True)
+    days = {k: ({} if replace else dict(schedule.get(k) or {})) for k in WEEK_KEYS}
+    imported, error_count, errors = 0, 0, []
+    for row in rows:
+        if row.error is not None:
+            error_count += 1
+            if len(errors) < _MAX_ERRORS:
+                errors.append({"line": row.line, "error": row.error})
+            continue
+        days[row.day][row.range] = row.action
+        imported += 1
+    schedule.clear()
+    schedule.update(days)
+    return {"imported": imported, "error_count": error_count, "errors": errors}
@@ -0,0 +1,368 @@
+"""可选的 SQLite 存储：WAL 模式，方案、时段与设置按行保存，每次修改追加一条修订记录。
+
+表结构（行版本化：from_rev 为写入该行的修订，to_rev 为使其失效的修订，当前数据即 to_rev IS NULL 的行）：
+    revisions(rev, at, source, note)                       只追加
+    settings(key, value, from_rev, to_rev)                 顶层设置（时区、注入范围、提示词、会话绑定……），value 为 JSON
+    profiles(name, data, from_rev, to_rev)                 方案（default 即顶层 schedule），data 为方案的其余字段（overrides）
+    slots(profile, day, range, action, choices, seq, from_rev, to_rev)
+                                                           时段，seq 保持配置中的先后（重叠时靠前者生效）；
+                                                           备选行为的 action 为其写法，choices 为列表 / 字典的 JSON
+
+修订 R 时的内容 = from_rev <= R 且 (to_rev IS NULL 或 to_rev > R) 的行，回滚即以该内容追加一个新修订。
+写入在 BEGIN IMMEDIATE 事务中完成，读取在读事务中完成（WAL 快照），读者不会看到写了一半的修订。
+load() / save() 与 routine_config.json 的结构相同，JSON 导入导出照常可用。
+"""
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    from .routine_core import WEEK_KEYS, DEFAULT_PROFILE, _clean_action, _parse_action
+except ImportError:  # 非包方式加载（WebUI 独立进程 / 基准脚本）
+    from routine_core import WEEK_KEYS, DEFAULT_PROFILE, _clean_action, _parse_action
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    rev     INTEGER PRIMARY KEY,
+    at      REAL NOT NULL,
+    source  TEXT NOT NULL DEFAULT '',
+    note    TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key      TEXT NOT NULL,
+    value    TEXT NOT NULL,
+    from_rev INTEGER NOT NULL,
+    to_rev   INTEGER
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    name     TEXT NOT NULL,
+    data     TEXT NOT NULL DEFAULT '{}',
+    from_rev INTEGER NOT NULL,
+    to_rev   INTEGER
+);
+CREATE TABLE IF NOT EXISTS slots (
+    id       INTEGER PRIMARY KEY,
+    profile  TEXT NOT NULL,
+    day      INTEGER NOT NULL,
+    range    TEXT NOT NULL,
+    action   TEXT NOT NULL,
+    choices  TEXT,
+    seq      INTEGER NOT NULL,
+    from_rev INTEGER NOT NULL,
+    to_rev   INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS settings_live ON settings(key) WHERE to_rev IS NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS profiles_live ON profiles(name) WHERE to_rev IS NULL;
+CREATE INDEX IF NOT EXISTS slots_live ON slots(profile, day, seq) WHERE to_rev IS NULL;
+CREATE INDEX IF NOT EXISTS slots_from ON slots(from_rev);
+CREATE INDEX IF NOT EXISTS slots_to ON slots(to_rev);
+CREATE INDEX IF NOT EXISTS slots_seq ON slots(seq);
+"""
+
+_AT_REVISION = "from_rev <= ? AND (to_rev IS NULL OR to_rev > ?)"
+_LIVE = "to_rev IS NULL"
+
+
+def _encode_action(value) -> Optional[Tuple[str, Optional[str]]]:
+    """配置中的行为 -> (action, choices) 列值；空行为返回 None"""
+    value = _clean_action(value)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value, None
+    return _parse_action(value)[0], json.dumps(value, ensure_ascii=False)
+
+def _decode_action(action: str, choices: Optional[str]):
+    return json.loads(choices) if choices else action
+
+
+class RoutineStore:
+    """SQLite 作息存储。每个线程使用自己的连接（插件与 WebUI 在工作线程中访问），
+    跨进程的并发写由 SQLite 的写锁串行化；save / patch_day 的 expect 参数提供与 If-Match 相同的修订号检查。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []  # 各线程打开的连接，close 时一并关闭
+        self._conns_lock = threading.Lock()
+        db = self._db()
+        db.executescript(_SCHEMA)
+        if "choices" not in {row[1] for row in db.execute("PRAGMA table_info(slots)")}:
+            db.execute("ALTER TABLE slots ADD COLUMN choices TEXT")  # 早于备选行为的库
+
+    # ---------------- 连接与事务 ----------------
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # 连接只在打开它的线程中使用；check_same_thread=False 仅为了 close 能在任意线程关闭它
+            db = sqlite3.connect(self.path, timeout=10.0, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            with self._conns_lock:
+                self._conns.append(db)
+        return db
+
+    @contextmanager
+    def _read(self):
+        """读事务：期间的多条查询看到同一个修订"""
+        db = self._db()
+        db.execute("BEGIN")
+        try:
+            yield db
+        finally:
+            db.execute("COMMIT")
+
+    @contextmanager
+    def _write(self):
+        """写事务：立即取得写锁，异常时整体回滚"""
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def close(self):
+        """关闭所有线程（包括 asyncio.to_thread 的工作线程）打开的连接；关闭后不再使用该实例"""
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for db in conns:
+            db.close()
+        self._local.db = None
+
+    # ---------------- 读取 ----------------
+    @staticmethod
+    def _current(db: sqlite3.Connection) -> int:
+        return db.execute("SELECT COALESCE(MAX(rev), 0) FROM revisions").fetchone()[0]
+
+    def revision(self) -> int:
+        """当前修订号（空库为 0）"""
+        return self._current(self._db())
+
+    def stamp(self) -> Tuple[int, int]:
+        """(当前修订的写入时间 ns, 修订号)，用作缓存戳（与文件的 (mtime_ns, size) 对应）"""
+        row = self._db().execute("SELECT at, rev FROM revisions ORDER BY rev DESC LIMIT 1").fetchone()
+        return (int(row[0] * 1e9), row[1]) if row else (0, 0)
+
+    def is_empty(self) -> bool:
+        return self.revision() == 0
+
+    def load(self, rev: Optional[int] = None) -> dict:
+        """组装与 routine_config.json 结构相同的配置字典；rev 指定历史修订（缺省为当前）"""
+        with self._read() as db:
+            current = self._current(db)
+            rev = current if rev is None else rev
+            where, args = (_LIVE, ()) if rev == current else (_AT_REVISION, (rev, rev))
+            cfg = {}
+            for key, value in db.execute(f"SELECT key, value FROM settings WHERE {where} ORDER BY key", args):
+                cfg[key] = json.loads(value)
+            holders = {}
+            for name, data in db.execute(f"SELECT name, data FROM profiles WHERE {where} ORDER BY name", args):
+                holders[name] = json.loads(data)
+            schedules = {name: {k: {} for k in WEEK_KEYS} for name in holders}
+            for profile, day, rng, action, choices in db.execute(
+                    f"SELECT profile, day, range, action, choices FROM slots WHERE {where} ORDER BY profile, day, seq",
+                    args):
+                if profile in schedules:
+                    schedules[profile][WEEK_KEYS[day]][rng] = _decode_action(action, choices)
+        default = holders.pop(DEFAULT_PROFILE, None)
+        if default is not None:
+            cfg.update(default)
+            cfg["schedule"] = schedules.pop(DEFAULT_PROFILE)
+        if holders:
+            cfg["profiles"] = {name: {**data, "schedule": schedules[name]} for name, data in holders.items()}
+        cfg["revision"] = rev
+        return cfg
+
+    def schedule(self, profile: str) -> Optional[dict]:
+        """当前修订中单个方案的日程；方案不存在时返回 None"""
+        with self._read() as db:
+            if db.execute(f"SELECT 1 FROM profiles WHERE name = ? AND {_LIVE}", (profile,)).fetchone() is None:
+                return None
+            schedule = {k: {} for k in WEEK_KEYS}
+            for day, rng, action, choices in db.execute(
+                    f"SELECT day, range, action, choices FROM slots WHERE profile = ? AND {_LIVE} ORDER BY day, seq",
+                    (profile,)):
+                schedule[WEEK_KEYS[day]][rng] = _decode_action(action, choices)
+        return schedule
+
+    def history(self, limit: int = 50) -> List[dict]:
+        """最近的修订记录（新的在前），附带每个修订写入与失效的时段行数"""
+        db = self._db()
+        rows = db.execute("SELECT rev, at, source, note FROM revisions ORDER BY rev DESC LIMIT ?", (limit,)).fetchall()
+        out = []
+        for rev, at, source, note in rows:
+            added = db.execute("SELECT COUNT(*) FROM slots WHERE from_rev = ?", (rev,)).fetchone()[0]
+            removed = db.execute("SELECT COUNT(*) FROM slots WHERE to_rev = ?", (rev,)).fetchone()[0]
+            out.append({"revision": rev, "at": at, "source": source, "note": note,
+                        "slots_added": added, "slots_removed": removed})
+        return out
+
+    # ---------------- 写入 ----------------
+    def _begin_revision(self, db: sqlite3.Connection, expect: Optional[int], source: str, note: str,
+                        floor: int = 0) -> Optional[int]:
+        """在写事务中分配新修订号；expect 与当前修订不符时返回 None"""
+        current = self._current(db)
+        if expect is not None and expect != current:
+            return None
+        rev = max(current + 1, floor)
+        db.execute("INSERT INTO revisions (rev, at, source, note) VALUES (?, ?, ?, ?)", (rev, time.time(), source, note))
+        return rev
+
+    @staticmethod
+    def _next_seq(db: sqlite3.Connection) -> int:
+        """下一个 seq；MAX(seq) 由 slots_seq 索引直接取得，不随历史行数变慢"""
+        return db.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM slots").fetchone()[0]
+
+    @staticmethod
+    def _live_day(db: sqlite3.Connection, profile: str, day: int) -> List[Tuple[int, str, tuple, int]]:
+        rows = db.execute(
+            f"SELECT id, range, action, choices, seq FROM slots WHERE profile = ? AND day = ? AND {_LIVE} ORDER BY seq",
+            (profile, day),
+        ).fetchall()
+        return [(row_id, rng, (action, choices), seq) for row_id, rng, action, choices, seq in rows]
+
+    def _put_profile(self, db: sqlite3.Connection, rev: int, name: str, data: dict):
+        text = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        row = db.execute(f"SELECT data FROM profiles WHERE name = ? AND {_LIVE}", (name,)).fetchone()
+        if row is not None and row[0] == text:
+            return
+        db.execute(f"UPDATE profiles SET to_rev = ? WHERE name = ? AND {_LIVE}", (rev, name))
+        db.execute("INSERT INTO profiles (name, data, from_rev) VALUES (?, ?, ?)", (name, text, rev))
+
+    def _put_day(self, db: sqlite3.Connection, rev: int, profile: str, day: int, slots: dict):
+        """把一天的时段改为 slots（保持其先后）；内容未变时不写任何行"""
+        want = [(str(rng), _encode_action(act)) for rng, act in slots.items()] if isinstance(slots, dict) else []
+        want = [(rng, act) for rng, act in want if act is not None]
+        live = self._live_day(db, profile, day)
+        if [(rng, act) for _, rng, act, _ in live] == want:
+            return
+        db.execute(f"UPDATE slots SET to_rev = ? WHERE profile = ? AND day = ? AND {_LIVE}", (rev, profile, day))
+        seq = self._next_seq(db)
+        db.executemany(
+            "INSERT INTO slots (profile, day, range, action, choices, seq, from_rev) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(profile, day, rng, *act, seq + i, rev) for i, (rng, act) in enumerate(want)],
+        )
+
+    def save(self, cfg: dict, expect: Optional[int] = None, source: str = "", note: str = "") -> Optional[int]:
+        """把整个配置字典写为一个新修订，只改动与当前内容不同的行（按天比较时段）。
+        expect 为调用方读到的修订号，不一致时不写入并返回 None；成功返回新修订号。
+        不带 expect 的写入（迁移、导入）沿用 cfg["revision"]，保证修订号不回退。
+        """
+        try:
+            floor = int(cfg.get("revision", 0)) if expect is None else 0
+        except (TypeError, ValueError):
+            floor = 0
+        holders = {DEFAULT_PROFILE: cfg}
+        profiles = cfg.get("profiles")
+        if isinstance(profiles, dict):
+            holders.update((str(k), v) for k, v in profiles.items() if isinstance(v, dict) and k != DEFAULT_PROFILE)
+        settings = {k: v for k, v in cfg.items() if k not in ("schedule", "profiles", "overrides", "revision")}
+
+        with self._write() as db:
+            rev = self._begin_revision(db, expect, source, note, floor)
+            if rev is None:
+                return None
+            # 设置
+            live = dict(db.execute(f"SELECT key, value FROM settings WHERE {_LIVE}"))
+            for key, value in settings.items():
+                text = json.dumps(value, ensure_ascii=False, sort_keys=True)
+                if live.pop(key, None) != text:
+                    db.execute(f"UPDATE settings SET to_rev = ? WHERE key = ? AND {_LIVE}", (rev, key))
+                    db.execute("INSERT INTO settings (key, value, from_rev) VALUES (?, ?, ?)", (key, text, rev))
+            for key in live:
+                db.execute(f"UPDATE settings SET to_rev = ? WHERE key = ? AND {_LIVE}", (rev, key))
+            # 方案与时段
+            existing = {name for (name,) in db.execute(f"SELECT name FROM profiles WHERE {_LIVE}")}
+            for name, holder in holders.items():
+                self._put_profile(db, rev, name, {k: v for k, v in holder.items() if k == "overrides"})
+                schedule = holder.get("schedule") if isinstance(holder.get("schedule"), dict) else {}
+                for day, key in enumerate(WEEK_KEYS):
+                    self._put_day(db, rev, name, day, schedule.get(key) or {})
+                existing.discard(name)
+            for name in existing:
+                db.execute(f"UPDATE profiles SET to_rev = ? WHERE name = ? AND {_LIVE}", (rev, name))
+                db.execute(f"UPDATE slots SET to_rev = ? WHERE profile = ? AND {_LIVE}", (rev, name))
+        return rev
+
+    def patch_day(self, profile: str, day: str, set_: dict, delete: Iterable[str] = (),
+                  replace: Optional[dict] = None, expect: Optional[int] = None, source: str = "") -> Optional[int]:
+        """单天增量修改（与 PATCH /api/schedule/<day> 语义相同），只写入变化的行：
+        已有时段改行为时保留其先后，新时段追加在当天末尾；空行为表示删除。
+        expect 与当前修订不符时返回 None；成功返回新修订号。
+        """
+        di = WEEK_KEYS.index(day)
+        with self._write() as db:
+            rev = self._begin_revision(db, expect, source, f"{profile} {day}")
+            if rev is None:
+                return None
+            if db.execute(f"SELECT 1 FROM profiles WHERE name = ? AND {_LIVE}", (profile,)).fetchone() is None:
+                db.execute("INSERT INTO profiles (name, data, from_rev) VALUES (?, '{}', ?)", (profile, rev))
+            if replace is not None:
+                # 整天替换：按请求中的先后重写当天
+                slots = {str(rng): act for rng, act in replace.items() if _clean_action(act) is not None}
+                for rng in delete:
+                    slots.pop(str(rng), None)
+                for rng, act in set_.items():
+                    if _clean_action(act) is not None:
+                        slots[str(rng)] = act
+                    else:
+                        slots.pop(str(rng), None)
+                self._put_day(db, rev, profile, di, slots)
+                return rev
+            live = {rng: (row_id, act, seq) for row_id, rng, act, seq in self._live_day(db, profile, di)}
+            changes = {}  # 时段 -> 新行为（None 表示删除）
+            for rng in delete:
+                changes[str(rng)] = None
+            for rng, act in set_.items():
+                changes[str(rng)] = _encode_action(act)
+            seq = self._next_seq(db)
+            for rng, act in changes.items():
+                old = live.get(rng)
+                if old is not None and old[1] == act:
+                    continue
+                if old is not None:
+                    db.execute("UPDATE slots SET to_rev = ? WHERE id = ?", (rev, old[0]))
+                if act is not None:
+                    db.execute(
+                        "INSERT INTO slots (profile, day, range, action, choices, seq, from_rev) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (profile, di, rng, *act, old[2] if old is not None else seq, rev),
+                    )
+                    seq += old is None
+        return rev
+
+    def has_revision(self, rev: int) -> bool:
+        """修订记录中是否有 rev（迁移时沿用的起始修订号之前没有记录）"""
+        return self._db().execute("SELECT 1 FROM revisions WHERE rev = ?", (rev,)).fetchone() is not None
+
+    def rollback(self, to: int, expect: Optional[int] = None) -> Optional[int]:
+        """以修订 to 的内容追加一个新修订；to 不存在（先用 has_revision 区分）或 expect 不符时返回 None"""
+        if not self.has_revision(to):
+            return None
+        cfg = self.load(to)
+        current = self.revision()
+        if expect is not None and expect != current:
+            return None
+        cfg.pop("revision", None)
+        return self.save(cfg, expect=current, source="rollback", note=f"回滚到修订 {to}")
+
+
+def open_store(path: str, migrate_from: Optional[str] = None) -> RoutineStore:
+    """打开（必要时创建）SQLite 存储；库为空且 migrate_from 指向已有的 JSON 配置时先导入"""
+    store = RoutineStore(path)
+    if migrate_from and store.is_empty():
+        try:
+            with open(migrate_from, "r", encoding="utf-8") as f:
+                cfg = json.load(f)
+        except (OSError, ValueError):
+            cfg = None
+        if isinstance(cfg, dict):
+            store.save(cfg, source="migrate", note=migrate_from)
+    return store
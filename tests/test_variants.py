@@ -0,0 +1,35 @@
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routine_core import _DateIndex, _compile_schedule, _merge_adjacent  # noqa: E402
+
+# 字面量 "A / B" 与列表 ["A", "B"] 显示写法相同，但是不同的行为
+MIXED = {
+    "Mon": {"08:00-09:00": "A / B", "09:00-10:00": ["A", "B"], "10:00-11:00": {"A": 1, "B": 1}},
+}
+
+def test_literal_and_alternatives_keep_their_values():
+    table = _compile_schedule(MIXED)
+    values = {table.range_key(i): table.value(i) for i in range(len(table))}
+    assert values == {"08:00-09:00": "A / B", "09:00-10:00": ["A", "B"], "10:00-11:00": {"A": 1, "B": 1}}
+    assert len(set(table.action_ids)) == 3
+    assert table.alias(0) is None
+    assert table.alias(1) is not None and table.alias(2) is not None
+
+def test_merge_adjacent_does_not_join_mixed_forms():
+    assert _merge_adjacent(MIXED)["Mon"] == MIXED["Mon"]
+
+def test_date_overrides_keep_alias_per_slot():
+    dates = _DateIndex([{"date": "2030-01-07", "slots": {"08:00-09:00": "A / B", "09:00-10:00": ["A", "B"]}}])
+    base = date(2030, 1, 7).toordinal() * 1440
+    literal, alias, _, _ = dates.lookup(base + 8 * 60 + 30)
+    assert literal.action == "A / B" and alias is None
+    listed, alias, _, _ = dates.lookup(base + 9 * 60 + 30)
+    assert listed.action == "A / B" and alias is not None and alias.value == ["A", "B"]
+
+def test_identical_alternatives_share_one_action():
+    table = _compile_schedule({"Mon": {"08:00-09:00": ["A", "B"]}, "Tue": {"08:00-09:00": ["A", "B"]}})
+    assert table.action_ids[0] == table.action_ids[1]
@@ -1,47 +1,430 @@
+import io
 import os
+import gzip
 import json
 import time
+import socket
 import asyncio
-from quart import Quart, request, redirect, url_for, session, send_from_directory, Response, jsonify
+import codecs
+import hashlib
+import tempfile
+import mimetypes
+from datetime import datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from urllib.parse import quote
+from zoneinfo import ZoneInfo
+from quart import Quart, request, redirect, url_for, session, Response, jsonify
+from quart.wrappers.response import DataBody
+from werkzeug.utils import safe_join
 import hypercorn.asyncio
 from hypercorn.config import Config
 
+try:
+    from .routine_core import (
+        WEEK_KEYS, DEFAULT_PROFILE, _profile_holder, _profile_schedule, _override_issues, _prune_overrides,
+        _write_json_atomic, _validate_schedule, _merge_adjacent, _compile_schedule, _WeekIndex, _DateIndex,
+        _BatchResolver, _clean_action, _check_range, _PROFILE_RE, _PromptTemplate,
+    )
+    from . import routine_io
+except ImportError:  # 非包方式加载（由 main.py 按文件路径导入）
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from routine_core import (
+        WEEK_KEYS, DEFAULT_PROFILE, _profile_holder, _profile_schedule, _override_issues, _prune_overrides,
+        _write_json_atomic, _validate_schedule, _merge_adjacent, _compile_schedule, _WeekIndex, _DateIndex,
+        _BatchResolver, _clean_action, _check_range, _PROFILE_RE, _PromptTemplate,
+    )
+    import routine_io
+
+try:
+    from .routine_store import RoutineStore
+except ImportError:
+    from routine_store import RoutineStore
+
+try:
+    import brotli  # 可选依赖：安装后对支持的浏览器优先使用 br 压缩
+except ImportError:
+    brotli = None
+
+try:
+    import uvloop  # 可选依赖：独立进程模式下 worker_class=uvloop 时使用
+except ImportError:
+    uvloop = None
+
 # 初始化 Quart 应用
 app = Quart(__name__)
 
 # 全局变量（由 main.py 启动时注入）
 SERVER_LOGIN_KEY = ""          
 STORAGE_PATH = None            
+STORE = None                   # 插件配置 storage=sqlite 时的 RoutineStore，此时 STORAGE_PATH 不再使用
 INITIAL_CONFIG = {}            
 ONE_TIME_KEY = True            
 KEY_EXPIRES_AT = 0.0           
+NOTIFY_CONN = None             # 独立进程模式：与插件进程之间的通知管道（就绪信号、配置变更、指标）
+PLUGIN_HOOKS = None            # 进程内模式：插件直接提供的回调 {"notify": fn(msg), "metrics": fn()}
+METRICS_TOKEN = ""             # 非空时允许携带 Bearer Token 免登录抓取 /api/metrics
 
 # 常量
 ASSETS_DIR = os.path.join(os.path.dirname(__file__), "assets")
-WEEK_KEYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+# 串行化"读取-修改-写回"，避免并发保存互相覆盖
+_CONFIG_LOCK = asyncio.Lock()
+# 同一时刻只允许一个指标请求在管道上等待回复
+_METRICS_LOCK = asyncio.Lock()
+_METRICS_PREFIX = "routine_manager_"
+
+# 实时推送（SSE）：共享监视任务的检查间隔、心跳间隔与每个连接的待发队列长度
+_EVENTS_POLL = 2.0
+_EVENTS_HEARTBEAT = 25.0
+_EVENTS_QUEUE = 16
+
+# 时间线：每批解析的采样点数，以及单次查询的最大跨度
+_TIMELINE_CHUNK = 4096
+_TIMELINE_MAX_SPAN = timedelta(days=400)
+
+# Hypercorn 连接参数的缺省值（可由启动配置 keep_alive_timeout / backlog / worker_class 覆盖）
+_KEEP_ALIVE_TIMEOUT = 5.0
+_BACKLOG = 100
+_WORKER_CLASSES = ("asyncio", "uvloop")
+
+# HTTP 缓存与压缩
+_COMPRESS_MIN_SIZE = 512
+_COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript")
+_ASSET_CACHE: dict = {}        # 文件路径 -> _CachedAsset
+_CONFIG_CACHE = None           # ((mtime_ns, size), 原始字节, 解析结果)，按文件戳（或 SQLite 修订）失效
+
+class _CachedAsset:
+    """静态文件缓存：原始内容、校验值，以及按需生成的各编码压缩版本"""
+    __slots__ = ("stamp", "body", "etag", "last_modified", "mimetype", "encoded")
+
+    def __init__(self, stamp: tuple, body: bytes, last_modified: float, mimetype: str):
+        self.stamp = stamp
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()[:16]}"'
+        self.last_modified = last_modified
+        self.mimetype = mimetype
+        self.encoded: dict = {}
 
 # ==================== 辅助函数 ====================
 
+async def _offload(func, *args):
+    """进程内模式下 WebUI 与插件共用 AstrBot 的事件循环：读写配置、解析、校验与 SQLite 访问
+    放到工作线程，保存配置时不拖慢 LLM 请求；独立进程模式下直接调用
+    """
+    if PLUGIN_HOOKS is None:
+        return func(*args)
+    return await asyncio.to_thread(func, *args)
+
+def _read_config_cached():
+    """带解析缓存的配置读取，按文件 (mtime_ns, size) 失效。
+    返回 ((mtime_ns, size), 原始字节, 解析结果)；解析结果为共享对象，调用方不得修改。
+    SQLite 存储下文件戳换成 (修订时间 ns, 修订号)，只在出现新修订时才重新组装。
+    """
+    global _CONFIG_CACHE
+    if STORE is not None:
+        stamp = STORE.stamp()
+        cache = _CONFIG_CACHE
+        if cache is None or cache[0] != stamp:
+            cfg = STORE.load(stamp[1])
+            cache = _CONFIG_CACHE = (stamp, json.dumps(cfg, ensure_ascii=False).encode("utf-8"), cfg)
+        return cache
+    st = os.stat(STORAGE_PATH)
+    cache = _CONFIG_CACHE
+    if cache is None or cache[0] != (st.st_mtime_ns, st.st_size):
+        with open(STORAGE_PATH, "rb") as f:
+            st = os.fstat(f.fileno())
+            raw = f.read()
+        cache = _CONFIG_CACHE = ((st.st_mtime_ns, st.st_size), raw, json.loads(raw))
+    return cache
+
 def _load_disk_config() -> dict:
-    """读取磁盘配置，若失败则返回内存中的初始配置"""
-    if STORAGE_PATH and os.path.exists(STORAGE_PATH):
+    """读取磁盘配置（返回可自由修改的副本），若失败则返回内存中的初始配置"""
+    if STORE is not None or (STORAGE_PATH and os.path.exists(STORAGE_PATH)):
         try:
-            with open(STORAGE_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return json.loads(_read_config_cached()[1])
         except Exception:
             pass
     return dict(INITIAL_CONFIG or {})
 
 def _save_disk_config(cfg: dict) -> bool:
-    """写入磁盘配置"""
+    """原子写入磁盘配置：先写同目录临时文件，再 rename 覆盖，读者不会看到半截文件。
+    SQLite 存储下只写入变化的行（一个事务），cfg["revision"] 须为读到的修订号 + 1。
+    """
+    global _CONFIG_CACHE
+    if STORE is not None:
+        try:
+            saved = STORE.save(cfg, expect=_revision(cfg) - 1, source="webui")
+        except Exception:
+            return False
+        if saved is None:
+            return False
+        _CONFIG_CACHE = None
+        return True
     if not STORAGE_PATH:
         return False
     try:
-        with open(STORAGE_PATH, "w", encoding="utf-8") as f:
-            json.dump(cfg, f, ensure_ascii=False, indent=2)
-        return True
+        st, raw = _write_json_atomic(STORAGE_PATH, cfg)
     except Exception:
         return False
+    # 顺手刷新解析缓存，下次读取无需重新解析
+    _CONFIG_CACHE = ((st.st_mtime_ns, st.st_size), raw, cfg)
+    return True
+
+def _revision(cfg: dict) -> int:
+    """配置修订号：每次保存单调递增"""
+    try:
+        return int(cfg.get("revision", 0))
+    except (TypeError, ValueError):
+        return 0
+
+def _etag(revision: int, stamp: str = "") -> str:
+    """ETag 以修订号开头；可附加文件戳，使手动编辑（修订号不变）也能让缓存失效"""
+    return f'"{revision}-{stamp}"' if stamp else f'"{revision}"'
+
+def _if_match(revision: int) -> bool:
+    """校验 If-Match 请求头（只比较修订号部分）；未携带时视为匹配"""
+    header = request.headers.get("If-Match")
+    if not header:
+        return True
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/").strip('"').split("-")[0] == str(revision):
+            return True
+    return False
+
+def _accepted_encoding():
+    """按 Accept-Encoding 选择压缩算法：br（需安装 brotli）优先，其次 gzip"""
+    accept = request.headers.get("Accept-Encoding", "").lower()
+    if brotli is not None and "br" in accept:
+        return "br"
+    if "gzip" in accept:
+        return "gzip"
+    return None
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+def _compressible(mimetype) -> bool:
+    return bool(mimetype) and mimetype.startswith(_COMPRESSIBLE_TYPES)
+
+def _not_modified(etag: str, last_modified) -> bool:
+    """条件请求判定：If-None-Match 优先，其次 If-Modified-Since"""
+    inm = request.headers.get("If-None-Match")
+    if inm is not None:
+        return any(t.strip() == "*" or t.strip().removeprefix("W/") == etag for t in inm.split(","))
+    ims = request.headers.get("If-Modified-Since")
+    if ims and last_modified is not None:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _cached_response(body: bytes, mimetype: str, etag: str, last_modified=None, encoded=None) -> Response:
+    """带 ETag / Last-Modified 的响应；条件命中时返回 304。
+    encoded 为压缩结果缓存（编码 -> 字节），传入时复用，避免重复压缩。
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if _not_modified(etag, last_modified):
+        return Response(b"", status=304, headers=headers)
+    encoding = _accepted_encoding() if len(body) >= _COMPRESS_MIN_SIZE and _compressible(mimetype) else None
+    if encoding:
+        data = encoded.get(encoding) if encoded is not None else None
+        if data is None:
+            data = _compress(body, encoding)
+            if encoded is not None:
+                encoded[encoding] = data
+        body = data
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype=mimetype, headers=headers)
+
+async def _send_asset(filename: str):
+    """发送 assets 下的文件：内容与压缩结果按 (mtime_ns, size) 缓存，支持 304"""
+    path = safe_join(ASSETS_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        return Response("Not Found", status=404, mimetype="text/plain")
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    entry = _ASSET_CACHE.get(path)
+    if entry is None or entry.stamp != stamp:
+        with open(path, "rb") as f:
+            body = f.read()
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        entry = _ASSET_CACHE[path] = _CachedAsset(stamp, body, st.st_mtime, mimetype)
+    return _cached_response(entry.body, entry.mimetype, entry.etag, entry.last_modified, entry.encoded)
+
+def _revision_conflict(revision: int):
+    resp = jsonify({"ok": False, "error": "revision_conflict", "revision": revision})
+    resp.headers["ETag"] = _etag(revision)
+    return resp, 412
+
+def _saved_response(revision: int, **extra):
+    resp = jsonify({"ok": True, "revision": revision, **extra})
+    resp.headers["ETag"] = _etag(revision)
+    return resp
+
+def _request_profile() -> str:
+    """从查询参数 ?profile= 取方案名，缺省为默认方案"""
+    return (request.args.get("profile") or "").strip() or DEFAULT_PROFILE
+
+def _send_to_plugin(msg: tuple):
+    """向插件发送消息：进程内模式直接回调，独立进程模式经管道发送"""
+    try:
+        if PLUGIN_HOOKS is not None:
+            PLUGIN_HOOKS["notify"](msg)
+        elif NOTIFY_CONN is not None:
+            NOTIFY_CONN.send(msg)
+    except Exception:
+        pass
+
+def _notify_change(revision: int, cfg: Optional[dict] = None):
+    """通知插件配置已变更，插件在后台线程中重载并整体替换配置快照。
+    进程内模式直接交出新配置，插件无需再读盘解析（未提供 cfg 时插件自行读取）。
+    """
+    _send_to_plugin(("config", revision, cfg) if PLUGIN_HOOKS is not None and cfg is not None else ("config", revision))
+    _wake_events()
+
+async def _fetch_metrics(timeout: float = 2.0):
+    """向插件请求指标快照（独立进程模式经通知管道往返），失败返回 None"""
+    if PLUGIN_HOOKS is not None:
+        return PLUGIN_HOOKS["metrics"]()
+    conn = NOTIFY_CONN
+    if conn is None:
+        return None
+    async with _METRICS_LOCK:
+        try:
+            while conn.poll():  # 丢弃此前超时未取走的回复
+                conn.recv()
+            conn.send(("metrics",))
+            if not await asyncio.to_thread(conn.poll, timeout):
+                return None
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return None
+    return msg[1] if msg and msg[0] == "metrics" else None
+
+class _ProfileWatch:
+    """实时推送中某个方案的基线：上次推送时的日程与覆盖项、当前区段，以及据此编译的解析器"""
+    __slots__ = ("schedule", "overrides", "resolver", "slot")
+
+    def __init__(self, cfg: dict, profile: str):
+        holder = _profile_holder(cfg, profile)
+        self.schedule = _profile_schedule(cfg, profile)
+        self.overrides = holder.get("overrides") if holder is not None else None
+        self.resolver: Optional[_BatchResolver] = None
+        self.slot: Optional[tuple] = None
+
+    def current_slot(self, tz, now: float) -> Optional[dict]:
+        """当前所处的区段；与上次不同时返回 slot 事件数据，否则返回 None"""
+        if self.resolver is None:
+            table = _compile_schedule(self.schedule or {})
+            dates = _DateIndex(self.overrides)
+            self.resolver = _BatchResolver(table, _WeekIndex(table), dates if dates else None)
+        slot = self.resolver.resolve_many([now], tz)[0]
+        if slot == self.slot:
+            return None
+        self.slot = slot
+        return {"action": slot[0], "range": slot[1], "at": datetime.fromtimestamp(now, tz).isoformat(timespec="seconds")}
+
+_SUBSCRIBERS: dict = {}        # asyncio.Queue -> 订阅的方案名
+_EVENTS_TASK: Optional[asyncio.Task] = None
+_EVENTS_WAKE: Optional[asyncio.Event] = None
+
+def _current_config():
+    """(文件戳, 解析结果)；解析结果为共享对象，调用方不得修改"""
+    try:
+        stamp, _, cfg = _read_config_cached()
+        return stamp, cfg
+    except Exception:
+        return None, INITIAL_CONFIG or {}
+
+def _config_tz(cfg: dict):
+    try:
+        return ZoneInfo(str(cfg.get("timezone") or "Asia/Shanghai"))
+    except Exception:
+        return None
+
+def _publish(queue: asyncio.Queue, event: str, data: dict):
+    """放入一条待发事件；连接积压（客户端长时间不读）时清空队列，改发 resync 让客户端整体重载"""
+    try:
+        queue.put_nowait((event, data))
+    except asyncio.QueueFull:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(("resync", {}))
+
+async def _watch_events():
+    """所有 SSE 连接共享的监视任务：配置变化时按方案推送变化的天，区段切换时推送当前区段。
+    每 _EVENTS_POLL 秒只做一次 stat；WebUI 自身保存后立即唤醒。没有连接时退出。
+    """
+    global _EVENTS_TASK
+    watches: dict = {}  # 方案名 -> _ProfileWatch
+    last_stamp, cfg = await _offload(_current_config)
+    last_revision = _revision(cfg)
+    try:
+        while _SUBSCRIBERS:
+            stamp, cfg = await _offload(_current_config)
+            revision = _revision(cfg)
+            changed = stamp != last_stamp or revision != last_revision
+            last_stamp, last_revision = stamp, revision
+            tz, now = _config_tz(cfg), time.time()
+            profiles = set(_SUBSCRIBERS.values())
+            for name in list(watches):
+                if name not in profiles:
+                    del watches[name]
+            for name in profiles:
+                watch, days = watches.get(name), []
+                if watch is None or changed:
+                    fresh = _ProfileWatch(cfg, name)
+                    if watch is not None:
+                        before, after = watch.schedule or {}, fresh.schedule or {}
+                        days = [k for k in WEEK_KEYS if before.get(k) != after.get(k)]
+                        fresh.slot = watch.slot
+                    else:
+                        fresh.current_slot(tz, now)  # 新连接已在建立时收到当前区段
+                    watch = watches[name] = fresh
+                slot = watch.current_slot(tz, now)
+                for queue, profile in list(_SUBSCRIBERS.items()):
+                    if profile != name:
+                        continue
+                    if changed:
+                        _publish(queue, "config", {"revision": revision, "days": days,
+                                                   "exists": watch.schedule is not None})
+                    if slot is not None:
+                        _publish(queue, "slot", slot)
+            _EVENTS_WAKE.clear()
+            try:
+                await asyncio.wait_for(_EVENTS_WAKE.wait(), _EVENTS_POLL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _EVENTS_TASK = None
+
+def _wake_events():
+    if _EVENTS_WAKE is not None:
+        _EVENTS_WAKE.set()
+
+def _render_prometheus(snapshot: dict) -> str:
+    """将插件指标快照渲染为 Prometheus 文本格式"""
+    lines = []
+    for name, help_, value in snapshot.get("counters", []):
+        full = _METRICS_PREFIX + name
+        lines += [f"# HELP {full} {help_}", f"# TYPE {full} counter", f"{full} {value}"]
+    for name, help_, hist in snapshot.get("histograms", []):
+        full = _METRICS_PREFIX + name
+        lines += [f"# HELP {full} {help_}", f"# TYPE {full} histogram"]
+        cumulative = 0
+        for bound, count in zip([*hist["bounds"], "+Inf"], hist["counts"]):
+            cumulative += count
+            lines.append(f'{full}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f"{full}_sum {hist['sum']}", f"{full}_count {hist['count']}"]
+    return "\n".join(lines) + "\n"
 
 def _render_login_html(error: str = "") -> str:
     """内置极简登录页渲染（当 assets/login.html 缺失时使用）"""
@@ -61,12 +444,33 @@ button:hover{{background:#1d4ed8}}.err{{color:#ef4444;font-size:0.875rem;margin-
 
 # ==================== 路由处理 ====================
 
+@app.after_request
+async def compress_response(response):
+    """对未压缩的文本类响应按需 gzip/br 压缩（流式响应不处理）"""
+    if response.status_code != 200 or "Content-Encoding" in response.headers \
+            or not isinstance(response.response, DataBody) or not _compressible(response.mimetype):
+        return response
+    encoding = _accepted_encoding()
+    if encoding is None:
+        return response
+    data = await response.get_data(as_text=False)
+    if len(data) < _COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(_compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
 @app.before_request
 async def login_guard():
     """全局登录守卫"""
     # 白名单路由
     if request.endpoint in {"login", "serve_assets", "api_check_status"}:
         return
+    # 指标抓取可用 Bearer Token 代替登录会话
+    if request.endpoint == "api_metrics" and METRICS_TOKEN \
+            and request.headers.get("Authorization") == f"Bearer {METRICS_TOKEN}":
+        return
     # 静态资源若在 assets 下也放行（视具体需求，通常建议保护）
     if request.path.startswith("/assets/"):
         return
@@ -105,7 +509,7 @@ async def login():
     # 尝试加载自定义登录页
     custom_login = os.path.join(ASSETS_DIR, "login.html")
     if os.path.exists(custom_login):
-        return await send_from_directory(ASSETS_DIR, "login.html")
+        return await _send_asset("login.html")
     return Response(_render_login_html(), mimetype="text/html")
 
 @app.route("/")
@@ -113,34 +517,75 @@ async def index():
     """主页：优先查找 index.html"""
     for name in ["index.html", "weekly.html"]:
         if os.path.exists(os.path.join(ASSETS_DIR, name)):
-            return await send_from_directory(ASSETS_DIR, name)
+            return await _send_asset(name)
     return "<h1>404 Error</h1><p>未找到前端文件 (assets/index.html)，请检查插件安装完整性。</p>", 404
 
 @app.route("/assets/<path:filename>")
 async def serve_assets(filename):
-    return await send_from_directory(ASSETS_DIR, filename)
+    return await _send_asset(filename)
 
 # ==================== API 接口 ====================
 
 @app.get("/api/load")
 async def api_load():
-    """获取当前配置（供前端初始化数据）"""
-    data = _load_disk_config()
+    """获取当前配置（供前端初始化数据）；?profile= 指定方案，schedule 字段返回该方案的日程。
+    使用解析缓存，并支持 ETag / Last-Modified 条件请求。
+    """
+    profile = _request_profile()
+    stamp, last_modified = "", None
+    try:
+        (mtime_ns, size), _, shared = await _offload(_read_config_cached)
+        data = dict(shared)  # 浅拷贝：下面只替换顶层键，不修改共享的嵌套对象
+        stamp, last_modified = f"{mtime_ns:x}{size:x}", mtime_ns / 1e9
+    except Exception:
+        data = dict(INITIAL_CONFIG or {})
+    schedule = _profile_schedule(data, profile)
+    if schedule is None:
+        return jsonify({"ok": False, "error": "unknown_profile"}), 404
+    # 各方案的响应不同，ETag 带上方案名的摘要
+    tag = hashlib.sha1(profile.encode("utf-8")).hexdigest()[:8]
+    etag = _etag(_revision(data), f"{stamp}-{tag}" if stamp else tag)
+    if _not_modified(etag, last_modified):
+        return _cached_response(b"", "application/json", etag, last_modified)
+    raw_overrides = _profile_holder(data, profile).get("overrides")
+    data["overrides"] = raw_overrides if isinstance(raw_overrides, list) else []
+    # 方案与绑定可能有成千上万条，只返回名称列表与数量
+    profiles = data.pop("profiles", None)
+    bindings = data.pop("profile_bindings", None)
+    data["schedule"] = schedule
+    validation = await _offload(_validate_schedule, schedule)
+    # 不合法的覆盖项（手动编辑配置文件所致）编译时被忽略，一并报告
+    validation["overrides"] = _override_issues(raw_overrides)
+    validation["counts"]["overrides"] = len(validation["overrides"])
+    data["validation"] = validation
+    data["profile"] = profile
+    data["profile_names"] = [DEFAULT_PROFILE, *sorted(profiles if isinstance(profiles, dict) else {})]
+    data["binding_count"] = len(bindings) if isinstance(bindings, dict) else 0
+    data["storage"] = "sqlite" if STORE is not None else "json"
     # 确保返回前端需要的基本结构，防止前端报错
     data.setdefault("timezone", "Asia/Shanghai")
     data.setdefault("inject_scope", "all")
-    data.setdefault("schedule", {})
-    return jsonify({"ok": True, "data": data})
+    data["revision"] = _revision(data)
+    body = json.dumps({"ok": True, "data": data}, ensure_ascii=False).encode("utf-8")
+    return _cached_response(body, "application/json", etag, last_modified)
 
 @app.post("/api/config")
 async def api_config():
-    """保存完整配置（前端 saveToAstrBot 调用）"""
+    """保存配置；schedule 写入 payload.profile（或 ?profile=）指定的方案。
+    携带 If-Match 时仅在修订号一致时写入；响应附带校验结果（validation），
+    ?strict=1 时存在无法解析的时段则不写入并返回 422。
+    """
     try:
         payload = await request.get_json()
     except Exception:
         return jsonify({"ok": False, "error": "invalid_json"}), 400
+    if not isinstance(payload, dict):
+        return jsonify({"ok": False, "error": "invalid_json"}), 400
 
     # 1. 提取并清洗数据
+    profile = str(payload.get("profile") or _request_profile()).strip()
+    if not _PROFILE_RE.match(profile):
+        return jsonify({"ok": False, "error": "invalid_profile"}), 400
     tz = str(payload.get("timezone") or "Asia/Shanghai").strip()
     scope = str(payload.get("inject_scope") or "all").strip()
     
@@ -149,6 +594,10 @@ async def api_config():
     tpl = prompt_conf.get("routine_prompt_template", "").strip()
     if not tpl:
         tpl = "现在时间：{now} 当前行为：{action} 请在语气和内容上贴合该场景进行回复。"
+    try:
+        _PromptTemplate(tpl)  # 与插件加载时相同的校验，避免保存后才在重载时回落到默认模板
+    except ValueError as e:
+        return jsonify({"ok": False, "error": "invalid_template", "detail": str(e)}), 400
 
     # 日程表处理（确保是 Dict[str, Dict]）
     raw_schedule = payload.get("schedule") or {}
@@ -157,36 +606,576 @@ async def api_config():
         for day_key in WEEK_KEYS:
             day_data = raw_schedule.get(day_key) or {}
             if isinstance(day_data, dict):
-                # 过滤空的时间段（可选，或者信任前端）
-                clean_schedule[day_key] = {k: str(v) for k, v in day_data.items() if v}
-
-    # 2. 组装新配置
-    new_config = {
-        "timezone": tz,
-        "inject_scope": scope,
-        "webui_port": INITIAL_CONFIG.get("webui_port", 58101), # 端口保留原配置
-        "prompt": {
-            "routine_prompt_template": tpl
-        },
-        "schedule": clean_schedule
-    }
-
-    # 3. 落盘
-    if _save_disk_config(new_config):
-        return jsonify({"ok": True})
+                # 过滤空的时间段；行为可以是字符串，也可以是备选列表 / {行为: 权重}
+                day_clean = {str(k): _clean_action(v) for k, v in day_data.items()}
+                clean_schedule[day_key] = {k: v for k, v in day_clean.items() if v is not None}
+
+    raw_bindings = payload.get("profile_bindings")
+    if raw_bindings is not None and not isinstance(raw_bindings, dict):
+        return jsonify({"ok": False, "error": "invalid_bindings"}), 400
+    validation = await _offload(_validate_schedule, clean_schedule)
+    if request.args.get("strict") in ("1", "true") and validation["counts"]["invalid"]:
+        return jsonify({"ok": False, "error": "invalid_ranges", "validation": validation}), 422
+
+    # 2. 校验修订号，合并到现有配置（保留其他方案与绑定）并落盘
+    async with _CONFIG_LOCK:
+        new_config = await _offload(_load_disk_config)
+        revision = _revision(new_config)
+        if not _if_match(revision):
+            return _revision_conflict(revision)
+        new_config.update({
+            "timezone": tz,
+            "inject_scope": scope,
+            "webui_port": INITIAL_CONFIG.get("webui_port", 58101), # 端口保留原配置
+            "prompt": {
+                "routine_prompt_template": tpl
+            },
+        })
+        target = _profile_schedule(new_config, profile, create=True)
+        target.clear()
+        target.update(clean_schedule)
+        if raw_bindings is not None:
+            new_config["profile_bindings"] = {str(k): str(v) for k, v in raw_bindings.items() if v}
+        new_config["revision"] = revision + 1
+        if not await _offload(_save_disk_config, new_config):
+            return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+    _notify_change(revision + 1, new_config)
+    return _saved_response(revision + 1, validation=validation)
+
+@app.get("/api/schedule/<day>")
+async def api_get_schedule(day):
+    """读取方案（?profile=）某一天的日程，供实时推送后只重新拉取变化的天；附带整个方案的校验结果"""
+    if day not in WEEK_KEYS:
+        return jsonify({"ok": False, "error": "unknown_day"}), 404
+    _, cfg = await _offload(_current_config)
+    schedule = _profile_schedule(cfg, _request_profile())
+    if schedule is None:
+        return jsonify({"ok": False, "error": "unknown_profile"}), 404
+    day_data = schedule.get(day)
+    resp = jsonify({
+        "ok": True, "revision": _revision(cfg), "day": day,
+        "schedule": day_data if isinstance(day_data, dict) else {},
+        "validation": await _offload(_validate_schedule, schedule),
+    })
+    resp.headers["ETag"] = _etag(_revision(cfg))
+    return resp
+
+@app.patch("/api/schedule/<day>")
+async def api_patch_schedule(day):
+    """按天增量修改日程（?profile= 指定方案），请求体：
+    {"set": {"08:00-09:00": "上课"}, "delete": ["10:00-11:00"]} 或 {"replace": {...}}
+    响应附带整个方案的校验结果（validation）。
+    """
+    if day not in WEEK_KEYS:
+        return jsonify({"ok": False, "error": "unknown_day"}), 404
+    profile = _request_profile()
+    if not _PROFILE_RE.match(profile):
+        return jsonify({"ok": False, "error": "invalid_profile"}), 400
+    try:
+        payload = await request.get_json()
+    except Exception:
+        return jsonify({"ok": False, "error": "invalid_json"}), 400
+    if not isinstance(payload, dict):
+        return jsonify({"ok": False, "error": "invalid_json"}), 400
+
+    replace = payload.get("replace")
+    to_set = payload.get("set") or {}
+    to_delete = payload.get("delete") or []
+    if not isinstance(to_set, dict) or not isinstance(to_delete, list) \
+            or (replace is not None and not isinstance(replace, dict)):
+        return jsonify({"ok": False, "error": "invalid_patch"}), 400
+    for rng in [*(replace or {}), *to_set]:
+        try:
+            _check_range(str(rng))  # 与加载时相同的校验，避免保存后被静默丢弃
+        except ValueError:
+            return jsonify({"ok": False, "error": "invalid_range", "range": rng}), 400
+
+    if STORE is not None:
+        # SQLite 存储：只写入变化的时段行，不重写整个配置
+        async with _CONFIG_LOCK:
+            revision = await _offload(STORE.revision)
+            if not _if_match(revision):
+                return _revision_conflict(revision)
+            try:
+                saved = await asyncio.to_thread(
+                    STORE.patch_day, profile, day, to_set, to_delete, replace, revision, "webui"
+                )
+            except Exception:
+                return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+            if saved is None:
+                return _revision_conflict(await _offload(STORE.revision))
+            schedule = await asyncio.to_thread(STORE.schedule, profile)
+        _notify_change(saved)
+        return _saved_response(saved, validation=await _offload(_validate_schedule, schedule or {}))
+
+    async with _CONFIG_LOCK:
+        cfg = await _offload(_load_disk_config)
+        revision = _revision(cfg)
+        if not _if_match(revision):
+            return _revision_conflict(revision)
+
+        schedule = _profile_schedule(cfg, profile, create=True)
+        day_data = schedule.get(day)
+        day_data = dict(day_data) if isinstance(day_data, dict) and replace is None else {}
+        for rng, act in (replace or {}).items():
+            act = _clean_action(act)
+            if act is not None:
+                day_data[str(rng)] = act
+        for rng in to_delete:
+            day_data.pop(str(rng), None)
+        for rng, act in to_set.items():
+            act = _clean_action(act)
+            if act is not None:
+                day_data[str(rng)] = act
+            else:
+                day_data.pop(str(rng), None)
+        schedule[day] = day_data
+
+        cfg["revision"] = revision + 1
+        if not await _offload(_save_disk_config, cfg):
+            return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+    _notify_change(revision + 1, cfg)
+    return _saved_response(revision + 1, validation=await _offload(_validate_schedule, schedule))
+
+@app.post("/api/bindings")
+async def api_bindings():
+    """增量修改会话绑定：{"set": {"<会话来源/群号/用户ID>": "<方案名>"}, "delete": ["..."]}"""
+    try:
+        payload = await request.get_json()
+    except Exception:
+        return jsonify({"ok": False, "error": "invalid_json"}), 400
+    if not isinstance(payload, dict):
+        return jsonify({"ok": False, "error": "invalid_json"}), 400
+    to_set = payload.get("set") or {}
+    to_delete = payload.get("delete") or []
+    if not isinstance(to_set, dict) or not isinstance(to_delete, list):
+        return jsonify({"ok": False, "error": "invalid_patch"}), 400
+
+    async with _CONFIG_LOCK:
+        cfg = await _offload(_load_disk_config)
+        revision = _revision(cfg)
+        if not _if_match(revision):
+            return _revision_conflict(revision)
+        bindings = cfg.get("profile_bindings")
+        bindings = dict(bindings) if isinstance(bindings, dict) else {}
+        for key in to_delete:
+            bindings.pop(str(key), None)
+        for key, profile in to_set.items():
+            profile = str(profile or "").strip()
+            if profile and profile != DEFAULT_PROFILE and _profile_schedule(cfg, profile) is None:
+                return jsonify({"ok": False, "error": "unknown_profile", "profile": profile}), 404
+            if profile:
+                bindings[str(key).strip()] = profile
+            else:
+                bindings.pop(str(key).strip(), None)
+        cfg["profile_bindings"] = bindings
+
+        cfg["revision"] = revision + 1
+        if not await _offload(_save_disk_config, cfg):
+            return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+    _notify_change(revision + 1, cfg)
+    return _saved_response(revision + 1)
+
+@app.delete("/api/profiles/<name>")
+async def api_delete_profile(name):
+    """删除方案，并移除指向它的会话绑定"""
+    if name == DEFAULT_PROFILE:
+        return jsonify({"ok": False, "error": "cannot_delete_default"}), 400
+    async with _CONFIG_LOCK:
+        cfg = await _offload(_load_disk_config)
+        revision = _revision(cfg)
+        if not _if_match(revision):
+            return _revision_conflict(revision)
+        profiles = cfg.get("profiles")
+        if not isinstance(profiles, dict) or name not in profiles:
+            return jsonify({"ok": False, "error": "unknown_profile"}), 404
+        del profiles[name]
+        bindings = cfg.get("profile_bindings")
+        if isinstance(bindings, dict):
+            cfg["profile_bindings"] = {k: v for k, v in bindings.items() if v != name}
+
+        cfg["revision"] = revision + 1
+        if not await _offload(_save_disk_config, cfg):
+            return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+    _notify_change(revision + 1, cfg)
+    return _saved_response(revision + 1)
+
+def _import_spooled(cfg: dict, spool, fmt: str, encoding: str, profile: str, replace: bool) -> dict:
+    """在工作线程中流式解析已落盘的上传文件并写入 cfg，返回逐行报告"""
+    try:
+        tz = ZoneInfo(str(cfg.get("timezone") or "Asia/Shanghai"))
+    except Exception:
+        tz = None
+    text = io.TextIOWrapper(spool, encoding=encoding, errors="replace", newline="")
+    try:
+        return routine_io.import_schedule(cfg, routine_io.parse_rows(text, fmt, tz), profile, replace)
+    finally:
+        text.detach()  # 临时文件由调用方关闭
+
+@app.post("/api/import")
+async def api_import():
+    """批量导入日程，请求体为 CSV 或 iCalendar 原文，返回逐行错误报告。
+    ?format=csv|ics（缺省按内容识别）&profile=&mode=merge|replace&encoding=utf-8&strict=1（有错误行时不写入）
+    上传内容逐块写入临时文件后再流式解析，内存占用与文件大小无关。
+    """
+    profile = _request_profile()
+    if not _PROFILE_RE.match(profile):
+        return jsonify({"ok": False, "error": "invalid_profile"}), 400
+    fmt = (request.args.get("format") or "").strip().lower()
+    if fmt and fmt not in routine_io.FORMATS:
+        return jsonify({"ok": False, "error": "unknown_format"}), 400
+    mode = (request.args.get("mode") or "merge").strip().lower()
+    if mode not in ("merge", "replace"):
+        return jsonify({"ok": False, "error": "invalid_mode"}), 400
+    encoding = (request.args.get("encoding") or "utf-8-sig").strip()
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return jsonify({"ok": False, "error": "unknown_encoding"}), 400
+    strict = request.args.get("strict") in ("1", "true")
+
+    with tempfile.TemporaryFile() as spool:
+        async for chunk in request.body:
+            spool.write(chunk)
+        if not spool.tell():
+            return jsonify({"ok": False, "error": "empty_body"}), 400
+        spool.seek(0)
+        if not fmt:
+            fmt = routine_io.detect_format(spool.read(64))
+            spool.seek(0)
+
+        async with _CONFIG_LOCK:
+            cfg = await _offload(_load_disk_config)
+            revision = _revision(cfg)
+            if not _if_match(revision):
+                return _revision_conflict(revision)
+            report = await asyncio.to_thread(
+                _import_spooled, cfg, spool, fmt, encoding, profile, mode == "replace"
+            )
+            if strict and report["error_count"]:
+                return jsonify({"ok": False, "error": "invalid_rows", "format": fmt, **report}), 422
+            cfg["revision"] = revision + 1
+            if not await _offload(_save_disk_config, cfg):
+                return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+    _notify_change(revision + 1, cfg)
+    validation = await _offload(_validate_schedule, _profile_schedule(cfg, profile))
+    resp = jsonify({"ok": True, "revision": revision + 1, "format": fmt, **report, "validation": validation})
+    resp.headers["ETag"] = _etag(revision + 1)
+    return resp
+
+@app.get("/api/export")
+async def api_export():
+    """导出日程（?format=csv|ics&profile=），逐段流式输出为附件"""
+    profile = _request_profile()
+    fmt = (request.args.get("format") or "csv").strip().lower()
+    if fmt not in routine_io.FORMATS:
+        return jsonify({"ok": False, "error": "unknown_format"}), 400
+    try:
+        cfg = (await _offload(_read_config_cached))[2]  # 只读，不修改共享的解析结果
+    except Exception:
+        cfg = INITIAL_CONFIG or {}
+    schedule = _profile_schedule(cfg, profile)
+    if schedule is None:
+        return jsonify({"ok": False, "error": "unknown_profile"}), 404
+
+    if fmt == "ics":
+        chunks = routine_io.export_ics(schedule, str(cfg.get("timezone") or "Asia/Shanghai"), profile)
+        mimetype = "text/calendar"
     else:
-        return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+        chunks = routine_io.export_csv(schedule)
+        mimetype = "text/csv"
+
+    async def body():
+        for chunk in chunks:
+            yield chunk.encode("utf-8")
+
+    resp = Response(body(), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = (
+        f'attachment; filename="routine.{fmt}"; filename*=UTF-8\'\'routine-{quote(profile)}.{fmt}'
+    )
+    return resp
+
+@app.post("/api/normalize")
+async def api_normalize():
+    """整理方案（?profile=）的周作息：丢弃无法解析与被遮挡的部分，合并首尾相接的相同行为。
+    查询结果不变；响应给出整理前后的时段数与整理后的校验结果。
+    """
+    profile = _request_profile()
+    async with _CONFIG_LOCK:
+        cfg = await _offload(_load_disk_config)
+        revision = _revision(cfg)
+        if not _if_match(revision):
+            return _revision_conflict(revision)
+        schedule = _profile_schedule(cfg, profile)
+        if schedule is None:
+            return jsonify({"ok": False, "error": "unknown_profile"}), 404
+        before, merged = await _offload(lambda: (len(_compile_schedule(schedule)), _merge_adjacent(schedule)))
+        schedule.clear()
+        schedule.update(merged)
+
+        cfg["revision"] = revision + 1
+        if not await _offload(_save_disk_config, cfg):
+            return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+    _notify_change(revision + 1, cfg)
+    return _saved_response(revision + 1, before=before, after=len(_compile_schedule(merged)),
+                           validation=await _offload(_validate_schedule, merged))
+
+@app.get("/api/revisions")
+async def api_revisions():
+    """修订历史（?limit=，默认 50，新的在前）；仅 SQLite 存储保留历史"""
+    if STORE is None:
+        return jsonify({"ok": False, "error": "history_unavailable"}), 404
+    try:
+        limit = max(1, min(int(request.args.get("limit") or 50), 1000))
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_limit"}), 400
+    revisions = await asyncio.to_thread(STORE.history, limit)
+    return jsonify({"ok": True, "revision": await _offload(STORE.revision), "revisions": revisions})
+
+@app.post("/api/rollback")
+async def api_rollback():
+    """回滚到 ?to= 指定的修订：以该修订的内容追加一个新修订，之后的历史仍然保留"""
+    if STORE is None:
+        return jsonify({"ok": False, "error": "history_unavailable"}), 404
+    try:
+        target = int(request.args.get("to") or "")
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_revision"}), 400
+    async with _CONFIG_LOCK:
+        revision = await _offload(STORE.revision)
+        if not _if_match(revision):
+            return _revision_conflict(revision)
+        if not 0 < target <= revision or not await _offload(STORE.has_revision, target):
+            return jsonify({"ok": False, "error": "unknown_revision"}), 404
+        try:
+            saved = await asyncio.to_thread(STORE.rollback, target, revision)
+        except Exception:
+            return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+        if saved is None:
+            return _revision_conflict(await _offload(STORE.revision))
+    _notify_change(saved)
+    return _saved_response(saved, restored=target)
+
+@app.get("/api/backup")
+async def api_backup():
+    """下载完整配置（routine_config.json 的格式，两种存储方式通用）"""
+    try:
+        _, raw, cfg = await _offload(_read_config_cached)
+    except Exception:
+        return jsonify({"ok": False, "error": "config_unavailable"}), 404
+    resp = Response(raw, mimetype="application/json")
+    resp.headers["Content-Disposition"] = f'attachment; filename="routine_config-r{_revision(cfg)}.json"'
+    return resp
+
+@app.post("/api/restore")
+async def api_restore():
+    """用完整配置（/api/backup 的内容或旧的 routine_config.json）整体替换当前配置，作为一个新修订保存"""
+    try:
+        payload = await request.get_json(force=True)
+    except Exception:
+        return jsonify({"ok": False, "error": "invalid_json"}), 400
+    if not isinstance(payload, dict) or not isinstance(payload.get("schedule", {}), dict):
+        return jsonify({"ok": False, "error": "invalid_config"}), 400
+    async with _CONFIG_LOCK:
+        revision = _revision(await _offload(_load_disk_config))
+        if not _if_match(revision):
+            return _revision_conflict(revision)
+        cfg = dict(payload)
+        cfg["revision"] = revision + 1
+        if not await _offload(_save_disk_config, cfg):
+            return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+    _notify_change(revision + 1, cfg)
+    return _saved_response(revision + 1, validation=await _offload(_validate_schedule, cfg.get("schedule") or {}))
+
+def _parse_instant(value: str, tz) -> datetime:
+    """ISO 8601 日期或日期时间；无时区的按配置时区理解"""
+    dt = datetime.fromisoformat(value.strip())
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=tz)
+
+async def _timeline_segments(resolver: _BatchResolver, tz, start: float, stop: float, step: int):
+    """按 step 秒采样 [start, stop)，分批批量解析，把相同结果的相邻采样合并为区段逐条产出"""
+    current, since = None, start
+    t = start
+    while t < stop:
+        stamps = [t + i * step for i in range(min(_TIMELINE_CHUNK, int((stop - t - 1) // step) + 1))]
+        for ts, label in zip(stamps, resolver.resolve_many(stamps, tz)):
+            if label != current:
+                if current is not None:
+                    yield since, ts, current
+                current, since = label, ts
+        t = stamps[-1] + step
+        await asyncio.sleep(0)  # 每批之间让出事件循环
+    if current is not None:
+        yield since, stop, current
+
+def _timeline_resolver(schedule: dict, overrides) -> _BatchResolver:
+    table = _compile_schedule(schedule)
+    dates = _DateIndex(overrides)
+    return _BatchResolver(table, _WeekIndex(table), dates if dates else None)
+
+@app.get("/api/timeline")
+async def api_timeline():
+    """预览方案（?profile=）在一段时间内的行为：?from=&to=（ISO 8601，缺省为此刻起 7 天）&step=（采样间隔秒数，默认 60）。
+    以 NDJSON 流式输出区段 {"from", "to", "action", "range"}，逐批解析，不在内存中构建完整列表；
+    区段边界精确到采样间隔，日期覆盖优先于每周作息。
+    """
+    profile = _request_profile()
+    try:
+        cfg = (await _offload(_read_config_cached))[2]  # 只读，不修改共享的解析结果
+    except Exception:
+        cfg = INITIAL_CONFIG or {}
+    holder = _profile_holder(cfg, profile)
+    schedule = _profile_schedule(cfg, profile)
+    if schedule is None:
+        return jsonify({"ok": False, "error": "unknown_profile"}), 404
+    try:
+        tz = ZoneInfo(str(cfg.get("timezone") or "Asia/Shanghai"))
+    except Exception:
+        tz = None
+    try:
+        start = _parse_instant(request.args["from"], tz) if request.args.get("from") else \
+            datetime.now(tz).replace(second=0, microsecond=0)
+        stop = _parse_instant(request.args["to"], tz) if request.args.get("to") else start + timedelta(days=7)
+        step = int(request.args.get("step") or 60)
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_range"}), 400
+    if step < 60 or stop <= start:
+        return jsonify({"ok": False, "error": "invalid_range"}), 400
+    if stop - start > _TIMELINE_MAX_SPAN:
+        return jsonify({"ok": False, "error": "range_too_large"}), 400
+
+    resolver = await _offload(_timeline_resolver, schedule, holder.get("overrides"))
+
+    async def body():
+        async for since, until, (action, raw_range) in _timeline_segments(
+                resolver, tz, start.timestamp(), stop.timestamp(), step):
+            yield (json.dumps({
+                "from": datetime.fromtimestamp(since, tz).isoformat(timespec="seconds"),
+                "to": datetime.fromtimestamp(until, tz).isoformat(timespec="seconds"),
+                "action": action,
+                "range": raw_range,
+            }, ensure_ascii=False) + "\n").encode("utf-8")
+
+    return Response(body(), mimetype="application/x-ndjson")
+
+@app.get("/api/events")
+async def api_events():
+    """Server-Sent Events：推送方案（?profile=）的配置变化与当前区段。
+    event: config  {"revision", "days": [变化的天], "exists"}（连接时先发一次当前修订号）
+    event: slot    {"action", "range", "at"}（连接时先发一次，之后在区段切换时推送）
+    event: resync  推送积压，客户端应整体重新加载
+    所有连接共享一个监视任务，空闲连接只占一个等待中的队列，每 25 秒一次心跳注释。
+    """
+    global _EVENTS_TASK, _EVENTS_WAKE
+    profile = _request_profile()
+    _, cfg = await _offload(_current_config)
+    watch = _ProfileWatch(cfg, profile)
+    queue: asyncio.Queue = asyncio.Queue(_EVENTS_QUEUE)
+    _publish(queue, "config", {"revision": _revision(cfg), "days": [], "exists": watch.schedule is not None})
+    _publish(queue, "slot", watch.current_slot(_config_tz(cfg), time.time()))
+    _SUBSCRIBERS[queue] = profile
+    if _EVENTS_WAKE is None:
+        _EVENTS_WAKE = asyncio.Event()
+    if _EVENTS_TASK is None:
+        _EVENTS_TASK = asyncio.get_running_loop().create_task(_watch_events())
+
+    async def stream():
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), _EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+        finally:
+            _SUBSCRIBERS.pop(queue, None)
+
+    resp = Response(stream(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"  # 反向代理不要缓冲
+    resp.timeout = None  # 长连接，不受 Quart 默认的响应超时限制
+    return resp
+
+@app.put("/api/overrides")
+async def api_put_overrides():
+    """整体替换方案（?profile=）的日期覆盖列表，已过期的项顺带丢弃。请求体：
+    [{"date": "2025-10-01", "to": "2025-10-07", "action": "国庆假期"},
+     {"date": "2025-12-24", "slots": {"19:00-23:00": "圣诞聚会"}}]
+    只写 action 的覆盖整天；带 slots 的默认与每周作息叠加，"replace": true 时当天只保留 slots。
+    """
+    profile = _request_profile()
+    if not _PROFILE_RE.match(profile):
+        return jsonify({"ok": False, "error": "invalid_profile"}), 400
+    try:
+        payload = await request.get_json()
+    except Exception:
+        return jsonify({"ok": False, "error": "invalid_json"}), 400
+    if not isinstance(payload, list):
+        return jsonify({"ok": False, "error": "invalid_json"}), 400
+    errors = _override_issues(payload)
+    if errors:
+        return jsonify({"ok": False, "error": "invalid_overrides", "errors": errors}), 400
+
+    async with _CONFIG_LOCK:
+        cfg = await _offload(_load_disk_config)
+        revision = _revision(cfg)
+        if not _if_match(revision):
+            return _revision_conflict(revision)
+        try:
+            tz = ZoneInfo(str(cfg.get("timezone") or "Asia/Shanghai"))
+        except Exception:
+            tz = None
+        _profile_schedule(cfg, profile, create=True)
+        _profile_holder(cfg, profile)["overrides"] = _prune_overrides(payload, datetime.now(tz).date())
+
+        cfg["revision"] = revision + 1
+        if not await _offload(_save_disk_config, cfg):
+            return jsonify({"ok": False, "error": "write_disk_failed"}), 500
+    _notify_change(revision + 1, cfg)
+    return _saved_response(revision + 1)
+
+@app.get("/api/metrics")
+async def api_metrics():
+    """以 Prometheus 文本格式导出插件运行指标"""
+    snapshot = await _fetch_metrics()
+    if snapshot is None:
+        return Response("# plugin metrics unavailable\n", status=503, mimetype="text/plain")
+    return Response(_render_prometheus(snapshot), mimetype="text/plain; version=0.0.4")
 
 # ==================== 启动逻辑 ====================
 
-async def start_server(cfg: dict):
-    global SERVER_LOGIN_KEY, STORAGE_PATH, INITIAL_CONFIG, ONE_TIME_KEY, KEY_EXPIRES_AT
+def _bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """预先绑定并监听端口：端口冲突立即报错；监听成功后新连接在 backlog 中排队，即可视为就绪"""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        if os.name != "nt":  # Windows 下 SO_REUSEADDR 允许抢占他人端口，不启用
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+async def start_server(cfg: dict, shutdown_trigger=None):
+    """启动 WebUI。独立进程模式由 run_server 调用；进程内模式由插件作为任务运行，
+    并传入 shutdown_trigger 控制关闭。监听成功后向插件发送 ("ready", 端口)，失败发送 ("error", 原因)。
+    """
+    global SERVER_LOGIN_KEY, STORAGE_PATH, STORE, INITIAL_CONFIG, ONE_TIME_KEY, KEY_EXPIRES_AT, NOTIFY_CONN, PLUGIN_HOOKS, METRICS_TOKEN
+    global _CONFIG_CACHE
     
     # 从 main.py 传入的参数初始化
     SERVER_LOGIN_KEY = cfg.get("server_key", "")
     STORAGE_PATH = cfg.get("storage_path")
+    STORE = RoutineStore(cfg["store_path"]) if cfg.get("store_path") else None
+    _CONFIG_CACHE = None
     INITIAL_CONFIG = cfg.get("plugin_config", {})
     ONE_TIME_KEY = cfg.get("one_time_key", True)
+    NOTIFY_CONN = cfg.get("notify_conn")
+    PLUGIN_HOOKS = cfg.get("plugin_hooks")
+    METRICS_TOKEN = str(cfg.get("metrics_token", "") or "")
     
     # 设置过期时间
     ttl = int(cfg.get("key_ttl_seconds", 600))
@@ -198,17 +1187,43 @@ async def start_server(cfg: dict):
     # 确保 assets 目录存在
     os.makedirs(ASSETS_DIR, exist_ok=True)
 
-    # Hypercorn 配置
+    # Hypercorn 配置（端口为 0 时由系统分配，就绪信号中回报实际端口）
     port = int(cfg.get("webui_port", 58101))
     host = str(cfg.get("host", "0.0.0.0"))
     
     hc_cfg = Config()
-    hc_cfg.bind = [f"{host}:{port}"]
     hc_cfg.graceful_timeout = 2
-    hc_cfg.worker_class = "asyncio"
-    
-    await hypercorn.asyncio.serve(app, hc_cfg)
+    hc_cfg.worker_class = _worker_class(cfg)
+    hc_cfg.keep_alive_timeout = float(cfg.get("keep_alive_timeout") or _KEEP_ALIVE_TIMEOUT)
+    hc_cfg.backlog = int(cfg.get("backlog") or _BACKLOG)
+
+    try:
+        try:
+            sock = _bind_socket(host, port, hc_cfg.backlog)
+        except OSError as e:
+            _send_to_plugin(("error", str(e)))
+            return
+        port = sock.getsockname()[1]
+        hc_cfg.bind = [f"fd://{sock.detach()}"]
+        _send_to_plugin(("ready", port))
+
+        await hypercorn.asyncio.serve(app, hc_cfg, shutdown_trigger=shutdown_trigger)
+    finally:
+        # 服务停止（含进程内模式下任务被取消）后关闭存储的全部连接
+        if STORE is not None:
+            STORE.close()
+            STORE = None
+
+def _worker_class(cfg: dict) -> str:
+    """事件循环实现：asyncio（默认）或 uvloop（需安装，且只在独立进程模式下生效）"""
+    name = str(cfg.get("worker_class") or "asyncio").strip()
+    if name not in _WORKER_CLASSES or (name == "uvloop" and uvloop is None):
+        return "asyncio"
+    return name
 
 def run_server(cfg: dict):
     """入口函数，由 multiprocess 调用"""
-    asyncio.run(start_server(cfg))
\ No newline at end of file
+    if _worker_class(cfg) == "uvloop":
+        uvloop.run(start_server(cfg))
+    else:
+        asyncio.run(start_server(cfg))